@@ -1,16 +1,52 @@
-from flask import Flask, request, jsonify, g
-from config import DATABASE, DEBUG, PROFILE_DIR
+from flask import Flask, request, jsonify
+from config import (
+    DATABASE, DB_BUSY_TIMEOUT, DB_SYNCHRONOUS, DEBUG,
+    PROFILE_DIR, PROFILE_CHECK_INTERVAL,
+    EVENT_BATCH_SIZE, EVENT_FLUSH_SECONDS,
+    DOWNLOAD_CONCURRENCY, TRANSFER_MODE, STREAM_UPLOAD, DOWNLOAD_VERIFY_HASH,
+    TRANSFER_RETRIES, TRANSFER_RETRY_BACKOFF, TRANSFER_CHUNK_SIZE, TRANSFER_RESUME_THRESHOLD,
+    COMPRESSION, COMPRESSION_LEVEL, COMPRESSION_STORE_EXTENSIONS, ZIP_WORKERS, ZIP_CHUNK_SIZE,
+    HASH_BUFFER_SIZE, DIGEST_CACHE_ENTRIES,
+    DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES, DOWNLOAD_CACHE_HASH,
+    PIPELINE_STAGES, PIPELINE_QUEUE_FILES,
+    JOB_WORKERS, JOB_PIPELINE_DEPTH, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_POLL_MIN_SECONDS, JOB_POLL_MAX_SECONDS,
+    PROGRESS_WRITE_SECONDS, JOB_STATUS_MAX_WAIT_SECONDS, JOB_STATUS_MAX_WAITERS,
+    JOB_PRIORITY_LIMIT, JOB_STARVATION_SECONDS, JOB_MAX_RUNNING_PER_PROFILE,
+    JOB_PROFILER, JOB_PROFILER_INTERVAL, JOB_PROFILER_DIR,
+    ADMISSION_IP_PER_MINUTE, ADMISSION_KEY_PER_MINUTE, ADMISSION_BURST,
+    MAX_PENDING_JOBS, ADMISSION_PENDING_REFRESH_SECONDS, ADMISSION_QUEUE_RETRY_AFTER,
+    MAX_FILES_PER_JOB, MAX_REQUEST_BYTES, BULK_SUBMIT_MAX_JOBS, BULK_SUBMIT_CHUNK, MAX_BULK_REQUEST_BYTES,
+    WORKSPACE_ROOT, WORKSPACE_DISK_BUDGET, WORKSPACE_DISK_RESERVE,
+    RETENTION_INTERVAL_SECONDS, RETENTION_POLICIES, RETENTION_BATCH_ROWS, RETENTION_BATCH_PAUSE,
+    RETENTION_ARCHIVE_DIR, RETENTION_VACUUM_PAGES,
+)
 import sqlite3
 import os
 import zipfile
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import subprocess
 import threading
 import time
 import json
 import tempfile
+import types
+import shutil
 from dotenv import load_dotenv
 import hashlib
+import datetime
+import atexit
+import socket
+import itertools
+import collections
+import math
+import gzip
+import bisect
+import contextlib
+import multiprocessing
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from parallel_zip import ParallelZipWriter
 
 # Globals
 app = Flask(__name__)
@@ -20,36 +56,183 @@ load_dotenv()
 
 path_profiles = os.path.join(os.getcwd(), PROFILE_DIR)
 
+def parse_operation_profile(path):
+    """Parse and validate a profile file; raises ValueError describing the first problem found."""
+    op_name, op_path_up, op_path_down = None, None, None
+    op_options = {}
+
+    with open(path, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            key, separator, value = line.partition('=')
+            if not separator:
+                raise ValueError(f"line {line_number}: expected KEY=VALUE")
+
+            if key == "NAME":
+                op_name = value
+            elif key == "PATH_DOWN":
+                op_path_down = value
+            elif key == "PATH_UP":
+                op_path_up = value
+            elif key == "CONCURRENCY":
+                op_options['concurrency'] = max(1, int(value))
+            elif key == "TRANSFER_MODE":
+                if value.lower() not in ('batch', 'parallel'):
+                    raise ValueError(f"line {line_number}: TRANSFER_MODE must be 'batch' or 'parallel'")
+                op_options['transfer_mode'] = value.lower()
+            elif key == "STREAM_UPLOAD":
+                op_options['stream_upload'] = value.lower() in ('1', 'true', 'yes')
+            elif key == "COMPRESSION":
+                op_options['compression'] = value.lower()
+            elif key == "COMPRESSION_LEVEL":
+                op_options['compression_level'] = int(value)
+            elif key == "RETRIES":
+                op_options['retries'] = max(0, int(value))
+            elif key == "RETRY_BACKOFF":
+                op_options['retry_backoff'] = float(value)
+            elif key == "MULTI_THREAD_STREAMS":
+                op_options['multi_thread_streams'] = max(0, int(value))
+            elif key == "CHUNK_SIZE":
+                op_options['chunk_size'] = parse_size(value)
+            elif key == "RESUME_THRESHOLD":
+                op_options['resume_threshold'] = parse_size(value)
+            elif key == "BWLIMIT":
+                op_options['bwlimit'] = value
+            else:
+                raise ValueError(f"line {line_number}: unknown key '{key}'")
+
+    if not (op_name and op_path_down and op_path_up):
+        raise ValueError("NAME, PATH_DOWN and PATH_UP are required")
+
+    return OperationProfile(op_name, op_path_down, op_path_up, **op_options)
+
+# Holds every operation profile in memory, indexed by name. The profiles directory is parsed
+# once and re-parsed only when a background check sees its files change (or on reload()),
+# so lookups on the request path are a dict access with no filesystem I/O.
+class ProfileRegistry:
+    def __init__(self, directory, check_interval):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.profiles = None
+        self.snapshot = None
+        self.watcher = None
+        # Metrics
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self.reloads = 0
+        self.last_load_seconds = 0.0
+        self.errors = {}
+
+    def get(self, name):
+        started = time.perf_counter()
+        if self.profiles is None:
+            self.reload()
+        profile = self.profiles.get(name)
+        self.lookups += 1
+        self.lookup_seconds += time.perf_counter() - started
+        return profile
+
+    def names(self):
+        if self.profiles is None:
+            self.reload()
+        return sorted(self.profiles)
+
+    def scan(self):
+        # mtimes of the directory tree and every profile file; any change means a reload
+        snapshot = {}
+        for root, _, files in os.walk(self.directory):
+            snapshot[root] = os.stat(root).st_mtime_ns
+            for file in files:
+                if file.endswith(".txt"):
+                    path = os.path.join(root, file)
+                    snapshot[path] = os.stat(path).st_mtime_ns
+        return snapshot
+
+    def reload(self):
+        with self.lock:
+            started = time.perf_counter()
+            snapshot = self.scan()
+            profiles, errors = {}, {}
+
+            for path in sorted(p for p in snapshot if p.endswith(".txt")):
+                try:
+                    profile = parse_operation_profile(path)
+                except (OSError, ValueError) as e:
+                    errors[path] = str(e)
+                    Logger().log_error(f"Invalid operation profile '{path}': {e}")
+                    continue
+
+                if profile.name in profiles:
+                    errors[path] = f"duplicate profile name '{profile.name}'"
+                    Logger().log_error(f"Ignoring duplicate operation profile '{profile.name}' in '{path}'")
+                    continue
+                profiles[profile.name] = profile
+
+            self.profiles, self.snapshot, self.errors = profiles, snapshot, errors
+            self.reloads += 1
+            self.last_load_seconds = time.perf_counter() - started
+            self.start_watcher()
+
+    def reload_if_changed(self):
+        if self.scan() != self.snapshot:
+            self.reload()
+            return True
+        return False
+
+    def start_watcher(self):
+        if self.check_interval > 0 and (self.watcher is None or not self.watcher.is_alive()):
+            self.watcher = threading.Thread(target=self.watch, name="profile-watcher", daemon=True)
+            self.watcher.start()
+
+    def watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.reload_if_changed()
+            except OSError as e:
+                Logger().log_error(f"Failed to check operation profiles: {e}")
+
+    def stats(self):
+        return {
+            'profiles': len(self.profiles or {}),
+            'lookups': self.lookups,
+            'lookup_seconds_total': self.lookup_seconds,
+            'reloads': self.reloads,
+            'last_load_seconds': self.last_load_seconds,
+            'errors': self.errors,
+        }
+
+profile_registry = ProfileRegistry(path_profiles, PROFILE_CHECK_INTERVAL)
+
 def get_operation_profile_by_name(name):
-    for root, _, files in os.walk(path_profiles):
-        for file in files:
-            if file.endswith(".txt"):
-                # Read the file and fetch the key-value pair
-                with open(os.path.join(root, file), 'r') as file:
-
-                    op_name, op_path_up, op_path_down = None, None, None
-
-                    for line in file:
-                        key, value = line.strip().split('=')
-
-                        if key == "NAME":
-                            op_name = value
-                        elif key == "PATH_DOWN":
-                            op_path_down = value
-                        elif key == "PATH_UP":
-                            op_path_up = value
-                    
-                    if op_name == name:
-                        if op_path_up and op_path_down:
-                            return OperationProfile(op_name, op_path_down, op_path_up)
-    return None
+    return profile_registry.get(name)
+
+def connect_db():
+    db = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT)
+    db.row_factory = sqlite3.Row
+    # WAL (set in init_db) keeps readers and the single writer out of each other's way;
+    # NORMAL only fsyncs at checkpoints, which is still safe from corruption in WAL mode
+    db.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+    return db
+
+# One connection per thread per database file, reused across requests and jobs
+db_local = threading.local()
+
+def thread_db():
+    connections = getattr(db_local, 'connections', None)
+    if connections is None:
+        connections = db_local.connections = {}
+    if DATABASE not in connections:
+        connections[DATABASE] = connect_db()
+    return connections[DATABASE]
 
 def get_db():
     try:
-        if 'db' not in g:
-            g.db = sqlite3.connect(DATABASE)
-            g.db.row_factory = sqlite3.Row
-        return g.db
+        return thread_db()
     except sqlite3.Error as e:
         # Handle the error or log it
         print(f"Database error: {e}")
@@ -57,16 +240,321 @@ def get_db():
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    # The connection outlives the request; just make sure no transaction is left open on it
+    db = getattr(db_local, 'connections', {}).get(DATABASE)
+    if db is not None and db.in_transaction:
+        db.rollback()
 
 def init_db():
-    with app.app_context():
-        db = get_db()
+    # A connection of its own, closed again: wsgi.py runs this in the uWSGI master before the
+    # workers are forked, and an SQLite connection must not be used on both sides of a fork
+    db = connect_db()
+    try:
+        if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Lets retention hand freed pages back to the filesystem a few at a time. Only takes
+            # effect on a new database, before the WAL switch writes its header; an existing one
+            # needs a full VACUUM, which blocks every writer while it runs, so that is left to
+            # `flask --app app vacuum-db`.
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table'").fetchone():
+                print(f"Database '{DATABASE}' does not use incremental auto-vacuum; retention will not shrink the file "
+                      f"until 'flask --app app vacuum-db' is run during a maintenance window")
+        # Persistent: every later connection to the file uses the write-ahead log
+        db.execute('PRAGMA journal_mode = WAL')
+        migrate_db(db)
         with app.open_resource('schema.sql', mode='r') as f:
             db.cursor().executescript(f.read())
         db.commit()
+    finally:
+        db.close()
+
+@app.cli.command('vacuum-db')
+def vacuum_db_command():
+    """Switch an existing database to incremental auto-vacuum with a one-off full VACUUM."""
+    db = connect_db()
+    try:
+        convert_to_incremental_vacuum(db)
+    finally:
+        db.close()
+
+def convert_to_incremental_vacuum(db):
+    """Rewrite the database with auto_vacuum = INCREMENTAL; returns True if it was converted."""
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        print(f"Database '{DATABASE}' already uses incremental auto-vacuum")
+        return False
+
+    size = db.execute('PRAGMA page_count').fetchone()[0] * db.execute('PRAGMA page_size').fetchone()[0]
+    print(f"Running VACUUM on '{DATABASE}' ({size} bytes); writers wait until it finishes")
+    started = time.monotonic()
+    db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    try:
+        db.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        print(f"VACUUM of '{DATABASE}' failed after {time.monotonic() - started:.1f}s: {e}")
+        raise
+    size = db.execute('PRAGMA page_count').fetchone()[0] * db.execute('PRAGMA page_size').fetchone()[0]
+    print(f"VACUUM of '{DATABASE}' finished in {time.monotonic() - started:.1f}s ({size} bytes)")
+    return True
+
+# Columns added to existing tables after their first release, as (table, column, definition)
+MIGRATION_COLUMNS = [
+    ('jobs', 'worker_id', 'TEXT'),
+    ('jobs', 'lease_expires', 'DATETIME'),
+    ('jobs', 'attempts', 'INTEGER DEFAULT 0'),
+    ('jobs', 'phase', 'TEXT'),
+    ('jobs', 'files_total', 'INTEGER DEFAULT 0'),
+    ('jobs', 'files_done', 'INTEGER DEFAULT 0'),
+    ('jobs', 'bytes_transferred', 'INTEGER DEFAULT 0'),
+    ('jobs', 'progress_updated', 'DATETIME'),
+    ('jobs', 'file_progress', 'TEXT'),
+    ('jobs', 'priority', 'INTEGER DEFAULT 0'),
+    ('jobs', 'profile', 'TEXT'),
+    ('jobs', 'size_estimate', 'INTEGER DEFAULT 0'),
+    ('jobs', 'size_bytes', 'INTEGER'),
+    ('jobs', 'workspace_bytes', 'INTEGER'),
+    ('jobs', 'workspace_reserved', 'INTEGER'),
+    ('jobs', 'downloaded_bytes', 'INTEGER DEFAULT 0'),
+]
+
+def migrate_db(db):
+    # Bring databases created by older releases up to the current schema.sql,
+    # which is applied afterwards and creates any missing tables and indexes
+    for table, column, definition in MIGRATION_COLUMNS:
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            continue  # New database; schema.sql creates the table with every column
+        existing = {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+        if column not in existing:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+# Cumulative-bucket histogram in the Prometheus sense; bucket i counts values <= bounds[i]
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# In-process histograms, counters and gauges, rendered in the Prometheus text format by /metrics.
+# Recording is a dict lookup and a few additions under one lock, so it is cheap enough to wrap
+# every phase, rclone call and database write; series are keyed by (name, sorted labels).
+class Metrics:
+    SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+    BYTES_BUCKETS = tuple(1024 * 4 ** n for n in range(15))  # 1 KiB to 256 GiB
+    THROUGHPUT_BUCKETS = tuple(64 * 1024 * 2 ** n for n in range(16))  # 64 KiB/s to 2 GiB/s
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def adjust(self, name, delta, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def record_phase(self, phase, profile, seconds, size=None):
+        """Duration of one FileOps phase, plus the bytes it moved and their throughput when known."""
+        self.observe('damzipper_phase_seconds', seconds, phase=phase, profile=profile)
+        if size is not None:
+            self.observe('damzipper_phase_bytes', size, self.BYTES_BUCKETS, phase=phase, profile=profile)
+            if seconds > 0 and size > 0:
+                self.observe('damzipper_phase_throughput_bytes_per_second', size / seconds, self.THROUGHPUT_BUCKETS,
+                             phase=phase, profile=profile)
+
+    @contextlib.contextmanager
+    def phase(self, phase, profile):
+        """Time a block as `phase`; the block may set .bytes on the yielded object."""
+        timing = types.SimpleNamespace(bytes=None)
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            self.record_phase(phase, profile, time.perf_counter() - started, timing.bytes)
+
+    def totals(self, name):
+        """[(labels, count, sum)] for every series of histogram `name`."""
+        with self.lock:
+            return [(dict(labels), histogram.count, histogram.sum)
+                    for (series, labels), histogram in self.histograms.items() if series == name]
+
+    def render(self, extra=()):
+        """Every series in the Prometheus text format; `extra` adds (name, type, labels, value) read at scrape time."""
+        with self.lock:
+            histograms = [(key, histogram.bounds, list(histogram.counts), histogram.sum, histogram.count)
+                          for key, histogram in self.histograms.items()]
+            series = [(key, 'counter', value) for key, value in self.counters.items()]
+            series += [(key, 'gauge', value) for key, value in self.gauges.items()]
+        series += [(self.key(name, labels), kind, value) for name, kind, labels, value in extra]
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), bounds, counts, total, count in sorted(histograms, key=lambda histogram: histogram[0]):
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", format_number(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_number(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+        for (name, labels), kind, value in sorted(series, key=lambda item: item[0]):
+            declare(name, kind)
+            lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+metrics = Metrics()
+
+# Buffers job events in memory and writes them from a background thread in batched
+# transactions, so file operations never wait on an fsync per event
+class EventSink:
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.condition = threading.Condition()
+        self.queue = []
+        self.queued = 0  # Sequence number of the last queued event
+        self.written = 0  # Sequence number of the last event known to be on disk
+        self.flush_requested = False
+        self.thread = None
+        # Metrics
+        self.flushes = 0
+        self.flush_failures = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    def emit(self, job_id, message):
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self.condition:
+            self.queue.append((job_id, timestamp, message))
+            self.queued += 1
+            if len(self.queue) >= self.batch_size:
+                self.condition.notify_all()
+            self.start()
+
+    def flush(self, timeout=30):
+        """Block until every event queued before this call has been written."""
+        with self.condition:
+            target = self.queued
+            if self.written >= target:
+                return True
+            self.flush_requested = True
+            self.start()
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.written >= target, timeout)
+
+    def start(self):
+        # Called with the condition held
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="event-sink", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.flush_requested or len(self.queue) >= self.batch_size, self.flush_interval)
+                batch, self.queue = self.queue, []
+                self.flush_requested = False
+                batch_end = self.queued
+
+            if batch:
+                self.write(batch, batch_end)
+            else:
+                with self.condition:
+                    self.written = max(self.written, batch_end)
+                    self.condition.notify_all()
+
+    def write(self, batch, batch_end):
+        started = time.perf_counter()
+        try:
+            db = thread_db()
+            with db:
+                db.executemany('''
+                    INSERT INTO events (job_id, timestamp, message)
+                    VALUES (?, ?, ?)
+                    ''', batch)
+        except sqlite3.Error as e:
+            print(f"ERROR: Failed to write {len(batch)} job events: {e}")
+            with self.condition:
+                # Put them back in front of anything queued since and retry on the next pass
+                self.queue = batch + self.queue
+                self.flush_failures += 1
+            time.sleep(self.flush_interval)
+            return
+
+        elapsed = time.perf_counter() - started
+        metrics.observe('damzipper_db_seconds', elapsed, operation='events_flush')
+        with self.condition:
+            self.written = max(self.written, batch_end)
+            self.flushes += 1
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'queue_depth': len(self.queue),
+                'flushes': self.flushes,
+                'flush_failures': self.flush_failures,
+                'flush_seconds_total': self.flush_seconds_total,
+                'flush_seconds_max': self.flush_seconds_max,
+            }
+
+event_sink = EventSink(EVENT_BATCH_SIZE, EVENT_FLUSH_SECONDS)
+atexit.register(event_sink.flush, 5)
 
 # Logger class
 class Logger:
@@ -92,40 +580,56 @@ class Logger:
     def log_request(self, source_ip=None, user_agent=None, method=None, request_url=None, request_raw=None):
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO requests (source_ip, user_agent, method, request_url, request_raw) 
-            VALUES (?, ?, ?, ?, ?)
-            """, (source_ip, user_agent, method, request_url, request_raw))
-        db.commit()
+        with metrics.timer('damzipper_db_seconds', operation='log_request'):
+            cursor.execute("""
+                INSERT INTO requests (source_ip, user_agent, method, request_url, request_raw)
+                VALUES (?, ?, ?, ?, ?)
+                """, (source_ip, user_agent, method, request_url, request_raw))
+            db.commit()
         return cursor.lastrowid  # Return the ID of the inserted request
     
-    def update_log_request_response_status(self, request_id, response_status):
+    def update_log_request_response_status(self, request_id, response_status, drop_raw=False):
+        # drop_raw: the payload was stored on the job it created, so the request needn't keep a copy
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("""
-            UPDATE requests SET response_status = ? WHERE id = ?
-            """, (response_status, request_id))
-        db.commit()
+        with metrics.timer('damzipper_db_seconds', operation='log_response_status'):
+            cursor.execute("""
+                UPDATE requests SET response_status = ?, request_raw = CASE WHEN ? THEN NULL ELSE request_raw END
+                WHERE id = ?
+                """, (response_status, drop_raw, request_id))
+            db.commit()
         return cursor.rowcount  # Return the number of rows updated
 
-    def create_job_record(self, request_id, message):
+    def create_job_record(self, request_id, message, priority=0, profile=None, size_estimate=0):
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO jobs (request_id, message, status) 
-            VALUES (?, ?, 'pending')
-            """, (request_id, message))
-        db.commit()
+        with metrics.timer('damzipper_db_seconds', operation='create_job'):
+            cursor.execute("""
+                INSERT INTO jobs (request_id, message, status, priority, profile, size_estimate)
+                VALUES (?, ?, 'pending', ?, ?, ?)
+                """, (request_id, message, priority, profile, size_estimate))
+            db.commit()
         return cursor.lastrowid  # Return the ID of the inserted job
 
-    def log_job(self, job_id, message):
+    def create_job_records(self, rows):
+        """Insert (request_id, message, priority, profile, size_estimate) rows in one transaction; returns their ids."""
         db = get_db()
-        with db:
-            db.execute("""
-                INSERT INTO events (job_id, message) 
-                VALUES (?, ?)
-                """, (job_id, message))
-            db.commit()
+        with metrics.timer('damzipper_db_seconds', operation='create_jobs'), db:
+            db.executemany("""
+                INSERT INTO jobs (request_id, message, status, priority, profile, size_estimate)
+                VALUES (?, ?, 'pending', ?, ?, ?)
+                """, rows)
+            # AUTOINCREMENT hands out consecutive ids within a single write transaction
+            last_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+
+    def log_job(self, job_id, message):
+        # Buffered; written in batches by the event sink
+        event_sink.emit(job_id, message)
+
+    def flush_job_events(self):
+        if not event_sink.flush():
+            self.log_error("Timed out waiting for job events to be written")
 
 # Job class
 class Job:
@@ -134,53 +638,871 @@ class Job:
         self.file_ops = file_ops
         self.operation_profile = operation_profile
 
+# Picks the zip compression for each entry: already-compressed media is stored as-is,
+# everything else gets the profile's method and level
+class CompressionPolicy:
+    METHODS = {
+        'store': zipfile.ZIP_STORED,
+        'deflate': zipfile.ZIP_DEFLATED,
+        'bzip2': zipfile.ZIP_BZIP2,
+        'lzma': zipfile.ZIP_LZMA,
+    }
+
+    # Leading bytes of formats that are already compressed
+    SIGNATURES = (
+        (0, b'\xff\xd8\xff'),          # JPEG
+        (0, b'\x89PNG\r\n\x1a\n'),     # PNG
+        (0, b'GIF8'),                   # GIF
+        (0, b'PK\x03\x04'),             # ZIP / Office documents
+        (0, b'\x1f\x8b'),               # gzip
+        (0, b'7z\xbc\xaf\x27\x1c'),     # 7-Zip
+        (0, b'ID3'),                    # MP3
+        (0, b'fLaC'),                   # FLAC
+        (0, b'OggS'),                   # Ogg
+        (0, b'%PDF'),                   # PDF
+        (0, b'\x1aE\xdf\xa3'),          # Matroska / WebM
+        (4, b'ftyp'),                   # MP4 / MOV / M4A / HEIC
+    )
+
+    def __init__(self, method=COMPRESSION, level=COMPRESSION_LEVEL, store_extensions=COMPRESSION_STORE_EXTENSIONS):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown compression method '{method}'")
+        self.method = method
+        self.level = level
+        self.store_extensions = {ext.lower() for ext in store_extensions}
+
+    def choose(self, file_path):
+        """Return (compress_type, compresslevel, label) for a file."""
+        if self.method == 'store' or self.is_precompressed(file_path):
+            return zipfile.ZIP_STORED, None, 'store'
+        # lzma has no level setting in zipfile
+        level = None if self.method == 'lzma' else self.level
+        label = self.method if level is None else f"{self.method}-{level}"
+        return self.METHODS[self.method], level, label
+
+    def is_precompressed(self, file_path):
+        if os.path.splitext(file_path)[1].lower() in self.store_extensions:
+            return True
+        try:
+            with open(file_path, 'rb') as f:
+                head = f.read(16)
+        except OSError:
+            return False
+        return any(head[offset:offset + len(magic)] == magic for offset, magic in self.SIGNATURES)
+
+# Process pool shared by every job's parallel zip; started on first use. Forking a server full of
+# threads can hand a child a lock some other thread held at that moment, and the workers only
+# need parallel_zip, so they are started from a clean forkserver (spawn where there is none)
+zip_executor = None
+zip_executor_lock = threading.Lock()
+ZIP_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+def get_zip_executor():
+    global zip_executor
+    with zip_executor_lock:
+        if zip_executor is None:
+            zip_executor = ProcessPoolExecutor(max_workers=ZIP_WORKERS, mp_context=multiprocessing.get_context(ZIP_START_METHOD))
+            atexit.register(zip_executor.shutdown)
+        return zip_executor
+
+# On-disk cache of downloaded source files, keyed by remote identity (profile, path, size,
+# modtime and hash when available). Files are hardlinked into job workspaces and the
+# least recently used ones are evicted once the cache grows past its byte budget.
+class DownloadCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, profile_name, remote_file, entry):
+        identity = json.dumps([profile_name, remote_file, entry.get('Size'), entry.get('ModTime'), entry.get('Hashes')], sort_keys=True)
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, destination_file_path):
+        """Link a cached file into place; returns False on a miss."""
+        cache_path = self.path(key)
+        try:
+            link_or_copy(cache_path, destination_file_path)
+            os.utime(cache_path)  # Mark as recently used
+            return True
+        except FileNotFoundError:
+            return False
+
+    def store(self, key, source_file_path):
+        cache_path = self.path(key)
+        temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            link_or_copy(source_file_path, temp_path)
+            os.replace(temp_path, cache_path)
+            # rclone kept the remote's modtime on the file; eviction goes by last use
+            os.utime(cache_path)
+        except OSError as e:
+            Logger().log_error(f"Failed to cache '{source_file_path}': {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self):
+        """Delete least recently used files until the cache fits its byte budget."""
+        with self.lock:
+            entries, total = [], 0
+            for root, _, files in os.walk(self.directory):
+                for file in files:
+                    try:
+                        stat = os.stat(os.path.join(root, file))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file)))
+                    total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+download_cache = DownloadCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES)
+
+def link_or_copy(source, destination):
+    # Hardlinks cost no extra disk; fall back to a copy across filesystems
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        os.remove(destination)
+        os.link(source, destination)
+    except OSError as e:
+        if isinstance(e, FileNotFoundError):
+            raise
+        shutil.copyfile(source, destination)
+
+def get_job_workspace(job_id):
+    return os.path.join(WORKSPACE_ROOT, f'job-{job_id}')
+
+def sweep_workspaces(db):
+    """Remove workspaces left behind by jobs that are no longer running (e.g. after a crash)."""
+    if not os.path.isdir(WORKSPACE_ROOT):
+        return
+
+    # Jobs still held under a live lease may be running in another process
+    active = {get_job_workspace(row['id']) for row in db.execute('''
+        SELECT id FROM jobs WHERE status = 'in progress' AND lease_expires >= CURRENT_TIMESTAMP
+    ''')}
+
+    for entry in os.scandir(WORKSPACE_ROOT):
+        if entry.path in active:
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+            print(f"Removed orphaned workspace entry '{entry.path}'")
+        except OSError as e:
+            print(f"Failed to remove orphaned workspace entry '{entry.path}': {e}")
+
+def workspace_free_bytes():
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    return shutil.disk_usage(WORKSPACE_ROOT).free
+
+def workspace_total_bytes():
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    return shutil.disk_usage(WORKSPACE_ROOT).total
+
+# Workspace bytes promised to running jobs. A job reserves its estimated footprint before it
+# downloads anything and only starts if that fits; otherwise it is put back in the queue until
+# running jobs finish and give their space back. Reservations live in the jobs table
+# (workspace_reserved), so every process and worker thread admits against the same total.
+class DiskBudget:
+    def __init__(self, limit, keep_free):
+        self.limit = limit  # Bytes all running jobs may hold at once (0 for no fixed limit)
+        self.keep_free = keep_free  # Bytes always left free on the workspace filesystem
+        self.lock = threading.Lock()
+        self.deferred = 0
+
+    def usage(self, db, exclude=None):
+        """Bytes reserved by running jobs, and how many of those they have already written."""
+        row = db.execute('''
+            SELECT COUNT(*), COALESCE(SUM(workspace_reserved), 0),
+                   COALESCE(SUM(MIN(downloaded_bytes, workspace_reserved)), 0)
+            FROM jobs
+            WHERE status = 'in progress' AND workspace_reserved > 0 AND id IS NOT ?
+        ''', (exclude,)).fetchone()
+        return row[0], row[1], row[2]
+
+    def capacity(self, db):
+        """Bytes all running jobs may hold at once."""
+        _, _, written = self.usage(db)
+        return self.get_capacity(written)
+
+    def get_capacity(self, written):
+        # What running jobs already wrote is theirs to keep using, on top of what is still free
+        capacity = max(0, workspace_free_bytes() + written - self.keep_free)
+        return min(capacity, self.limit) if self.limit else capacity
+
+    def ceiling(self):
+        """Bytes no job may exceed: the fixed limit, or the whole filesystem less what stays free."""
+        ceiling = max(0, workspace_total_bytes() - self.keep_free)
+        return min(ceiling, self.limit) if self.limit else ceiling
+
+    def available(self, db, exclude=None):
+        """Bytes a new job may reserve now."""
+        _, reserved, written = self.usage(db, exclude)
+        return max(0, self.get_capacity(written) - reserved)
+
+    def reserve(self, db, job_id, worker_id, size):
+        """Hold `size` bytes for the job; returns False, holding nothing, if they don't fit."""
+        # The write lock makes the check and the reservation one step across every process
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            if size > self.available(db, exclude=job_id):
+                with self.lock:
+                    self.deferred += 1
+                return False
+            cursor = db.execute('''
+                UPDATE jobs SET workspace_reserved = ? WHERE id = ? AND worker_id = ? AND status = 'in progress'
+            ''', (size, job_id, worker_id))
+            return cursor.rowcount == 1
+
+    def release(self, db, job_id):
+        """Give the job's bytes back; returns True if it held any."""
+        with db:
+            cursor = db.execute('UPDATE jobs SET workspace_reserved = NULL WHERE id = ? AND workspace_reserved IS NOT NULL',
+                                (job_id,))
+        return cursor.rowcount == 1
+
+    def stats(self, db):
+        jobs, reserved, written = self.usage(db)
+        with self.lock:
+            deferred = self.deferred
+        return {'reserved': reserved, 'jobs': jobs, 'capacity': self.get_capacity(written), 'deferred': deferred}
+
+disk_budget = DiskBudget(WORKSPACE_DISK_BUDGET, WORKSPACE_DISK_RESERVE)
+
+# A transfer that rclone reported as successful but whose result is wrong (short file, bad checksum)
+class TransferError(Exception):
+    pass
+
+# A pipelined job found out, part way through its archive, that some files never arrived
+class IncompleteDownloadError(Exception):
+    pass
+
+def parse_size(value):
+    """Parse an rclone-style size such as '64M' or '1G' into bytes."""
+    value = str(value).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+# Digests of local files keyed by path, invalidated when the file's mtime or size changes,
+# so verifying an unchanged file again costs a stat instead of a full read
+class DigestCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # Path -> ((mtime_ns, size), {algorithm: hexdigest})
+        self.lock = threading.Lock()
+
+    def get(self, file_path, st):
+        with self.lock:
+            cached = self.entries.get(file_path)
+            if cached is None or cached[0] != (st.st_mtime_ns, st.st_size):
+                return {}
+            self.entries.move_to_end(file_path)
+            return dict(cached[1])
+
+    def put(self, file_path, st, digests):
+        identity = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            cached = self.entries.get(file_path)
+            if cached is not None and cached[0] == identity:
+                digests = {**cached[1], **digests}
+            self.entries[file_path] = (identity, digests)
+            self.entries.move_to_end(file_path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return digests
+
+digest_cache = DigestCache(DIGEST_CACHE_ENTRIES)
+
+# Remote hash names (as listed by `rclone lsjson --hash`) that hashlib can check locally
+VERIFIABLE_HASHES = ('md5', 'sha1', 'sha256', 'sha512')
+
+def file_digests(file_path, algorithms=('sha1',), profile=''):
+    """Return {algorithm: hexdigest}, computing every uncached digest in a single read of the file."""
+    st = os.stat(file_path)
+    digests = digest_cache.get(file_path, st)
+    missing = [algorithm for algorithm in algorithms if algorithm not in digests]
+
+    if missing:
+        started = time.perf_counter()
+        hashers = [hashlib.new(algorithm) for algorithm in missing]
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        # Large unbuffered reads into one reused buffer; hashlib releases the GIL on big updates
+        with open(file_path, 'rb', buffering=0) as f:
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                for hasher in hashers:
+                    hasher.update(view[:size])
+        digests = digest_cache.put(file_path, st, {algorithm: hasher.hexdigest() for algorithm, hasher in zip(missing, hashers)})
+        # Only real reads are timed; cache hits would make hashing look infinitely fast
+        metrics.record_phase('hash', profile, time.perf_counter() - started, st.st_size)
+
+    return {algorithm: digests[algorithm] for algorithm in algorithms}
+
+# Write-only file object that hashes everything passing through it
+class HashingWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha1 = hashlib.sha1()
+        self.position = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.sha1.update(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        # zipfile only needs the offset; no seek() means it writes data descriptors
+        return self.position
+
+    def flush(self):
+        self.stream.flush()
+
+    def hexdigest(self):
+        return self.sha1.hexdigest()
+
 class FileOps:
-    def __init__(self, operation_profile, logger, job_id):
+    def __init__(self, operation_profile, logger, job_id, progress=None):
         self.operation_profile = operation_profile
-        self.temp_job_directory = os.path.join(tempfile.gettempdir(), 'dam-zipper')
+        self.progress = progress  # Optional JobProgress updated as files are processed
+        # Every job gets its own workspace so concurrent jobs never see each other's files
+        self.temp_job_directory = get_job_workspace(job_id)
         self.logger = logger
         self.job_id = job_id
         self.remote_base_dir = None  # Store the higher-level directory
+        self.downloaded_files = []  # Local paths of every file fetched for this job, in zip order
+        self.streaming = False  # True while the zip is being streamed to the remote
+        self.remote_info = {}  # rclone lsjson entries for the job's remote files, keyed by path
+        self.remote_files = {}  # Local path -> remote file it was downloaded from
+        self.failed_downloads = []  # Remote files that could not be fetched, even after retries
+        self.archive_sha1 = None  # SHA1 of the archive once it is verified on the remote
+        self.zip_saved = 0  # Bytes saved by compression in the last archive written
+        self.zip_input_bytes = 0  # Uncompressed bytes that went into the last archive written
+        self.pending_downloads = None  # Pipelined download generator still feeding the archive
+        self.on_downloads_done = None  # Called once every download has finished (or failed)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_bytes_saved = 0
+
+    def advance_progress(self, files=0, bytes_transferred=0, remote_file=None, state=None, downloaded_bytes=0):
+        if self.progress is not None:
+            self.progress.advance(files, bytes_transferred, remote_file, state, downloaded_bytes)
 
     def download(self, file_map):
+        return list(self.download_iter(file_map))
+
+    def download_iter(self, file_map):
+        """Download the job's files, yielding each local path as soon as the file has landed."""
+        if not file_map:
+            return
+
+        # Extract the higher-level directory from the first remote file path
+        if not self.remote_base_dir:
+            self.remote_base_dir = next(iter(file_map)).split('/')[0]
+
+        started = time.monotonic()
+        downloaded = []
+        total_bytes = 0
+        transferred_bytes = 0
+        profile_name = self.operation_profile.name
+
+        # Remote sizes drive resumable transfers; with modtimes they also key the cache.
+        # Planning may already have listed the files.
+        if not self.remote_info:
+            self.remote_info = self.stat_remote_files(file_map)
+
+        # Serve what we can from the local cache and only transfer the rest
+        cache_keys = {}
+        if download_cache.enabled:
+            for remote_file in file_map:
+                if remote_file in self.remote_info:
+                    cache_keys[remote_file] = download_cache.key(self.operation_profile.name, remote_file, self.remote_info[remote_file])
+
+        cached, missing = [], {}
         for remote_file, local_name in file_map.items():
+            destination_file_path = self.local_destination(local_name)
+            if remote_file in cache_keys and download_cache.fetch(cache_keys[remote_file], destination_file_path):
+                cached.append((remote_file, destination_file_path, None))
+            else:
+                missing[remote_file] = local_name
+
+        # Large files always go through the resumable path, one rclone process each
+        resumable = {remote_file: local_name for remote_file, local_name in missing.items() if self.is_resumable(remote_file)}
+        regular = {remote_file: local_name for remote_file, local_name in missing.items() if remote_file not in resumable}
+
+        if not regular:
+            results = []
+        elif self.operation_profile.transfer_mode == 'batch':
+            results = self.download_batch(regular)
+        else:
+            results = self.download_parallel(regular)
+
+        if resumable:
+            results = itertools.chain(results, self.download_parallel(resumable))
+
+        # Results are reported from this thread so all DB writes stay on the job's connection
+        for remote_file, destination_file_path, error in itertools.chain(cached, results):
+            if error is None:
+                file_size = os.path.getsize(destination_file_path)
+                total_bytes += file_size
+                downloaded.append(destination_file_path)
+                if destination_file_path not in self.downloaded_files:
+                    self.downloaded_files.append(destination_file_path)
+                self.remote_files[destination_file_path] = remote_file
+
+                # When pipelined, files_done counts zipped files and downloads only add bytes
+                files_done = 0 if self.pending_downloads is not None else 1
+
+                if remote_file not in missing:
+                    self.advance_progress(files=files_done, remote_file=remote_file, state='cached')
+                    metrics.inc('damzipper_download_cache_hits_total', profile=profile_name)
+                    metrics.inc('damzipper_download_cache_saved_bytes_total', file_size, profile=profile_name)
+                    self.cache_hits += 1
+                    self.cache_bytes_saved += file_size
+                    self.logger.log_job(self.job_id, f"Cache hit for {remote_file}, linked to {destination_file_path} ({file_size} bytes)")
+                    yield destination_file_path
+                    continue
+
+                self.advance_progress(files=files_done, bytes_transferred=file_size, remote_file=remote_file, state='downloaded',
+                                      downloaded_bytes=file_size)
+                transferred_bytes += file_size
+
+                if remote_file in cache_keys:
+                    metrics.inc('damzipper_download_cache_misses_total', profile=profile_name)
+                    self.cache_misses += 1
+                    download_cache.store(cache_keys[remote_file], destination_file_path)
+
+                if DEBUG:
+                    self.logger.log(f"Downloaded {remote_file} to {destination_file_path}")
+
+                self.logger.log_job(self.job_id, f"Downloaded {remote_file} to {destination_file_path} ({file_size} bytes)")
+                yield destination_file_path
+            elif isinstance(error, subprocess.CalledProcessError):
+                metrics.inc('damzipper_download_failures_total', profile=profile_name)
+                self.failed_downloads.append(remote_file)
+                self.advance_progress(remote_file=remote_file, state='failed')
+                self.logger.log_error(f"rclone failed to download {remote_file}: {error}")
+                self.logger.log_job(self.job_id, f"Failed to download {remote_file}: {error}")
+            else:
+                metrics.inc('damzipper_download_failures_total', profile=profile_name)
+                self.failed_downloads.append(remote_file)
+                self.advance_progress(remote_file=remote_file, state='failed')
+                self.logger.log_error(f"Failed to download {remote_file}: {error}")
+                self.logger.log_job(self.job_id, f"Failed to download {remote_file}: {error}")
+
+        if cache_keys:
+            download_cache.evict()
+            self.logger.log_job(self.job_id, f"Download cache: {self.cache_hits} hits, {self.cache_misses} misses, {self.cache_bytes_saved} bytes saved")
+
+        elapsed = time.monotonic() - started
+        # When pipelined this includes time spent waiting for the zip writer to take files
+        metrics.record_phase('download', profile_name, elapsed, transferred_bytes)
+        self.logger.log_job(self.job_id, f"Downloaded {len(downloaded)}/{len(file_map)} files, {total_bytes} bytes in {elapsed:.2f}s")
+        self.logger.log(f"Downloaded {len(downloaded)}/{len(file_map)} files, {total_bytes} bytes in {elapsed:.2f}s")
+
+        if self.on_downloads_done is not None:
+            self.on_downloads_done()
+
+    def start_pipeline(self, file_map):
+        """Download lazily, so the archive writer takes each file as soon as it lands."""
+        if not self.remote_base_dir:
+            self.remote_base_dir = next(iter(file_map)).split('/')[0]
+        self.pending_downloads = self.download_iter(file_map)
+
+    def archive_files(self):
+        """Files for the archive: those downloaded so far, then whatever the pipeline still delivers."""
+        yield from list(self.downloaded_files)
+
+        if self.pending_downloads is not None:
+            # A plain loop (not `yield from`) so an aborted archive attempt doesn't close the
+            # pipeline; a retry picks up the files already downloaded and carries on
+            for file_path in self.pending_downloads:
+                yield file_path
+
+            if self.failed_downloads:
+                # The writer has already taken the other files; abort it before the archive is finished
+                raise IncompleteDownloadError(f"{len(self.failed_downloads)} files could not be downloaded")
+
+    def write_manifest(self, file_map, name):
+        # rclone --files-from-raw manifest: one path per line, relative to the profile's PATH_DOWN
+        manifest_path = os.path.join(self.temp_job_directory, name)
+        os.makedirs(self.temp_job_directory, exist_ok=True)
+        with open(manifest_path, 'w') as manifest:
+            for remote_file in file_map:
+                manifest.write(remote_file + '\n')
+        return manifest_path
+
+    def fingerprint(self, file_map):
+        """Identify the archive this job would produce, or None if not every remote file could be listed."""
+        if not self.remote_base_dir:
+            self.remote_base_dir = next(iter(file_map)).split('/')[0]
+        self.remote_info = self.stat_remote_files(file_map)
+
+        entries = []
+        for remote_file, local_name in sorted(file_map.items()):
+            info = self.remote_info.get(remote_file)
+            if not info or not info.get('ModTime'):
+                return None
+            entries.append([remote_file, local_name, info.get('Size'), info['ModTime']])
+
+        # Anything that changes the bytes of the zip is part of the key; the token only names it
+        policy = self.operation_profile.compression_policy
+        job_key = {
+            'remote': self.operation_profile.name,
+            'download_path': self.operation_profile.download_path,
+            'compression': [policy.method, policy.level, sorted(policy.store_extensions)],
+            'files': entries,
+        }
+        return hashlib.sha256(json.dumps(job_key, sort_keys=True).encode()).hexdigest()
+
+    def workspace_estimate(self, file_map):
+        """(source bytes, workspace bytes) from the listed remote sizes, or (None, None) if nothing was listed."""
+        sizes = [self.remote_info[remote_file].get('Size', 0) for remote_file in file_map if remote_file in self.remote_info]
+        if not sizes:
+            return None, None
+        size = sum(max(size, 0) for size in sizes)
+        # The source files sit in the workspace until the job ends; an unstreamed archive is a second copy
+        return size, size if self.operation_profile.stream_upload else 2 * size
+
+    def reuse_result(self, existing_path, sha1, zip_name):
+        """Serve the job from an archive an earlier job uploaded; returns the remote path or None."""
+        remote_upload_path = self.get_remote_upload_path(secure_filename(zip_name) + '.zip')
+
+        try:
+            if existing_path != remote_upload_path:
+                # Both paths are on the profile's remote, so rclone copies server-side where the backend can
+                rclone_command = ['rclone', 'copyto', existing_path, remote_upload_path, *self.operation_profile.rclone_flags(multi_thread=False)]
+                with metrics.phase('remote_copy', self.operation_profile.name):
+                    subprocess.run(rclone_command, check=True)
+
+            # The earlier upload may have been removed or replaced since
+            if not self.verify_remote_sha1(sha1, remote_upload_path):
+                return None
+
+        except subprocess.CalledProcessError as e:
+            self.logger.log_error(f"rclone failed to reuse {existing_path}: {e}")
+            self.logger.log_job(self.job_id, f"Could not reuse {existing_path}, building the archive instead: {e}")
+            return None
+
+        self.archive_sha1 = sha1
+        if existing_path == remote_upload_path:
+            self.logger.log_job(self.job_id, f"Identical archive already at {remote_upload_path}; nothing to transfer")
+        else:
+            self.logger.log_job(self.job_id, f"Copied identical archive {existing_path} to {remote_upload_path}")
+        return remote_upload_path
+
+    def stat_remote_files(self, file_map):
+        """Return {remote_file: lsjson entry} for the job's files, from a single `rclone lsjson` call."""
+        manifest_path = self.write_manifest(file_map, '.rclone-lsjson.txt')
+
+        rclone_command = [
+            'rclone', 'lsjson',
+            f'{self.operation_profile.name}:{self.operation_profile.download_path}',
+            '--files-from-raw', manifest_path,
+            '--no-traverse', '--files-only', '--recursive',
+        ]
+        if DOWNLOAD_CACHE_HASH or DOWNLOAD_VERIFY_HASH:
+            rclone_command.append('--hash')
+
+        try:
+            with metrics.phase('list', self.operation_profile.name):
+                result = subprocess.run(rclone_command, check=True, capture_output=True, text=True)
+            return {entry['Path']: entry for entry in json.loads(result.stdout or '[]')}
+        except (subprocess.CalledProcessError, ValueError) as e:
+            # Without metadata the cache can't be trusted and nothing is resumable; just download everything
+            self.logger.log_error(f"rclone failed to list remote files: {e}")
+            self.logger.log_job(self.job_id, f"Failed to list remote files, bypassing download cache and resumable transfers: {e}")
+            return {}
+        finally:
+            os.remove(manifest_path)
+
+    def download_parallel(self, file_map):
+        # One rclone process per file, up to `concurrency` at once. New downloads are only started
+        # as results are consumed, so a slow consumer (the zip writer when pipelined) holds back
+        # the downloads once PIPELINE_QUEUE_FILES finished files are waiting for it.
+        in_flight = self.operation_profile.concurrency + PIPELINE_QUEUE_FILES
+        queued = iter(file_map.items())
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.operation_profile.concurrency) as executor:
+            def submit_next():
+                for remote_file, local_name in queued:
+                    futures[executor.submit(self.download_file, remote_file, local_name)] = remote_file
+                    return
+
+            for _ in range(in_flight):
+                submit_next()
+
             try:
-                # Extract the higher-level directory from the first remote file path
-                if not self.remote_base_dir:
-                    self.remote_base_dir = remote_file.split('/')[0]
-                
-                # Split the local name into directory and filename
-                local_dir, filename = os.path.split(local_name)
-                local_dir_path = os.path.join(self.temp_job_directory, local_dir)
-                if not os.path.exists(local_dir_path):
-                    os.makedirs(local_dir_path)  # Create any necessary directories
-
-                remote_file_path = os.path.join(self.operation_profile.download_path, remote_file)
-                remote_download_path = f'{self.operation_profile.name}:{remote_file_path}'
-
-                # Set the destination file path
-                destination_file_path = os.path.join(local_dir_path, secure_filename(filename))
-
-                # Construct the rclone command
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        remote_file = futures.pop(future)
+                        try:
+                            result = (remote_file, future.result(), None)
+                        except Exception as e:
+                            result = (remote_file, None, e)
+                        submit_next()
+                        yield result
+            finally:
+                # An abandoned pipeline only waits for the downloads already running
+                for future in futures:
+                    future.cancel()
+
+    def download_batch(self, file_map):
+        # A single rclone process fetches every file listed in a --files-from manifest,
+        # so config parsing, auth and connection setup are paid once per job. rclone logs each
+        # finished transfer as a JSON line and the file is handed on right away, so when
+        # pipelined the zip writer takes files while the rest of the batch is still downloading.
+        staging_dir = os.path.join(self.temp_job_directory, '.rclone-staging')
+        manifest_path = os.path.join(self.temp_job_directory, '.rclone-files-from.txt')
+        os.makedirs(staging_dir, exist_ok=True)
+
+        remaining = dict(file_map)
+        attempts = self.operation_profile.retries + 1
+
+        try:
+            for attempt in range(1, attempts + 1):
+                self.write_manifest(remaining, os.path.basename(manifest_path))
+
                 rclone_command = [
-                    'rclone', 'copyto',
-                    remote_download_path,  # Remote file path (including remote name)
-                    destination_file_path  # Local destination path
+                    'rclone', 'copy',
+                    f'{self.operation_profile.name}:{self.operation_profile.download_path}',
+                    staging_dir,
+                    '--files-from-raw', manifest_path,
+                    '--no-traverse',
+                    '--transfers', str(self.operation_profile.concurrency),
+                    '--use-json-log', '--log-level', 'INFO',
+                    *self.operation_profile.rclone_flags(),
                 ]
 
-                # Execute the rclone command
-                subprocess.run(rclone_command, check=True)
-
-                if DEBUG:
-                    self.logger.log(f"Downloaded {remote_file} to {destination_file_path}")
+                failed = {}
+                taken = set()
+                stderr = []
+                # Don't raise on a non-zero exit: some files may still have been copied
+                with metrics.phase('download_batch', self.operation_profile.name) as timing:
+                    timing.bytes = 0
+                    process = subprocess.Popen(rclone_command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                    exited = False
+                    try:
+                        for line in process.stderr:
+                            remote_file = self.copied_file(line)
+                            if remote_file is None:
+                                stderr.append(line)
+                                continue
+                            if remote_file not in remaining or remote_file in taken:
+                                continue
+
+                            taken.add(remote_file)
+                            result = self.take_staged_file(staging_dir, remote_file, remaining[remote_file])
+                            if isinstance(result[2], TransferError):
+                                failed[remote_file] = result[2]
+                                continue
+                            if result[1] is not None:
+                                timing.bytes += os.path.getsize(result[1])
+                            yield result
+                        process.wait()
+                        exited = True
+                    finally:
+                        if not exited:
+                            # The consumer gave up on the job; so does rclone
+                            process.kill()
+                            process.wait()
+                stderr = ''.join(stderr)
+                if process.returncode != 0:
+                    self.logger.log_error(f"rclone batch download exited with {process.returncode}: {stderr.strip()}")
+
+                # Files rclone never reported are either missing or were copied without a log
+                # line; only what's missing or broken is retried
+                for remote_file, local_name in remaining.items():
+                    if remote_file in taken:
+                        continue
+                    if not os.path.isfile(os.path.join(staging_dir, remote_file)):
+                        failed[remote_file] = subprocess.CalledProcessError(process.returncode, rclone_command, stderr=stderr)
+                        continue
+
+                    result = self.take_staged_file(staging_dir, remote_file, local_name)
+                    if isinstance(result[2], TransferError):
+                        failed[remote_file] = result[2]
+                    else:
+                        yield result
+
+                remaining = {remote_file: remaining[remote_file] for remote_file in failed}
+                if not remaining or attempt == attempts:
+                    break
+
+                delay = self.operation_profile.retry_delay(attempt)
+                self.logger.log_job(self.job_id, f"Retrying {len(remaining)} failed downloads in {delay:.1f}s (attempt {attempt + 1}/{attempts})")
+                time.sleep(delay)
+
+            for remote_file, error in failed.items():
+                yield remote_file, None, error
+        finally:
+            # The staging area must not end up in the zip
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+
+    @staticmethod
+    def copied_file(line):
+        """The remote file a line of rclone's JSON log reports as copied, or None."""
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(entry, dict) or not str(entry.get('msg', '')).startswith('Copied'):
+            return None
+        return entry.get('object')
 
-                self.logger.log_job(self.job_id, f"Downloaded {remote_file} to {destination_file_path}")
-            except subprocess.CalledProcessError as e:
-                self.logger.log_error(f"rclone failed to download {remote_file}: {e}")
-                self.logger.log_job(self.job_id, f"Failed to download {remote_file}: {e}")
-            except Exception as e:
-                self.logger.log_error(f"Failed to download {remote_file}: {e}")
-                self.logger.log_job(self.job_id, f"Failed to download {remote_file}: {e}")
+    def take_staged_file(self, staging_dir, remote_file, local_name):
+        # Move a file rclone has finished to its requested local name and check it
+        try:
+            destination_file_path = self.local_destination(local_name)
+            os.replace(os.path.join(staging_dir, remote_file), destination_file_path)
+            self.verify_download(remote_file, destination_file_path)
+            return remote_file, destination_file_path, None
+        except Exception as e:
+            return remote_file, None, e
+
+    def local_destination(self, local_name):
+        # Split the local name into directory and filename
+        local_dir, filename = os.path.split(local_name)
+        local_dir_path = os.path.join(self.temp_job_directory, local_dir)
+        os.makedirs(local_dir_path, exist_ok=True)  # Create any necessary directories
+
+        # Set the destination file path
+        return os.path.join(local_dir_path, secure_filename(filename))
+
+    def download_file(self, remote_file, local_name):
+        # Per file, so the histograms show rclone's startup cost on small files next to the throughput of large ones
+        with metrics.phase('download_file', self.operation_profile.name) as timing:
+            destination_file_path = self.fetch_file(remote_file, local_name)
+            timing.bytes = os.path.getsize(destination_file_path)
+        return destination_file_path
+
+    def fetch_file(self, remote_file, local_name):
+        remote_file_path = os.path.join(self.operation_profile.download_path, remote_file)
+        remote_download_path = f'{self.operation_profile.name}:{remote_file_path}'
+
+        destination_file_path = self.local_destination(local_name)
+
+        if self.is_resumable(remote_file):
+            def fetch_resumable():
+                self.download_resumable(remote_download_path, destination_file_path, self.remote_info[remote_file]['Size'])
+                self.verify_download(remote_file, destination_file_path)
+
+            self.retry(fetch_resumable, f"Download of {remote_file}")
+            return destination_file_path
+
+        # Construct the rclone command
+        rclone_command = [
+            'rclone', 'copyto',
+            remote_download_path,  # Remote file path (including remote name)
+            destination_file_path,  # Local destination path
+            *self.operation_profile.rclone_flags(),
+        ]
+
+        def fetch():
+            # Execute the rclone command
+            subprocess.run(rclone_command, check=True)
+            self.verify_download(remote_file, destination_file_path)
+
+        self.retry(fetch, f"Download of {remote_file}")
+
+        return destination_file_path
+
+    def verify_download(self, remote_file, file_path):
+        """Hash a file as it lands and compare it with the hashes the remote listed for it, if any."""
+        if not DOWNLOAD_VERIFY_HASH:
+            return
+
+        remote_hashes = self.remote_info.get(remote_file, {}).get('Hashes') or {}
+        expected = {algorithm: value.lower() for algorithm, value in remote_hashes.items()
+                    if algorithm in VERIFIABLE_HASHES and value}
+        if not expected:
+            return
+
+        # One read covers every algorithm, and the result is cached for later checks
+        actual = file_digests(file_path, tuple(expected), self.operation_profile.name)
+        mismatched = [algorithm for algorithm in expected if actual[algorithm] != expected[algorithm]]
+        if mismatched:
+            os.remove(file_path)
+            raise TransferError(f"{', '.join(mismatched)} mismatch for {remote_file}")
+
+    def is_resumable(self, remote_file):
+        # Large files are fetched in chunks so a failure only costs the unfinished chunk
+        size = self.remote_info.get(remote_file, {}).get('Size', -1)
+        return size >= self.operation_profile.resume_threshold
+
+    def download_resumable(self, remote_download_path, destination_file_path, size):
+        """Append `rclone cat --offset` chunks to a .partial file, continuing from whatever it already holds."""
+        partial_path = destination_file_path + '.partial'
+        chunk_size = self.operation_profile.chunk_size
+
+        with open(partial_path, 'ab') as partial:
+            offset = partial.tell()
+            if offset:
+                self.logger.log_job(self.job_id, f"Resuming {remote_download_path} at byte {offset} of {size}")
+
+            while offset < size:
+                rclone_command = [
+                    'rclone', 'cat', remote_download_path,
+                    '--offset', str(offset),
+                    '--count', str(min(chunk_size, size - offset)),
+                    *self.operation_profile.rclone_flags(multi_thread=False),
+                ]
+                # Bytes already written stay valid even if the chunk fails part way
+                subprocess.run(rclone_command, check=True, stdout=partial)
+                partial.flush()
+                written = partial.tell()
+                if written == offset:
+                    raise TransferError(f"No data received for {remote_download_path} at byte {offset}")
+                offset = written
+
+        if os.path.getsize(partial_path) != size:
+            os.remove(partial_path)
+            raise TransferError(f"Downloaded size of {remote_download_path} does not match the remote ({size} bytes)")
+
+        os.replace(partial_path, destination_file_path)
+        return destination_file_path
+
+    def retry(self, operation, description):
+        """Run `operation`, retrying rclone and transfer failures with exponential backoff."""
+        attempts = self.operation_profile.retries + 1
+        for attempt in range(1, attempts + 1):
+            try:
+                return operation()
+            except (subprocess.CalledProcessError, TransferError) as e:
+                if attempt == attempts:
+                    raise
+                delay = self.operation_profile.retry_delay(attempt)
+                self.logger.log_error(f"{description} failed (attempt {attempt}/{attempts}): {e}")
+                self.logger.log_job(self.job_id, f"{description} failed (attempt {attempt}/{attempts}), retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
 
     def zip(self, zip_name):
         zip_dir = self.temp_job_directory
@@ -190,20 +1512,14 @@ class FileOps:
             os.makedirs(zip_dir)
 
         try:
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(self.temp_job_directory, topdown=True):
-                    self.logger.log(f"Zipping: Current directory: {root}")  # Debug print
-                    dirs[:] = [d for d in dirs if os.path.join(root, d) != zip_dir]
-                    for file in files:
-                        if file == '.DS_Store' or file == os.path.basename(zip_path):
-                            continue
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, start=self.temp_job_directory)
-                        zipf.write(file_path, arcname)
-                        self.logger.log(f"Added {file_path} to zip as {arcname}")  # Debug print
-
-                self.logger.log(f"Zipping completed: {zip_path}")  # Debug print
-                self.logger.log_job(self.job_id, f"Zipping completed: {zip_path}")
+            with open(zip_path, 'wb') as f:
+                # Hash the archive as it is written so the upload never has to read it back
+                writer = HashingWriter(f)
+                self.write_archive(writer)
+            digest_cache.put(zip_path, os.stat(zip_path), {'sha1': writer.hexdigest()})
+
+            self.logger.log(f"Zipping completed: {zip_path}")  # Debug print
+            self.logger.log_job(self.job_id, f"Zipping completed: {zip_path}")
 
         except Exception as e:
             self.logger.log_error(f"Exception during zipping: {e}")
@@ -213,6 +1529,124 @@ class FileOps:
         
         return zip_path
 
+    def write_archive(self, fileobj):
+        with metrics.phase('zip', self.operation_profile.name) as timing:
+            self.write_entries(fileobj)
+            timing.bytes = self.zip_input_bytes
+
+    def write_entries(self, fileobj):
+        policy = self.operation_profile.compression_policy
+        self.zip_saved = 0
+        self.zip_input_bytes = 0
+
+        # Only the files this job downloaded go in; nothing else in the workspace is walked.
+        # Entries are built lazily so a pipelined job zips each file as it arrives.
+        methods = {}
+
+        def entries():
+            for file_path in self.archive_files():
+                arcname = os.path.relpath(file_path, start=self.temp_job_directory)
+                compress_type, compresslevel, method = policy.choose(file_path)
+                methods[file_path] = method
+                yield file_path, arcname, compress_type, compresslevel, method
+
+        if ZIP_WORKERS > 1 and policy.method in ('deflate', 'store'):
+            # Deflate across all cores; bzip2 and lzma entries can't be split into chunks
+            writer = ParallelZipWriter(fileobj, get_zip_executor(), ZIP_WORKERS, parse_size(ZIP_CHUNK_SIZE))
+            for entry in writer.write_entries(entry[:4] for entry in entries()):
+                self.report_zip_entry(entry.path, entry.arcname, methods[entry.path], entry.file_size, entry.compress_size)
+            writer.close()
+        else:
+            with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for file_path, arcname, compress_type, compresslevel, method in entries():
+                    zipf.write(file_path, arcname, compress_type=compress_type, compresslevel=compresslevel)
+                    zinfo = zipf.filelist[-1]
+                    self.report_zip_entry(file_path, arcname, method, zinfo.file_size, zinfo.compress_size)
+
+        self.logger.log_job(self.job_id, f"Compression saved {self.zip_saved} bytes")
+
+    def report_zip_entry(self, file_path, arcname, method, file_size, compress_size):
+        saved = file_size - compress_size
+        self.zip_saved += saved
+        self.zip_input_bytes += file_size
+        # When streaming, the compressed bytes are what goes over the wire
+        self.advance_progress(files=1, bytes_transferred=compress_size if self.streaming else 0,
+                              remote_file=self.remote_files.get(file_path), state='zipped')
+        self.logger.log(f"Added {file_path} to zip as {arcname}")  # Debug print
+        self.logger.log_job(self.job_id, f"Zipped {arcname} using {method}: {file_size} -> {compress_size} bytes (saved {saved})")
+
+    def get_remote_upload_path(self, zip_name):
+        # Use the remote_base_dir to define the remote upload directory
+        remote_upload_dir = f'{self.operation_profile.name}:{os.path.join(self.operation_profile.upload_path, self.remote_base_dir)}'
+        return f"{remote_upload_dir}/{zip_name}"
+
+    def zip_and_upload(self, zip_name):
+        # Stream the archive straight into `rclone rcat`, hashing the bytes on their way out,
+        # so the zip is never written to (or re-read from) the local disk
+        zip_name = secure_filename(zip_name) + '.zip'
+        remote_upload_path = self.get_remote_upload_path(zip_name)
+
+        try:
+            # Nothing is kept locally, so a retry rebuilds the stream from the downloaded files
+            self.retry(lambda: self.stream_zip(zip_name, remote_upload_path), f"Upload of {zip_name}")
+
+        except subprocess.CalledProcessError as e:
+            self.logger.log_error(f"rclone failed to stream {zip_name}: {e}")
+            self.logger.log_job(self.job_id, f"Failed to stream {zip_name}: {e}")
+            return None
+        except Exception as e:
+            self.logger.log_error(f"Failed to stream {zip_name}: {e}")
+            self.logger.log_job(self.job_id, f"Failed to stream {zip_name}: {e}")
+            return None
+
+        return remote_upload_path
+
+    def stream_zip(self, zip_name, remote_upload_path):
+        rclone_command = ['rclone', 'rcat', remote_upload_path, *self.operation_profile.rclone_flags(multi_thread=False)]
+
+        with tempfile.TemporaryFile() as stderr, metrics.phase('upload_stream', self.operation_profile.name) as timing:
+            process = subprocess.Popen(rclone_command, stdin=subprocess.PIPE, stderr=stderr)
+            writer = HashingWriter(process.stdin)
+            timing.bytes = 0
+
+            try:
+                self.streaming = True
+                self.write_archive(writer)
+                process.stdin.close()
+            except OSError as e:
+                if not isinstance(e, BrokenPipeError) and process.poll() is None:
+                    process.kill()
+                    process.wait()
+                    raise
+                # rclone exited before taking the whole archive; report it as rclone's failure, with
+                # its stderr, so the upload is retried like any other failed transfer
+                process.wait()
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(process.returncode, rclone_command, stderr=stderr.read().decode(errors='replace')) from e
+            except Exception:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                self.streaming = False
+
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(process.returncode, rclone_command, stderr=stderr.read().decode(errors='replace'))
+            timing.bytes = writer.tell()
+
+        local_sha1 = writer.hexdigest()
+        self.logger.log_job(self.job_id, f"Zipping completed: streamed {writer.tell()} bytes")
+        self.logger.log_job(self.job_id, f"Local SHA1 checksum: {local_sha1}")
+        self.logger.log(f"Local SHA1 checksum: {local_sha1}")
+
+        self.logger.log_job(self.job_id, f"Uploaded {zip_name} to {remote_upload_path}")
+        self.logger.log(f"Uploaded {zip_name} to {remote_upload_path}")  # Debug print
+
+        if not self.verify_remote_sha1(local_sha1, remote_upload_path):
+            raise TransferError(f"SHA1 mismatch for {remote_upload_path}")
+        self.archive_sha1 = local_sha1
+
     def upload(self, zip_path):
         try:
             # Calculate SHA1
@@ -220,87 +1654,452 @@ class FileOps:
             self.logger.log_job(self.job_id, f"Local SHA1 checksum: {local_sha1}")
             self.logger.log(f"Local SHA1 checksum: {local_sha1}")
 
-            # Use the remote_base_dir to define the remote upload directory
-
             # Construct the full remote upload path
-            remote_upload_dir = f'{self.operation_profile.name}:{os.path.join(self.operation_profile.upload_path, self.remote_base_dir)}'
-            remote_upload_path = f"{remote_upload_dir}/{os.path.basename(zip_path)}"
+            remote_upload_path = self.get_remote_upload_path(os.path.basename(zip_path))
 
             # Construct the rclone command for uploading
             rclone_command = [
                 'rclone', 'copyto',
                 zip_path,  # Local source file path
-                remote_upload_path  # Remote destination path
+                remote_upload_path,  # Remote destination path
+                *self.operation_profile.rclone_flags(),
             ]
 
-            # Execute the rclone command
-            subprocess.run(rclone_command, check=True)
+            def upload_once():
+                # Execute the rclone command
+                with metrics.phase('upload', self.operation_profile.name) as timing:
+                    subprocess.run(rclone_command, check=True)
+                    timing.bytes = os.path.getsize(zip_path)
 
-            self.logger.log_job(self.job_id, f"Uploaded {zip_path} to {remote_upload_path}")
-            self.logger.log(f"Uploaded {zip_path} to {remote_upload_path}")  # Debug print
+                self.logger.log_job(self.job_id, f"Uploaded {zip_path} to {remote_upload_path}")
+                self.logger.log(f"Uploaded {zip_path} to {remote_upload_path}")  # Debug print
 
-            # Fetch the remote file's SHA1 checksum
-            remote_sha1_command = ['rclone', 'hashsum', 'SHA1', f"{remote_upload_path}"]
-            result = subprocess.run(remote_sha1_command, check=True, capture_output=True, text=True)
+                if not self.verify_remote_sha1(local_sha1, remote_upload_path):
+                    raise TransferError(f"SHA1 mismatch for {remote_upload_path}")
+                self.archive_sha1 = local_sha1
 
-            # Parse the SHA1 checksum from the command output
-            if result.stdout:
-                remote_sha1 = result.stdout.split()[0]
-                self.logger.log(f"Remote SHA1 checksum: {remote_sha1}")
-
-                # Verify SHA1 checksums
-                if local_sha1 == remote_sha1:
-                    self.logger.log_job(self.job_id, "SHA1 checksum verification successful.")
-                    self.logger.log("SHA1 checksum verification successful.")
-                else:
-                    self.logger.log_job(self.job_id, "SHA1 checksum verification failed. File may be corrupted during transfer.")
-                    self.logger.log_error("SHA1 checksum verification failed. File may be corrupted during transfer.")
-            else:
-                self.logger.log_job(self.job_id, "No SHA1 checksum received from remote for file: {remote_upload_path}")
-                self.logger.log_error(f"No SHA1 checksum received from remote for file: {remote_upload_path}")
+            self.retry(upload_once, f"Upload of {os.path.basename(zip_path)}")
+            self.advance_progress(files=1, bytes_transferred=os.path.getsize(zip_path))
 
         except subprocess.CalledProcessError as e:
             self.logger.log_error(f"rclone failed to upload {zip_path}: {e}")
             self.logger.log_job(self.job_id, f"Failed to upload {zip_path}: {e}")
+            return None
         except Exception as e:
             self.logger.log_error(f"Failed to upload {zip_path}: {e}")
             self.logger.log_job(self.job_id, f"Failed to upload {zip_path}: {e}")
+            return None
+
+        return remote_upload_path
+
+    def verify_remote_sha1(self, local_sha1, remote_upload_path):
+        """Compare against the remote's SHA1; returns False only on a definite mismatch."""
+        # Fetch the remote file's SHA1 checksum
+        remote_sha1_command = ['rclone', 'hashsum', 'SHA1', f"{remote_upload_path}"]
+        with metrics.phase('remote_hash', self.operation_profile.name):
+            result = subprocess.run(remote_sha1_command, check=True, capture_output=True, text=True)
+
+        # Parse the SHA1 checksum from the command output
+        if result.stdout:
+            remote_sha1 = result.stdout.split()[0]
+            self.logger.log(f"Remote SHA1 checksum: {remote_sha1}")
+
+            # Verify SHA1 checksums
+            if local_sha1 == remote_sha1:
+                self.logger.log_job(self.job_id, "SHA1 checksum verification successful.")
+                self.logger.log("SHA1 checksum verification successful.")
+            else:
+                self.logger.log_job(self.job_id, "SHA1 checksum verification failed. File may be corrupted during transfer.")
+                self.logger.log_error("SHA1 checksum verification failed. File may be corrupted during transfer.")
+                return False
+        else:
+            self.logger.log_job(self.job_id, f"No SHA1 checksum received from remote for file: {remote_upload_path}")
+            self.logger.log_error(f"No SHA1 checksum received from remote for file: {remote_upload_path}")
+
+        return True
 
     def cleanup(self):
-        if os.path.exists(self.temp_job_directory):
-            for root, _, files in os.walk(self.temp_job_directory):
-                for file in files:
-                    try:
-                        file_path = os.path.join(root, file)
-                        os.remove(file_path)
-                        self.logger.log_job(self.job_id, f"Deleted '{file_path}'")
-                        self.logger.log(f"Deleted '{file_path}'")  # Debug print
-                    except Exception as e:
-                        self.logger.log_error(f"Failed to delete '{file_path}': {e}")
-                        self.logger.log_job(self.job_id, f"Failed to delete '{file_path}': {e}")
+        # Stop an unfinished pipeline first so no download is still writing into the workspace
+        if self.pending_downloads is not None:
+            self.pending_downloads.close()
+            self.pending_downloads = None
+
+        # Tear the whole workspace down, directories included
+        if not os.path.exists(self.temp_job_directory):
+            return
+
+        try:
+            shutil.rmtree(self.temp_job_directory)
+            self.logger.log_job(self.job_id, f"Deleted workspace '{self.temp_job_directory}'")
+            self.logger.log(f"Deleted workspace '{self.temp_job_directory}'")  # Debug print
+        except Exception as e:
+            self.logger.log_error(f"Failed to delete workspace '{self.temp_job_directory}': {e}")
+            self.logger.log_job(self.job_id, f"Failed to delete workspace '{self.temp_job_directory}': {e}")
 
     def calculate_md5(self, file_path):
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    
+        return file_digests(file_path, ('md5',), self.operation_profile.name)['md5']
+
     def calculate_sha1(self, file_path):
         """Calculate the SHA1 hash of a file."""
-        hash_sha1 = hashlib.sha1()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha1.update(chunk)
-        return hash_sha1.hexdigest()
+        return file_digests(file_path, ('sha1',), self.operation_profile.name)['sha1']
 
 # OperationProfile class
 class OperationProfile:
     # Placeholder for actual server profile logic
-    def __init__(self, name, download_path, upload_path):
+    def __init__(self, name, download_path, upload_path, concurrency=DOWNLOAD_CONCURRENCY, transfer_mode=TRANSFER_MODE, stream_upload=STREAM_UPLOAD,
+                 compression=COMPRESSION, compression_level=COMPRESSION_LEVEL,
+                 retries=TRANSFER_RETRIES, retry_backoff=TRANSFER_RETRY_BACKOFF, multi_thread_streams=None,
+                 chunk_size=TRANSFER_CHUNK_SIZE, resume_threshold=TRANSFER_RESUME_THRESHOLD, bwlimit=None):
         self.name = name
         self.download_path = download_path
         self.upload_path = upload_path
+        self.concurrency = concurrency  # Max simultaneous rclone transfers for this profile
+        self.transfer_mode = transfer_mode  # 'batch' (one rclone per job) or 'parallel' (one rclone per file)
+        self.stream_upload = stream_upload  # Zip directly into `rclone rcat` instead of a local archive
+        self.compression_policy = CompressionPolicy(compression, compression_level)
+        self.retries = retries  # Extra attempts for a failed transfer
+        self.retry_backoff = retry_backoff  # Seconds before the first retry; doubles after each attempt
+        self.multi_thread_streams = multi_thread_streams  # rclone --multi-thread-streams (None keeps rclone's default)
+        self.chunk_size = parse_size(chunk_size)  # Chunk size for resumable downloads and multi-thread transfers
+        self.resume_threshold = parse_size(resume_threshold)  # Files at least this big are downloaded resumably
+        self.bwlimit = bwlimit  # rclone --bwlimit, e.g. '10M' or '08:00,512k 19:00,off'
+
+    def rclone_flags(self, multi_thread=True):
+        flags = []
+        if self.bwlimit:
+            flags += ['--bwlimit', self.bwlimit]
+        if multi_thread and self.multi_thread_streams is not None:
+            flags += ['--multi-thread-streams', str(self.multi_thread_streams),
+                      # rclone reads a bare size as KiB
+                      '--multi-thread-chunk-size', f'{self.chunk_size}B']
+        return flags
+
+    def retry_delay(self, attempt):
+        return self.retry_backoff * 2 ** (attempt - 1)
+
+@app.route('/profiles/reload', methods=['POST'])
+def reload_profiles():
+    payload = request.get_json(silent=True) or {}
+
+    # Validate API Key
+    if payload.get('auth') != os.getenv('API_KEY'):
+        return jsonify({'message': 'Error, not-authorized'}), 403
+
+    profile_registry.reload()
+    return jsonify({
+        'message': 'Profiles reloaded',
+        'profiles': profile_registry.names(),
+        'stats': profile_registry.stats(),
+    }), 200
+
+# Columns returned by the job status endpoints; the ETag covers all of them
+JOB_STATUS_COLUMNS = '''
+    id, status, phase, files_total, files_done, bytes_transferred, attempts,
+    timestamp, start_time, end_time, progress_updated, size_bytes
+'''
+
+def job_status(row, file_progress=None):
+    job = {
+        'job_id': row['id'],
+        'status': row['status'],
+        'phase': row['phase'],
+        'files_total': row['files_total'],
+        'files_done': row['files_done'],
+        'bytes_transferred': row['bytes_transferred'],
+        'size_bytes': row['size_bytes'],
+        'attempts': row['attempts'],
+        'submitted': row['timestamp'],
+        'started': row['start_time'],
+        'ended': row['end_time'],
+        'updated': row['progress_updated'],
+    }
+    if file_progress is not None:
+        job['files'] = json.loads(file_progress or '{}')
+    return job
+
+def job_status_etag(job):
+    return hashlib.sha1(json.dumps(job, sort_keys=True).encode()).hexdigest()
+
+# Long-polls held open in this process; one that finds no slot is answered at once
+status_waiters = threading.BoundedSemaphore(JOB_STATUS_MAX_WAITERS)
+
+def is_status_request_authorized():
+    # Header only: a key in the query string would be written to every access log
+    supplied = request.headers.get('X-API-Key')
+    return supplied is not None and supplied == os.getenv('API_KEY')
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    if not is_status_request_authorized():
+        return jsonify({'message': 'Error, not-authorized'}), 403
+
+    db = get_db()
+    # Long-poll: with ?wait=N and a matching If-None-Match, hold the request until the job changes
+    wait = request.args.get('wait', 0, type=float)
+    if not math.isfinite(wait):
+        return jsonify({'message': 'Error, \'wait\' must be a number of seconds'}), 400
+    waiting = wait > 0 and status_waiters.acquire(blocking=False)
+    deadline = time.monotonic() + (min(wait, JOB_STATUS_MAX_WAIT_SECONDS) if waiting else 0)
+
+    try:
+        while True:
+            generation = progress_signal.generation
+            row = db.execute(f'''
+                SELECT {JOB_STATUS_COLUMNS}, file_progress FROM jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+            if row is None:
+                return jsonify({'message': 'Error, job not found'}), 404
+
+            job = job_status(row, row['file_progress'])
+            etag = job_status_etag(job)
+            remaining = deadline - time.monotonic()
+
+            if etag not in request.if_none_match or job['status'] in ('completed', 'failed') or remaining <= 0:
+                break
+
+            # Progress written by this process wakes us at once; re-check periodically for other processes
+            progress_signal.wait(generation, min(remaining, JOB_POLL_MIN_SECONDS))
+    finally:
+        if waiting:
+            status_waiters.release()
+
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(job)
+    response.set_etag(etag)
+    return response
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    if not is_status_request_authorized():
+        return jsonify({'message': 'Error, not-authorized'}), 403
+
+    status = request.args.get('status')
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    # Keyset pagination: pass the last job_id seen as ?before=
+    before = request.args.get('before', type=int)
+
+    conditions, params = [], []
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    if before:
+        conditions.append('id < ?')
+        params.append(before)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    rows = get_db().execute(f'''
+        SELECT {JOB_STATUS_COLUMNS} FROM jobs {where} ORDER BY id DESC LIMIT ?
+    ''', (*params, limit)).fetchall()
+
+    jobs = [job_status(row) for row in rows]
+    etag = job_status_etag(jobs)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({'jobs': jobs})
+    response.set_etag(etag)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not is_status_request_authorized():
+        return jsonify({'message': 'Error, not-authorized'}), 403
+
+    # Everything read here is in memory or an index seek, so scraping stays cheap as the tables grow
+    db = get_db()
+    counts = dict(db.execute('''
+        SELECT status, COUNT(*) FROM jobs WHERE status IN ('pending', 'in progress') GROUP BY status
+    ''').fetchall())
+    oldest = db.execute('''
+        SELECT (julianday('now') - julianday(timestamp)) * 86400 FROM jobs
+        WHERE status = 'pending' ORDER BY id ASC LIMIT 1
+    ''').fetchone()
+    events = event_sink.stats()
+    registry = profile_registry.stats()
+    admission = admission_controller.stats()
+    workspace = disk_budget.stats(db)
+    history = retention.stats()
+    page_size, page_count, free_pages = (db.execute(f'PRAGMA {pragma}').fetchone()[0]
+                                         for pragma in ('page_size', 'page_count', 'freelist_count'))
+
+    extra = [
+        ('damzipper_jobs', 'gauge', {'status': 'pending'}, counts.get('pending', 0)),
+        ('damzipper_jobs', 'gauge', {'status': 'in progress'}, counts.get('in progress', 0)),
+        ('damzipper_oldest_pending_seconds', 'gauge', {}, max(oldest[0], 0) if oldest else 0),
+        ('damzipper_workers', 'gauge', {}, sum(thread.is_alive() for thread in job_processor_threads)),
+        ('damzipper_event_queue_depth', 'gauge', {}, events['queue_depth']),
+        ('damzipper_event_flushes_total', 'counter', {}, events['flushes']),
+        ('damzipper_event_flush_failures_total', 'counter', {}, events['flush_failures']),
+        ('damzipper_event_flush_seconds_total', 'counter', {}, events['flush_seconds_total']),
+        ('damzipper_profiles', 'gauge', {}, registry['profiles']),
+        ('damzipper_profile_errors', 'gauge', {}, len(registry['errors'])),
+        ('damzipper_profile_lookups_total', 'counter', {}, registry['lookups']),
+        ('damzipper_profile_reloads_total', 'counter', {}, registry['reloads']),
+        ('damzipper_digest_cache_entries', 'gauge', {}, len(digest_cache.entries)),
+        ('damzipper_admission_buckets', 'gauge', {}, admission['buckets']),
+        ('damzipper_admission_pending', 'gauge', {}, admission['pending']),
+        ('damzipper_admission_rejected_total', 'counter', {}, admission['rejected']),
+        ('damzipper_workspace_capacity_bytes', 'gauge', {}, workspace['capacity']),
+        ('damzipper_workspace_reserved_bytes', 'gauge', {}, workspace['reserved']),
+        ('damzipper_workspace_jobs', 'gauge', {}, workspace['jobs']),
+        ('damzipper_workspace_deferred_total', 'counter', {}, workspace['deferred']),
+        ('damzipper_db_size_bytes', 'gauge', {}, page_size * page_count),
+        ('damzipper_db_free_bytes', 'gauge', {}, page_size * free_pages),
+        ('damzipper_retention_runs_total', 'counter', {}, history['runs']),
+        ('damzipper_retention_failures_total', 'counter', {}, history['failures']),
+        ('damzipper_retention_deduped_total', 'counter', {}, history['deduped']),
+    ]
+    extra += [('damzipper_retention_deleted_total', 'counter', {'table': table}, history['deleted'].get(table, 0))
+              for table in Retention.TABLES]
+    extra += [('damzipper_retention_archived_total', 'counter', {'table': table}, history['archived'].get(table, 0))
+              for table in Retention.TABLES]
+    return app.response_class(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+# Refills `rate` tokens per minute up to `burst`; each admitted request takes one
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Take a token; returns 0 if one was available, else the seconds until there is one."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+# Decides whether /submit_job may queue another job. Rate limits are in-memory token buckets per
+# client IP and per API key, warmed from the recent rows of the requests table so a restart
+# doesn't hand out fresh bursts. The pending-job count is read from the jobs table at most every
+# ADMISSION_PENDING_REFRESH_SECONDS and counted locally in between.
+class AdmissionController:
+    MAX_BUCKETS = 10000
+
+    def __init__(self, ip_rate, key_rate, burst, max_pending, refresh_seconds):
+        self.rates = {'ip': ip_rate, 'key': key_rate}
+        self.burst = burst
+        self.max_pending = max_pending
+        self.refresh_seconds = refresh_seconds
+        self.buckets = {}  # (kind, identity) -> TokenBucket
+        self.lock = threading.Lock()
+        self.warmed = False
+        self.pending = 0
+        self.pending_checked = None
+        self.rejected = 0
+
+    def warm(self, db, request_id):
+        # Replay the last minute of submissions before this request against the IP buckets.
+        # Walking back by id keeps this on the primary key instead of scanning for timestamps.
+        rows = db.execute('''
+            SELECT source_ip FROM requests
+            WHERE id > ? AND id < ?
+              AND request_url IN ('/submit_job', '/submit_jobs') AND timestamp >= datetime('now', '-60 seconds')
+        ''', (request_id - self.MAX_BUCKETS, request_id)).fetchall()
+        now = time.monotonic()
+        for row in rows:
+            self.bucket('ip', row['source_ip'], now).tokens -= 1
+        self.warmed = True
+
+    def bucket(self, kind, identity, now):
+        key = (kind, identity)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.MAX_BUCKETS:
+                # Forget clients whose buckets have refilled; they behave like new ones anyway
+                for stale_key, stale in list(self.buckets.items()):
+                    stale.refill(now)
+                    if stale.tokens >= stale.burst:
+                        del self.buckets[stale_key]
+            bucket = self.buckets[key] = TokenBucket(self.rates[kind], self.burst, now)
+        return bucket
+
+    def check_rate(self, db, request_id, kind, identity):
+        """Returns 0 if the client may submit, else the seconds it should wait."""
+        if not self.rates[kind]:
+            return 0
+        with self.lock:
+            if not self.warmed:
+                self.warm(db, request_id)
+            now = time.monotonic()
+            retry_after = self.bucket(kind, identity, now).take(now)
+            if retry_after:
+                self.rejected += 1
+            return retry_after
+
+    def queue_capacity(self, db):
+        """How many more jobs fit under MAX_PENDING_JOBS, or None if there is no limit."""
+        if not self.max_pending:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            if self.pending_checked is None or now - self.pending_checked >= self.refresh_seconds:
+                # Served by idx_jobs_status_id without touching the table
+                self.pending = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+                self.pending_checked = now
+            return max(0, self.max_pending - self.pending)
+
+    def check_queue(self, db):
+        """Returns True if another job fits under MAX_PENDING_JOBS."""
+        if self.queue_capacity(db) != 0:
+            return True
+        with self.lock:
+            self.rejected += 1
+        return False
+
+    def admitted(self, count=1):
+        with self.lock:
+            self.pending += count
+
+    def stats(self):
+        with self.lock:
+            return {'buckets': len(self.buckets), 'pending': self.pending, 'rejected': self.rejected}
+
+admission_controller = AdmissionController(ADMISSION_IP_PER_MINUTE, ADMISSION_KEY_PER_MINUTE, ADMISSION_BURST,
+                                           MAX_PENDING_JOBS, ADMISSION_PENDING_REFRESH_SECONDS)
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES or None
+
+def too_many_requests(logger, request_id, message, retry_after):
+    logger.update_log_request_response_status(request_id, 429)
+    response = jsonify({'message': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def validate_job_payload(payload):
+    """Check one job's files, server, token and options; returns an error message, or None if it is valid."""
+    if not isinstance(payload, dict):
+        return 'Error, job must be a JSON object'
+
+    if not isinstance(payload.get('files'), dict) or not payload['files']:
+        return 'Error, \'files\' array is empty or invalid'
+
+    if not payload.get('server'):
+        return 'Error, \'server\' string is empty'
+
+    if not payload.get('token'):
+        return 'Error, \'token\' string is empty'
+
+    if MAX_FILES_PER_JOB and len(payload['files']) > MAX_FILES_PER_JOB:
+        return f'Error, a job may have at most {MAX_FILES_PER_JOB} files'
+
+    if not isinstance(payload.get('profiler', False), bool):
+        return 'Error, \'profiler\' must be true or false'
+
+    # Optional; higher runs first
+    priority = payload.get('priority', 0)
+    if type(priority) is not int or abs(priority) > JOB_PRIORITY_LIMIT:
+        return f'Error, \'priority\' must be an integer from -{JOB_PRIORITY_LIMIT} to {JOB_PRIORITY_LIMIT}'
+
+    return None
 
 @app.route('/submit_job', methods=['POST'])
 def submit_job():
@@ -320,142 +2119,864 @@ def submit_job():
         if not request_id:
             return jsonify({'message': 'Error occurred during request submission'}), 400
 
+        # Per-client rate limit comes first so a flood of bad requests is cut off cheaply
+        db = get_db()
+        retry_after = admission_controller.check_rate(db, request_id, 'ip', request.remote_addr)
+        if retry_after:
+            return too_many_requests(logger, request_id, 'Error, rate limit exceeded', retry_after)
+
         # Validate API Key
         if payload.get('auth') != os.getenv('API_KEY'):
             return jsonify({'message': 'Error, not-authorized'}), 403
 
         # Validate payload
-        if not isinstance(payload.get('files'), dict) or not payload['files']:
-            return jsonify({'message': 'Error, \'files\' array is empty or invalid'}), 400
-        
-        if not payload.get('server'):
-            return jsonify({'message': 'Error, \'server\' string is empty'}), 400
-
-        if not payload.get('token'):
-            return jsonify({'message': 'Error, \'token\' string is empty'}), 400
+        error = validate_job_payload(payload)
+        if error:
+            return jsonify({'message': error}), 400
 
         operation_profile = get_operation_profile_by_name(payload['server'])
         if not operation_profile:
             return jsonify({'message': 'Failed to match server-operation profile'}), 400
 
+        retry_after = admission_controller.check_rate(db, request_id, 'key', hashlib.sha256(payload['auth'].encode()).hexdigest())
+        if retry_after:
+            return too_many_requests(logger, request_id, 'Error, rate limit exceeded', retry_after)
+
+        if not admission_controller.check_queue(db):
+            return too_many_requests(logger, request_id, 'Error, job queue is full', ADMISSION_QUEUE_RETRY_AFTER)
+
         # Create a new job record
-        job_id = logger.create_job_record(request_id, json.dumps(payload))
-        logger.update_log_request_response_status(request_id, 201)
+        job_id = logger.create_job_record(request_id, json.dumps(payload), payload.get('priority', 0), operation_profile.name, len(payload['files']))
+        logger.update_log_request_response_status(request_id, 201, drop_raw=True)
+        admission_controller.admitted()
+        job_signal.notify()
 
         return jsonify({'message': 'Job submitted successfully', 'job_id': job_id}), 201
-    
+
+    except RequestEntityTooLarge:
+        return jsonify({'message': f'Error, request body is larger than {MAX_REQUEST_BYTES} bytes'}), 413
     except Exception as e:
         logger.log_error(f"Unexpected error: {str(e)}")
         return jsonify({'message': 'Unexpected error occurred'}), 500
 
-def job_processor():
-    with app.app_context():  # Create an application context
+def read_ndjson(stream, max_line_bytes):
+    """Yield (payload, error) for each non-blank line of an NDJSON stream, holding one line at a time."""
+    limit = max_line_bytes + 1 if max_line_bytes else -1
+    while True:
+        line = stream.readline(limit)
+        if not line:
+            return
+        if max_line_bytes and len(line) > max_line_bytes:
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(limit)
+            yield None, f'Error, job is larger than {max_line_bytes} bytes'
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError:
+            yield None, 'Error, line is not valid JSON'
+
+@app.route('/submit_jobs', methods=['POST'])
+def submit_jobs():
+    """Submit many jobs in one call, from {"auth": ..., "jobs": [...]} or an NDJSON body with one job per line."""
+    logger = Logger()
+    # NDJSON is read as it arrives, so a batch can be far larger than MAX_REQUEST_BYTES
+    streamed = request.mimetype in ('application/x-ndjson', 'application/jsonl')
+
+    try:
+        if streamed:
+            request.max_content_length = MAX_BULK_REQUEST_BYTES or None
+            auth = request.headers.get('X-API-Key')
+            items = read_ndjson(request.stream, MAX_REQUEST_BYTES)
+        else:
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict) or not isinstance(body.get('jobs'), list):
+                return jsonify({'message': 'Error, \'jobs\' array is missing or invalid'}), 400
+            auth = request.headers.get('X-API-Key') or body.get('auth')
+            items = ((payload, None) for payload in body['jobs'])
+
+        # The jobs themselves are stored on their rows; the request row only records the call
+        request_id = logger.log_request(
+            source_ip=request.remote_addr,
+            user_agent=request.headers.get('User-Agent'),
+            method=request.method,
+            request_url=request.path,
+        )
+
+        db = get_db()
+        retry_after = admission_controller.check_rate(db, request_id, 'ip', request.remote_addr)
+        if retry_after:
+            return too_many_requests(logger, request_id, 'Error, rate limit exceeded', retry_after)
+
+        if not auth or auth != os.getenv('API_KEY'):
+            logger.update_log_request_response_status(request_id, 403)
+            return jsonify({'message': 'Error, not-authorized'}), 403
+
+        retry_after = admission_controller.check_rate(db, request_id, 'key', hashlib.sha256(auth.encode()).hexdigest())
+        if retry_after:
+            return too_many_requests(logger, request_id, 'Error, rate limit exceeded', retry_after)
+
+        # Each profile is looked up once per call, and rows are written BULK_SUBMIT_CHUNK at a time
+        # when streaming (so the write lock isn't held while the client uploads) or all at once
+        results = []
+        profiles = {}
+        capacity = admission_controller.queue_capacity(db)
+        batch = []
+        created = 0
+        queue_full = False
+
+        def insert_batch():
+            nonlocal created
+            if not batch:
+                return
+            try:
+                job_ids = logger.create_job_records([row for _, row in batch])
+                for (index, _), job_id in zip(batch, job_ids):
+                    results[index] = {'index': index, 'job_id': job_id}
+                created += len(batch)
+                admission_controller.admitted(len(batch))
+                job_signal.notify()
+            except sqlite3.Error as e:
+                logger.log_error(f"Failed to create {len(batch)} jobs: {e}")
+                for index, _ in batch:
+                    results[index] = {'index': index, 'error': 'Error, job could not be stored'}
+            batch.clear()
+
+        try:
+            for index, (payload, error) in enumerate(items):
+                if index >= BULK_SUBMIT_MAX_JOBS:
+                    results.append({'index': index, 'error': f'Error, a request may submit at most {BULK_SUBMIT_MAX_JOBS} jobs'})
+                    break
+
+                error = error or validate_job_payload(payload)
+                if error is None:
+                    server = payload['server']
+                    if server not in profiles:
+                        profiles[server] = get_operation_profile_by_name(server)
+                    if not profiles[server]:
+                        error = 'Failed to match server-operation profile'
+                if error is None and capacity is not None and created + len(batch) >= capacity:
+                    error = 'Error, job queue is full'
+                    queue_full = True
+
+                if error is not None:
+                    results.append({'index': index, 'error': error})
+                    continue
+
+                payload.pop('auth', None)
+                results.append(None)
+                batch.append((index, (request_id, json.dumps(payload), payload.get('priority', 0),
+                                      profiles[payload['server']].name, len(payload['files']))))
+                if streamed and len(batch) >= BULK_SUBMIT_CHUNK:
+                    insert_batch()
+        except RequestEntityTooLarge:
+            # Jobs already committed stay submitted; report where the body was cut off
+            results.append({'index': len(results), 'error': f'Error, request body is larger than {MAX_BULK_REQUEST_BYTES} bytes; nothing after this was read'})
+        insert_batch()
+
+        if queue_full:
+            with admission_controller.lock:
+                admission_controller.rejected += 1
+
+        status = 201 if created and created == len(results) else 207 if created else 400
+        logger.update_log_request_response_status(request_id, status)
+
+        if streamed:
+            response = app.response_class((json.dumps(result) + '\n' for result in results), mimetype='application/x-ndjson')
+        else:
+            response = jsonify({'message': f'Submitted {created} of {len(results)} jobs', 'submitted': created,
+                                'failed': len(results) - created, 'jobs': results})
+        response.status_code = status
+        if queue_full:
+            response.headers['Retry-After'] = str(ADMISSION_QUEUE_RETRY_AFTER)
+        return response
+
+    except RequestEntityTooLarge:
+        limit = MAX_BULK_REQUEST_BYTES if streamed else MAX_REQUEST_BYTES
+        return jsonify({'message': f'Error, request body is larger than {limit} bytes'}), 413
+    except Exception as e:
+        logger.log_error(f"Unexpected error: {str(e)}")
+        return jsonify({'message': 'Unexpected error occurred'}), 500
+
+# Wakes idle job workers in this process as soon as a job is submitted
+class JobSignal:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.generation = 0
+
+    def notify(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """Block until notify() is called after `generation` was read, or until timeout."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.generation != generation, timeout)
+
+job_signal = JobSignal()
+
+# Wakes long-polling status requests in this process whenever a job's progress is written
+progress_signal = JobSignal()
+
+def select_next_job(db, budget=None):
+    """Choose the next job to run; returns its id or None.
+
+    Jobs with an expired lease come first, as they were already started. Then the oldest pending
+    job if it has waited JOB_STARVATION_SECONDS, so nothing waits forever. Otherwise each profile
+    offers its best pending job (highest priority, then fewest files, then oldest) and the
+    highest priority wins, ties going to the profile with the fewest running jobs, then the
+    smaller job. Every query is a seek on idx_jobs_status_id or idx_jobs_schedule.
+
+    With a DiskBudget, jobs already sized at more workspace than the running jobs (in any
+    process) leave available are passed over, except that a starving job holds everything else
+    back until it fits.
+    """
+    job = db.execute('''
+        SELECT id FROM jobs
+        WHERE status = 'in progress' AND (lease_expires IS NULL OR lease_expires < CURRENT_TIMESTAMP)
+        ORDER BY id ASC
+        LIMIT 1
+    ''').fetchone()
+    if job is not None:
+        return job['id']
+
+    oldest = db.execute('''
+        SELECT id, workspace_bytes, timestamp < datetime('now', ?) AS starving FROM jobs
+        WHERE status = 'pending'
+        ORDER BY id ASC
+        LIMIT 1
+    ''', (f'-{JOB_STARVATION_SECONDS} seconds',)).fetchone()
+    if oldest is None:
+        return None
+
+    available = budget.available(db) if budget is not None else None
+    if oldest['starving']:
+        # A job that can never fit is claimed anyway so it fails instead of blocking the queue
+        if available is None or (oldest['workspace_bytes'] or 0) <= available or oldest['workspace_bytes'] > budget.ceiling():
+            return oldest['id']
+        return None
+
+    running = dict(db.execute('''
+        SELECT profile, COUNT(*) FROM jobs WHERE status = 'in progress' GROUP BY profile
+    ''').fetchall())
+
+    # Skip-scan the index for the distinct profiles with pending work, starting with jobs from
+    # before profiles were recorded
+    heads = []
+    profile = None
+    while True:
+        head = db.execute('''
+            SELECT id, profile, priority, size_estimate FROM jobs
+            WHERE status = 'pending' AND profile IS ?
+              AND (? IS NULL OR workspace_bytes IS NULL OR workspace_bytes <= ?)
+            ORDER BY priority DESC, size_estimate ASC, id ASC
+            LIMIT 1
+        ''', (profile, available, available)).fetchone()
+        if head is not None and not (JOB_MAX_RUNNING_PER_PROFILE and running.get(profile, 0) >= JOB_MAX_RUNNING_PER_PROFILE):
+            heads.append(head)
+
+        following = db.execute('''
+            SELECT profile FROM jobs WHERE status = 'pending' AND profile > ? ORDER BY profile LIMIT 1
+        ''', (profile or '',)).fetchone()
+        if following is None:
+            break
+        profile = following['profile']
+
+    if not heads:
+        return None
+
+    best = min(heads, key=lambda head: (-head['priority'], running.get(head['profile'], 0), head['size_estimate'], head['id']))
+    return best['id']
+
+def claim_next_job(db, worker_id):
+    """Atomically claim the next runnable job for this worker; returns (job_id, payload) or None."""
+    with metrics.timer('damzipper_db_seconds', operation='claim'):
+        return claim_job(db, worker_id)
+
+def claim_job(db, worker_id):
+    while True:
+        job_id = select_next_job(db, disk_budget)
+
+        if job_id is None:
+            return None
+
+        # The conditional UPDATE only succeeds for one worker; anyone who lost the race picks again
+        with db:
+            cursor = db.execute('''
+                UPDATE jobs SET status = 'in progress', worker_id = ?, attempts = attempts + 1,
+                                lease_expires = datetime('now', ?), start_time = CURRENT_TIMESTAMP,
+                                phase = 'claimed', files_done = 0, bytes_transferred = 0, downloaded_bytes = 0,
+                                progress_updated = CURRENT_TIMESTAMP
+                WHERE id = ?
+                  AND (status = 'pending'
+                       OR (status = 'in progress' AND (lease_expires IS NULL OR lease_expires < CURRENT_TIMESTAMP)))
+            ''', (worker_id, f'+{JOB_LEASE_SECONDS} seconds', job_id))
+
+        if cursor.rowcount != 1:
+            continue
+
+        claimed = db.execute('''
+            SELECT id, message, attempts, profile, (julianday('now') - julianday(timestamp)) * 86400 AS waited
+            FROM jobs WHERE id = ?
+        ''', (job_id,)).fetchone()
+
+        if claimed['attempts'] > JOB_MAX_ATTEMPTS:
+            # Keeps dying with whichever worker runs it; give up instead of retrying forever
+            Logger().log_job(claimed['id'], f"Giving up after {JOB_MAX_ATTEMPTS} attempts")
+            finish_job(db, claimed['id'], worker_id, 'failed')
+            continue
+
+        if claimed['attempts'] > 1:
+            Logger().log_job(claimed['id'], f"Reclaimed expired lease (attempt {claimed['attempts']})")
+        else:
+            metrics.observe('damzipper_job_queue_seconds', max(claimed['waited'], 0), profile=claimed['profile'] or '')
+
+        return claimed['id'], claimed['message']
+
+def finish_job(db, job_id, worker_id, status):
+    # The job's events are on disk before anyone can see it finished
+    Logger().flush_job_events()
+    metrics.inc('damzipper_jobs_finished_total', status=status)
+
+    # Only the lease holder may finish a job; a worker whose lease was reclaimed changes nothing
+    with db:
+        db.execute('''
+            UPDATE jobs SET status = ?, phase = ?, end_time = CURRENT_TIMESTAMP, lease_expires = NULL,
+                            progress_updated = CURRENT_TIMESTAMP
+            WHERE id = ? AND worker_id = ?
+        ''', (status, status, job_id, worker_id))
+    progress_signal.notify()
+
+def defer_job(db, job_id, worker_id):
+    """Put a claimed job back in the queue without counting the attempt."""
+    Logger().flush_job_events()
+    with db:
+        db.execute('''
+            UPDATE jobs SET status = 'pending', phase = 'deferred', worker_id = NULL, lease_expires = NULL,
+                            start_time = NULL, attempts = attempts - 1, progress_updated = CURRENT_TIMESTAMP
+            WHERE id = ? AND worker_id = ?
+        ''', (job_id, worker_id))
+    progress_signal.notify()
+
+def record_job_size(db, job_id, size_bytes, workspace_bytes):
+    with db:
+        db.execute('UPDATE jobs SET size_bytes = ?, workspace_bytes = ? WHERE id = ?', (size_bytes, workspace_bytes, job_id))
+
+def find_job_result(db, fingerprint):
+    return db.execute('SELECT job_id, remote_path, sha1 FROM job_results WHERE fingerprint = ?', (fingerprint,)).fetchone()
+
+def record_job_result(db, fingerprint, job_id, remote_path, sha1):
+    # The newest upload is the one most likely to still be on the remote
+    with db:
+        db.execute('''
+            INSERT OR REPLACE INTO job_results (fingerprint, job_id, remote_path, sha1, created)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (fingerprint, job_id, remote_path, sha1))
+
+# Keeps the history tables from growing without bound. A background thread deletes rows past
+# their table's age or row limit in short batched transactions, optionally archiving them to
+# gzipped NDJSON first, then returns the freed pages to the filesystem with incremental vacuums.
+class Retention:
+    # Unfinished jobs and the requests behind them are never pruned
+    TABLES = ('events', 'jobs', 'requests')
+
+    def __init__(self, policies, interval, batch_rows, pause, archive_dir, vacuum_pages):
+        self.policies = policies  # table -> {'days': ..., 'max_rows': ...}; 0 or a missing key disables a limit
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self.pause = pause
+        self.archive_dir = archive_dir
+        self.vacuum_pages = vacuum_pages
+        self.lock = threading.Lock()
+        self.thread = None
+        self.deduped_id = 0  # Requests up to this id no longer duplicate their job's payload
+        # Metrics
+        self.runs = 0
+        self.failures = 0
+        self.deleted = collections.Counter()
+        self.archived = collections.Counter()
+        self.deduped = 0
+        self.vacuumed_pages = 0
+
+    def start(self):
+        with self.lock:
+            if self.interval and (self.thread is None or not self.thread.is_alive()):
+                self.thread = threading.Thread(target=self.run, name="retention", daemon=True)
+                self.thread.start()
+
+    def run(self):
         while True:
-            db = get_db()
+            try:
+                self.run_once(thread_db())
+            except Exception as e:
+                self.failures += 1
+                Logger().log_error(f"Retention pass failed: {e}")
+            time.sleep(self.interval)
+
+    def run_once(self, db, now=None):
+        """Prune, deduplicate and vacuum once; returns the rows deleted per table. `now` is a UTC datetime."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        deleted = {table: self.prune(db, table, now, **self.policies.get(table, {})) for table in self.TABLES}
+        self.dedupe_payloads(db)
+        self.vacuum(db)
+        self.runs += 1
+        return deleted
+
+    def prune(self, db, table, now, days=0, max_rows=0):
+        if not days and not max_rows:
+            return 0
+
+        # Ids and timestamps both grow with every insert, so rows past either limit are all at the
+        # front of the table and each batch is a short primary-key range scan
+        cutoff = None
+        if days:
+            cutoff = (now - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        last_id = db.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+        row_cutoff_id = last_id - max_rows if max_rows else 0
+
+        def expired(row):
+            return row['id'] <= row_cutoff_id or (cutoff is not None and row['timestamp'] < cutoff)
+
+        deleted = 0
+        after_id = 0
+        while True:
+            with metrics.timer('damzipper_db_seconds', operation='retention'), db:
+                # Read and delete under one write lock, so two processes never archive the same rows
+                db.execute('BEGIN IMMEDIATE')
+                rows = db.execute(f'SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?', (after_id, self.batch_rows)).fetchall()
+                candidates = list(itertools.takewhile(expired, rows))
+                doomed = self.deletable(db, table, candidates)
+                if doomed:
+                    if self.archive_dir:
+                        self.archive(table, doomed)
+                    db.executemany(f'DELETE FROM {table} WHERE id = ?', [(row['id'],) for row in doomed])
+
+            deleted += len(doomed)
+            self.deleted[table] += len(doomed)
+            if len(candidates) < len(rows) or len(rows) < self.batch_rows:
+                return deleted
+            after_id = rows[-1]['id']
+            # Let writers in between batches
+            time.sleep(self.pause)
+
+    def deletable(self, db, table, rows):
+        if table == 'jobs':
+            return [row for row in rows if row['status'] in ('completed', 'failed')]
+        if table == 'requests' and rows:
+            ids = [row['id'] for row in rows]
+            active = {row[0] for row in db.execute(f'''
+                SELECT request_id FROM jobs
+                WHERE request_id IN ({','.join('?' * len(ids))}) AND status IN ('pending', 'in progress')
+            ''', ids)}
+            return [row for row in rows if row['id'] not in active]
+        return rows
+
+    def archive(self, table, rows):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        day = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+        path = os.path.join(self.archive_dir, f'{table}-{day}.ndjson.gz')
+        # Each batch is appended as its own gzip member; gzip, zcat and gzip.open read them as one stream
+        with open(path, 'ab') as f:
+            with gzip.GzipFile(fileobj=f, mode='wb') as archive:
+                for row in rows:
+                    archive.write(json.dumps(dict(row)).encode() + b'\n')
+            f.flush()
+            # On disk before the rows are deleted
+            os.fsync(f.fileno())
+        self.archived[table] += len(rows)
+
+    def dedupe_payloads(self, db):
+        """Drop request_raw from requests whose job stores the same payload; walks each id once per process."""
+        last_id = db.execute('SELECT MAX(id) FROM requests').fetchone()[0] or 0
+        while self.deduped_id < last_id:
+            upper = self.deduped_id + self.batch_rows
             with db:
-                # Fetch the next pending job
-                job = db.execute('''
-                    SELECT id, message FROM jobs WHERE status = 'pending'
-                    ORDER BY id ASC
-                    LIMIT 1
-                ''').fetchone()
-
-                if job:
-                    job_id, job_payload = job
-                    logger = Logger()
-                    payload = json.loads(job_payload)
-                    files = payload.get('files', {})
-                    server = payload.get('server', '')
-                    token = payload.get('token', '')
-
-                    if not files or not server or not token:
-                        # missing data to continue
-                        # Update job status to 'failed' and record end time
-                        db.execute('''
-                            UPDATE jobs SET status = 'failed', end_time = CURRENT_TIMESTAMP
-                            WHERE id = ?
-                        ''', (job_id,))
+                cursor = db.execute('''
+                    UPDATE requests SET request_raw = NULL
+                    WHERE id > ? AND id <= ? AND request_raw IS NOT NULL
+                      AND EXISTS (SELECT 1 FROM jobs WHERE jobs.request_id = requests.id AND jobs.message = requests.request_raw)
+                ''', (self.deduped_id, upper))
+            self.deduped += cursor.rowcount
+            self.deduped_id = upper
+            if cursor.rowcount:
+                time.sleep(self.pause)
+
+    def vacuum(self, db):
+        """Return free pages to the filesystem, RETENTION_VACUUM_PAGES per write transaction."""
+        if not self.vacuum_pages or db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return
+        while True:
+            free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free_pages:
+                return
+            db.execute(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})').fetchall()
+            self.vacuumed_pages += min(free_pages, self.vacuum_pages)
+            time.sleep(self.pause)
+
+    def stats(self):
+        return {'runs': self.runs, 'failures': self.failures, 'deleted': dict(self.deleted),
+                'archived': dict(self.archived), 'deduped': self.deduped, 'vacuumed_pages': self.vacuumed_pages}
+
+retention = Retention(RETENTION_POLICIES, RETENTION_INTERVAL_SECONDS, RETENTION_BATCH_ROWS, RETENTION_BATCH_PAUSE,
+                      RETENTION_ARCHIVE_DIR, RETENTION_VACUUM_PAGES)
+
+# Tracks a running job's phase and counters and writes them to its jobs row. Each write is
+# its own short transaction, throttled to one per PROGRESS_WRITE_SECONDS except on phase changes.
+class JobProgress:
+    def __init__(self, job_id, worker_id, files_total=0):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.phase = None
+        self.files_total = files_total
+        self.files_done = 0
+        self.bytes_transferred = 0
+        self.downloaded_bytes = 0  # Written to the workspace; bytes_transferred also counts uploads
+        self.file_states = {}  # Remote file -> last state ('downloaded', 'cached', 'zipped', 'failed')
+        self.last_write = 0
+
+    def set_phase(self, phase, files_total=None):
+        self.phase = phase
+        self.files_done = 0
+        if files_total is not None:
+            self.files_total = files_total
+        self.write()
+
+    def advance(self, files=0, bytes_transferred=0, remote_file=None, state=None, downloaded_bytes=0):
+        self.files_done += files
+        self.bytes_transferred += bytes_transferred
+        self.downloaded_bytes += downloaded_bytes
+        if remote_file is not None:
+            self.file_states[remote_file] = state
+        if time.monotonic() - self.last_write >= PROGRESS_WRITE_SECONDS:
+            self.write()
+
+    def write(self):
+        self.last_write = time.monotonic()
+        try:
+            db = thread_db()
+            with metrics.timer('damzipper_db_seconds', operation='progress'), db:
+                db.execute('''
+                    UPDATE jobs SET phase = ?, files_total = ?, files_done = ?, bytes_transferred = ?,
+                                    downloaded_bytes = ?, file_progress = ?, progress_updated = CURRENT_TIMESTAMP
+                    WHERE id = ? AND worker_id = ?
+                ''', (self.phase, self.files_total, self.files_done, self.bytes_transferred,
+                      self.downloaded_bytes, json.dumps(self.file_states), self.job_id, self.worker_id))
+            progress_signal.notify()
+        except sqlite3.Error as e:
+            # Progress is informational; never fail a job over it
+            Logger().log_error(f"Failed to record progress for job {self.job_id}: {e}")
+
+# Keeps a claimed job's lease alive from a side thread while the worker is busy with it
+class JobLease:
+    def __init__(self, job_id, worker_id):
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.renew, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+    def renew(self):
+        db = connect_db()
+        try:
+            while not self.stopped.wait(JOB_LEASE_SECONDS / 3):
+                with db:
+                    db.execute('''
+                        UPDATE jobs SET lease_expires = datetime('now', ?)
+                        WHERE id = ? AND worker_id = ? AND status = 'in progress'
+                    ''', (f'+{JOB_LEASE_SECONDS} seconds', self.job_id, self.worker_id))
+        except sqlite3.Error as e:
+            Logger().log_error(f"Failed to renew lease for job {self.job_id}: {e}")
+        finally:
+            db.close()
+
+# Samples one thread's stack every `interval` seconds while a job runs, then writes the tallies
+# to JOB_PROFILER_DIR as folded stacks ("outer;inner count" lines, the format flamegraph.pl and
+# speedscope read). Only the job's worker thread is sampled: waits on rclone show up as
+# subprocess frames, and pool threads and zip processes are not included.
+class StackSampler:
+    def __init__(self, job_id, thread_id, interval):
+        self.job_id = job_id
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name=f"job-{job_id}-sampler", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        try:
+            self.write()
+        except OSError as e:
+            Logger().log_error(f"Failed to write profile for job {self.job_id}: {e}")
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def write(self):
+        total = sum(self.stacks.values())
+        if not total:
+            return None
+
+        os.makedirs(JOB_PROFILER_DIR, exist_ok=True)
+        path = os.path.join(JOB_PROFILER_DIR, f'job-{self.job_id}.folded')
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        # Where the thread actually was, as opposed to everything below it on the stack
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        top = ', '.join(f'{frame} {count * 100 // total}%' for frame, count in leaves.most_common(5))
+        Logger().log_job(self.job_id, f"Profiler: {total} samples written to {path}; top frames: {top}")
+        return path
+
+def build_archive(file_ops, progress, files, token):
+    """Download, zip and upload a job's files; returns the remote path of the archive or None."""
+    if PIPELINE_STAGES:
+        # Each file goes into the zip as soon as it lands; with STREAM_UPLOAD the upload
+        # runs at the same time too, so the job takes about as long as its slowest stage
+        progress.set_phase('pipelining', len(files))
+        file_ops.start_pipeline(files)
+    else:
+        # Perform the download
+        progress.set_phase('downloading', len(files))
+        file_ops.download(files)
+
+        if file_ops.failed_downloads:
+            # Everything is downloaded before zipping, so an incomplete job stops here, before any archive exists
+            file_ops.logger.log_job(file_ops.job_id, f"{len(file_ops.failed_downloads)} files could not be downloaded; not uploading an incomplete archive")
+            return None
+
+        progress.set_phase('zipping', len(file_ops.downloaded_files))
+
+    if file_ops.operation_profile.stream_upload:
+        # Zip straight into the remote; there is no local archive to upload
+        return file_ops.zip_and_upload(token)
+
+    # Perform the zipping
+    zip_path = file_ops.zip(token)
+    if zip_path is None:
+        return None
+
+    # Only proceed if zipping was successful
+    progress.set_phase('uploading', 1)
+    return file_ops.upload(zip_path)
+
+def process_job(db, job_id, job_payload, worker_id, download_slot=None):
+    logger = Logger()
+    payload = json.loads(job_payload)
+    files = payload.get('files', {})
+    server = payload.get('server', '')
+    token = payload.get('token', '')
+
+    if not files or not server or not token:
+        # missing data to continue
+        finish_job(db, job_id, worker_id, 'failed')
+        return
+
+    try:
+        # Process the job
+        operation_profile = get_operation_profile_by_name(server)
+
+        if not operation_profile:
+            logger.log_error(f"Failed to match operation profile '{server}'")
+            logger.log_job(job_id, f"Failed to match operation profile '{server}'")
+            finish_job(db, job_id, worker_id, 'failed')
+            return
+
+        print("STARTING TO PROCESS A JOB...")
+        current_thread = threading.current_thread()
+        print(f"\tWorker ID: {worker_id}")
+        print(f"\tCurrent Thread Name: {current_thread.name}")
+        print(f"\tCurrent Thread ID: {current_thread.ident}")
+
+        progress = JobProgress(job_id, worker_id)
+        file_ops = FileOps(operation_profile, logger, job_id, progress)
+        if download_slot is not None:
+            # Let the next job start downloading while this one zips and uploads
+            file_ops.on_downloads_done = download_slot.release
+
+        sampler = contextlib.nullcontext()
+        if JOB_PROFILER or payload.get('profiler'):
+            sampler = StackSampler(job_id, threading.get_ident(), JOB_PROFILER_INTERVAL)
+
+        started = time.perf_counter()
+        deferred = False
+        with JobLease(job_id, worker_id), sampler:
+            try:
+                # Plan: an earlier job may already have produced this exact archive
+                progress.set_phase('planning', len(files))
+                fingerprint = file_ops.fingerprint(files)
+                result = find_job_result(db, fingerprint) if fingerprint else None
+
+                remote_path = None
+                if result is not None:
+                    logger.log_job(job_id, f"Job matches the archive from job {result['job_id']}")
+                    remote_path = file_ops.reuse_result(result['remote_path'], result['sha1'], token)
+
+                if remote_path is None:
+                    # The listing that fingerprinted the job also sizes it; it only starts once its
+                    # workspace fits next to the other running jobs
+                    size_bytes, workspace_bytes = file_ops.workspace_estimate(files)
+                    record_job_size(db, job_id, size_bytes, workspace_bytes)
+                    if disk_budget.reserve(db, job_id, worker_id, workspace_bytes or 0):
+                        remote_path = build_archive(file_ops, progress, files, token)
+                    elif workspace_bytes is not None and workspace_bytes > disk_budget.ceiling():
+                        logger.log_job(job_id, f"Job needs {workspace_bytes} bytes of workspace, more than the {disk_budget.ceiling()} bytes jobs may ever use")
                     else:
-                        # Update job status to 'in progress' and record start time
-                        db.execute('''
-                            UPDATE jobs SET status = 'in progress', start_time = CURRENT_TIMESTAMP
-                            WHERE id = ?
-                        ''', (job_id,))
+                        # Only too large for now (other jobs, the download cache, another process),
+                        # or the lease was lost before the reservation; either way it goes back in the queue
+                        logger.log_job(job_id, f"Deferred: job needs {workspace_bytes or 0} bytes of workspace, {disk_budget.available(db, exclude=job_id)} available")
+                        metrics.inc('damzipper_jobs_deferred_total', profile=operation_profile.name)
+                        deferred = True
+
+                if remote_path is not None and fingerprint and file_ops.archive_sha1:
+                    record_job_result(db, fingerprint, job_id, remote_path, file_ops.archive_sha1)
+            finally:
+                # The workspace goes whether or not the job succeeded
+                progress.set_phase('cleanup')
+                file_ops.cleanup()
+                if disk_budget.release(db, job_id):
+                    # Jobs deferred for lack of space may fit now
+                    job_signal.notify()
+
+        if deferred:
+            defer_job(db, job_id, worker_id)
+            return
+
+        metrics.observe('damzipper_job_seconds', time.perf_counter() - started, profile=operation_profile.name,
+                        status='completed' if remote_path is not None else 'failed')
+
+        if remote_path is not None:
+            finish_job(db, job_id, worker_id, 'completed')
+        else:
+            # Handle download, zipping or upload failure
+            logger.log_error(f"Processing failed for job ID {job_id}")
+            finish_job(db, job_id, worker_id, 'failed')
 
-                        try:
-                            # Process the job
-                            #operation_profile = OperationProfile(server)
-                            operation_profile = get_operation_profile_by_name(server)
-
-                            if operation_profile:
-
-                                print("STARTING TO PROCESS A JOB...")
-                                current_thread = threading.current_thread()
-                                print(f"\tCurrent Thread Name: {current_thread.name}")
-                                print(f"\tCurrent Thread ID: {current_thread.ident}")
-                                print(f"\tIs Current Thread Alive: {current_thread.is_alive()}")
-                                print(f"\tIs Current Thread Daemon: {current_thread.daemon}")
-
-                                file_ops = FileOps(operation_profile, logger, job_id)
-
-                                # Perform the download
-                                file_ops.download(files)
-
-                                # Perform the zipping
-                                zip_path = file_ops.zip(token)
-                                if zip_path is not None:
-                                    # Only proceed if zipping was successful
-                                    file_ops.upload(zip_path)
-
-                                    # Perform cleanup after processing
-                                    file_ops.cleanup()
-
-                                    # Update job status to 'completed' and record end time
-                                    db.execute('''
-                                        UPDATE jobs SET status = 'completed', end_time = CURRENT_TIMESTAMP
-                                        WHERE id = ?
-                                    ''', (job_id,))
-                                else:
-                                    # Handle zipping failure
-                                    logger.log_error(f"Zipping failed for job ID {job_id}")
-                                    db.execute('''
-                                        UPDATE jobs SET status = 'failed', end_time = CURRENT_TIMESTAMP
-                                        WHERE id = ?
-                                    ''', (job_id,))
-                            else:
-                                logger.log_error(f"Failed to match operation profile '{server}'")
-                                logger.log_job(job_id, f"Failed to match operation profile '{server}'")
-
-                                # Update job status to 'failed' and record end time
-                                db.execute('''
-                                UPDATE jobs SET status = 'failed', end_time = CURRENT_TIMESTAMP
-                                WHERE id = ?
-                            ''', (job_id,))
+    except Exception as e:
+        # In case of error, log and update job status
+        logger.log_error(f"Job {job_id} failed: {e}")
+        finish_job(db, job_id, worker_id, 'failed')
+
+# A worker's hold on one of the download slots. process_job gives it back as soon as the job's
+# downloads are done, so another worker can start downloading the next job while this one zips
+# and uploads; release() is safe to call again once the job is over.
+class DownloadSlot:
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+        self.lock = threading.Lock()
+        self.held = False
+
+    def acquire(self):
+        self.semaphore.acquire()
+        self.held = True
+
+    def release(self):
+        with self.lock:
+            if self.held:
+                self.held = False
+                self.semaphore.release()
+
+# At most JOB_WORKERS jobs download at once; JOB_PIPELINE_DEPTH workers share each slot
+download_slots = threading.Semaphore(JOB_WORKERS)
+
+def job_processor(worker_id=None):
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+    poll_interval = JOB_POLL_MIN_SECONDS
+    download_slot = DownloadSlot(download_slots)
 
-                        except Exception as e:
-                            # In case of error, log and update job status
-                            db.execute('''
-                                UPDATE jobs SET status = 'failed', end_time = CURRENT_TIMESTAMP
-                                WHERE id = ?
-                            ''', (job_id,))
+    with app.app_context():  # Create an application context
+        while True:
+            db = get_db()
+            download_slot.acquire()
+            generation = job_signal.generation
+
+            try:
+                job = claim_next_job(db, worker_id)
+            except sqlite3.Error as e:
+                Logger().log_error(f"Worker {worker_id} failed to claim a job: {e}")
+                job = None
+
+            if job:
+                metrics.adjust('damzipper_workers_busy', 1)
+                try:
+                    process_job(db, *job, worker_id, download_slot)
+                finally:
+                    download_slot.release()
+                    metrics.adjust('damzipper_workers_busy', -1)
+                poll_interval = JOB_POLL_MIN_SECONDS
+                continue  # Look for more work straight away
+
+            download_slot.release()
 
             if DEBUG:
                 print("Sleeping...zzzZZZZzzzz")
 
-            time.sleep(10)  # Check for new jobs every 10 seconds
+            # Submissions to this process wake us immediately; polling only catches jobs
+            # submitted through other processes, backing off while the queue stays empty
+            if job_signal.wait(generation, poll_interval):
+                poll_interval = JOB_POLL_MIN_SECONDS
+            else:
+                poll_interval = min(poll_interval * 2, JOB_POLL_MAX_SECONDS)
+
+
 
+# Global list holding the references to this process' job_processor threads
+job_processor_threads = []
+job_processor_sequence = itertools.count()
 
+def start_job_processor_thread(workers=JOB_WORKERS, depth=JOB_PIPELINE_DEPTH):
+    global job_processor_threads, download_slots
 
-# Global variable to hold the reference to the job_processor thread
-job_processor_thread = None
+    job_processor_threads = [thread for thread in job_processor_threads if thread.is_alive()]
 
-def start_job_processor_thread():
-    global job_processor_thread
+    if not job_processor_threads:
+        # `workers` jobs download at a time; the extra threads run jobs that are past downloading
+        download_slots = threading.Semaphore(workers)
 
-    if job_processor_thread is None or not job_processor_thread.is_alive():
-        job_processor_thread = threading.Thread(target=job_processor, daemon=True)
-        job_processor_thread.start()
-        print(f"Job processor thread started: {job_processor_thread.name}")
+        # Reclaim disk from jobs that died mid-run before taking on new work
+        db = connect_db()
+        try:
+            sweep_workspaces(db)
+        except sqlite3.Error as e:
+            print(f"Skipped workspace sweep: {e}")
+        finally:
+            db.close()
+
+        retention.start()
+
+    for _ in range(len(job_processor_threads), workers * depth):
+        index = next(job_processor_sequence)
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        thread = threading.Thread(target=job_processor, args=(worker_id,), name=f"job-worker-{index}", daemon=True)
+        thread.start()
+        job_processor_threads.append(thread)
+        print(f"Job processor thread started: {thread.name} ({worker_id})")
 
 #if __name__ == '__main__':
 #    init_db()  # Initialize the database
@@ -0,0 +1,354 @@
+"""Run real jobs end to end against a stub rclone remote and report where the time goes.
+
+Generates a synthetic corpus on a local "remote" served by benchmark/stub_rclone.py (on PATH
+as `rclone`, with --latency per rclone call and --bandwidth per transfer), submits --jobs
+jobs through POST /submit_job and lets the job workers download, zip and upload them.
+Prints JSON with the submit throughput, the submit-to-start latency, job times, per-phase
+totals from the /metrics histograms, peak RSS (of this process and of the whole process tree,
+rclone and zip workers included) and peak workspace disk use.
+
+Corpora: `small` is --small-files JPGs of 50-500 KiB, `large` is --large-files MP4s and WAVs
+of --large-size each, `mixed` is both. Every job asks for the whole corpus under its own
+local names, so no job is served from an earlier job's archive.
+
+    python benchmark/end_to_end.py --corpus mixed --jobs 4 --latency 0.05 --bandwidth 200M
+    python benchmark/end_to_end.py --corpus small --output after.json --baseline before.json
+
+With --baseline, the run is compared with an earlier --output file and the script exits
+with status 1 if any tracked number got worse by more than --tolerance.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import app as app_module  # noqa: E402
+
+REMOTE = 'bench'
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Numbers compared against --baseline, where lower is better
+TRACKED = ('wall_seconds', 'submit_to_start_ms.p95', 'job_seconds.p50', 'job_seconds.max',
+           'peak_rss_mb.server', 'peak_rss_mb.process_tree', 'peak_workspace_mb')
+
+
+def write_file(path, size, block):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            data = block[:size - written]
+            f.write(data)
+            written += len(data)
+
+
+def build_corpus(root, kind, small_files, large_files, large_size):
+    """Write the corpus below `root` and return the file paths relative to it."""
+    rng = random.Random(42)
+    paths = []
+
+    if kind in ('small', 'mixed'):
+        for index in range(small_files):
+            path = f'12345_bench/photos/image_{index:05d}.jpg'
+            size = rng.randint(50, 500) * 1024
+            # JPEG signature, then noise: stored, not deflated, like real photos
+            write_file(os.path.join(root, path), size, b'\xff\xd8\xff\xe0' + rng.randbytes(size))
+            paths.append(path)
+
+    if kind in ('large', 'mixed'):
+        video = rng.randbytes(BLOCK_SIZE)
+        # 16-bit PCM: a tone plus noise, which deflate shrinks a little
+        audio = b''.join(int(8000 * math.sin(i / 20) + rng.randint(-500, 500)).to_bytes(2, 'little', signed=True)
+                         for i in range(BLOCK_SIZE // 2))
+        for index in range(large_files):
+            extension, block = ('mp4', video) if index % 2 == 0 else ('wav', audio)
+            path = f'12345_bench/media/tape_{index:02d}.{extension}'
+            write_file(os.path.join(root, path), large_size, block)
+            paths.append(path)
+
+    return paths
+
+
+def install_stub_rclone(bin_dir):
+    os.makedirs(bin_dir, exist_ok=True)
+    shim = os.path.join(bin_dir, 'rclone')
+    with open(shim, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCHMARK_DIR, "stub_rclone.py")}" "$@"\n')
+    os.chmod(shim, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+
+def disk_usage(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def process_tree_rss(root_pid):
+    """Resident memory of a process and all its descendants (rclone, zip workers), from /proc."""
+    parents, rss = {}, {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; the fields after it don't
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        rss[int(entry)] = int(fields[21]) * resource.getpagesize()
+
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(child for child, parent in parents.items() if parent == pid)
+    return total
+
+
+class ResourceSampler:
+    """Track the peak disk use of the workspace and the peak RSS of the process tree."""
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.peak_disk = 0
+        self.peak_rss = 0
+        self.has_proc = os.path.isdir('/proc/self')
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_disk = max(self.peak_disk, disk_usage(self.directory))
+            if self.has_proc:
+                self.peak_rss = max(self.peak_rss, process_tree_rss(os.getpid()))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        'p50': round(statistics.median(values), 3),
+        'p95': round(values[max(0, math.ceil(len(values) * 0.95) - 1)], 3),
+        'max': round(values[-1], 3),
+    }
+
+
+def phase_totals():
+    """Per phase: how often it ran, total seconds and bytes, and the resulting MB/s."""
+    phases = {}
+    for labels, count, seconds in app_module.metrics.totals('damzipper_phase_seconds'):
+        phases[labels['phase']] = {'count': count, 'seconds': round(seconds, 3)}
+    for labels, count, size in app_module.metrics.totals('damzipper_phase_bytes'):
+        phase = phases[labels['phase']]
+        phase['bytes'] = int(size)
+        if phase['seconds']:
+            phase['mb_per_second'] = round(size / phase['seconds'] / 1024 / 1024, 1)
+    return dict(sorted(phases.items()))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lookup(results, dotted):
+    value = results
+    for key in dotted.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """Return {metric: {baseline, current, change}} and the metrics that regressed."""
+    comparison, regressions = {}, []
+    for metric in TRACKED:
+        before, after = lookup(baseline, metric), lookup(results, metric)
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        comparison[metric] = {'baseline': before, 'current': after, 'change': round(change, 3)}
+        if change > tolerance:
+            regressions.append(metric)
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', choices=('small', 'large', 'mixed'), default='mixed')
+    parser.add_argument('--small-files', type=int, default=500)
+    parser.add_argument('--large-files', type=int, default=2)
+    parser.add_argument('--large-size', default='2G', help='size of each large file, e.g. 256M or 2G')
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=app_module.JOB_WORKERS)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every rclone call')
+    parser.add_argument('--bandwidth', default='0', help='per-transfer limit in bytes per second, e.g. 100M; 0 for none')
+    parser.add_argument('--transfer-mode', choices=('batch', 'parallel'), default=app_module.TRANSFER_MODE)
+    parser.add_argument('--stream-upload', choices=('true', 'false'), default=str(app_module.STREAM_UPLOAD).lower())
+    parser.add_argument('--concurrency', type=int, default=app_module.DOWNLOAD_CONCURRENCY)
+    parser.add_argument('--timeout', type=float, default=3600, help='give up on jobs still running after this many seconds')
+    parser.add_argument('--work-dir', help='directory for the remote, database and workspaces (default: a temp dir)')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown against --baseline (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='dam-zipper-bench-')
+    remote_root = os.path.join(work_dir, 'remote')
+    source_root = os.path.join(remote_root, REMOTE, 'source')
+    profile_dir = os.path.join(work_dir, 'profiles')
+    workspace_root = os.path.join(work_dir, 'workspace')
+
+    started = time.perf_counter()
+    paths = build_corpus(source_root, args.corpus, args.small_files, args.large_files, app_module.parse_size(args.large_size))
+    corpus_bytes = sum(os.path.getsize(os.path.join(source_root, path)) for path in paths)
+    corpus_seconds = time.perf_counter() - started
+
+    install_stub_rclone(os.path.join(work_dir, 'bin'))
+    os.environ.update({
+        'STUB_RCLONE_ROOT': remote_root,
+        'STUB_RCLONE_LATENCY': str(args.latency),
+        'STUB_RCLONE_BANDWIDTH': str(app_module.parse_size(args.bandwidth)),
+        'API_KEY': 'benchmark',
+    })
+
+    os.makedirs(profile_dir, exist_ok=True)
+    with open(os.path.join(profile_dir, 'bench.txt'), 'w') as f:
+        f.write(f'NAME={REMOTE}\nPATH_DOWN=/source\nPATH_UP=/archives\nTRANSFER_MODE={args.transfer_mode}\n'
+                f'STREAM_UPLOAD={args.stream_upload}\nCONCURRENCY={args.concurrency}\n')
+
+    app_module.DATABASE = os.path.join(work_dir, 'data.db')
+    app_module.WORKSPACE_ROOT = workspace_root
+    app_module.profile_registry = app_module.ProfileRegistry(profile_dir, 0)
+    # Every job should do the full work: no cached downloads and no client rate limits
+    app_module.download_cache = app_module.DownloadCache(None, 0)
+    app_module.admission_controller = app_module.AdmissionController(0, 0, 0, 0, 0)
+    app_module.init_db()
+
+    submitted, job_started, job_finished = {}, {}, {}
+    all_finished = threading.Event()
+    process_job = app_module.process_job
+
+    def timed_process_job(db, job_id, *args, **kwargs):
+        job_started[job_id] = time.perf_counter()
+        try:
+            return process_job(db, job_id, *args, **kwargs)
+        finally:
+            job_finished[job_id] = time.perf_counter()
+            if len(job_finished) == len(submitted):
+                all_finished.set()
+
+    app_module.process_job = timed_process_job
+    app_module.start_job_processor_thread(args.workers)
+    time.sleep(0.5)  # Let the workers go idle so submissions pay the wakeup path
+
+    client = app_module.app.test_client()
+    with ResourceSampler(workspace_root, 0.05) as sampler:
+        run_started = time.perf_counter()
+        for index in range(args.jobs):
+            payload = {
+                'files': {path: f'job_{index:03d}/{path.split("/", 1)[1]}' for path in paths},
+                'server': REMOTE,
+                'token': f'bench_{index:03d}',
+                'auth': 'benchmark',
+            }
+            submit_time = time.perf_counter()
+            response = client.post('/submit_job', json=payload)
+            if response.status_code != 201:
+                sys.exit(f"Submission {index} failed with {response.status_code}: {response.get_data(as_text=True)}")
+            submitted[response.json['job_id']] = submit_time
+        submit_seconds = time.perf_counter() - run_started
+
+        all_finished.wait(args.timeout)
+        wall_seconds = time.perf_counter() - run_started
+
+    db = app_module.connect_db()
+    statuses = dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+    db.close()
+
+    results = {
+        'benchmark': 'end_to_end',
+        'commit': git_commit(),
+        'settings': {
+            'corpus': args.corpus,
+            'jobs': args.jobs,
+            'workers': args.workers,
+            'latency': args.latency,
+            'bandwidth': args.bandwidth,
+            'transfer_mode': args.transfer_mode,
+            'stream_upload': args.stream_upload == 'true',
+            'concurrency': args.concurrency,
+            'pipeline_stages': app_module.PIPELINE_STAGES,
+            'zip_workers': app_module.ZIP_WORKERS,
+        },
+        'corpus': {'files': len(paths), 'bytes': corpus_bytes, 'build_seconds': round(corpus_seconds, 2)},
+        'jobs': {'completed': statuses.get('completed', 0), 'failed': statuses.get('failed', 0),
+                 'unfinished': args.jobs - len(job_finished)},
+        'wall_seconds': round(wall_seconds, 3),
+        'mb_per_second': round(corpus_bytes * args.jobs / wall_seconds / 1024 / 1024, 1),
+        'submit_jobs_per_second': round(args.jobs / submit_seconds, 1),
+        'submit_to_start_ms': percentiles((job_started[job_id] - submitted[job_id]) * 1000
+                                          for job_id in job_started if job_id in submitted),
+        'job_seconds': percentiles(job_finished[job_id] - job_started[job_id] for job_id in job_finished),
+        'phases': phase_totals(),
+        # ru_maxrss is in KiB on Linux. The process tree total is sampled, so it can miss short spikes.
+        'peak_rss_mb': {
+            'server': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'process_tree': round(sampler.peak_rss / 1024 / 1024, 1) if sampler.has_proc else None,
+        },
+        'peak_workspace_mb': round(sampler.peak_disk / 1024 / 1024, 1),
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results['baseline'], regressions = compare(results, baseline, args.tolerance)
+        results['regressions'] = regressions
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if regressions or results['jobs']['completed'] != args.jobs:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
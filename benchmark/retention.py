@@ -0,0 +1,119 @@
+"""Database size and query latency over months of history, with retention pruning it.
+
+Replays --days days of traffic into a throwaway database, --jobs-per-day submissions a day
+(each a request, a finished job and --events-per-job events, timestamped through that day), and
+runs one retention pass at the end of every simulated day, with --keep-days as the age limit
+for every table. Reports the file size and the latency of the status and scheduling queries
+as the days go by; both should stop growing once the history is older than --keep-days.
+
+    python benchmark/retention.py --days 180 --jobs-per-day 500 --keep-days 30
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+PAYLOAD = json.dumps({
+    'files': {f'12345_iegurh3987wbgieubrgh9w3ug/{i:04d}.jpg': f'Album_07/image_{i:04d}.jpg' for i in range(20)},
+    'server': 'myremote_a',
+    'token': 'benchmark',
+})
+
+
+def replay_day(db, day, jobs, events_per_job):
+    with db:
+        for job in range(jobs):
+            timestamp = (day + datetime.timedelta(days=job / jobs)).strftime('%Y-%m-%d %H:%M:%S')
+            request_id = db.execute("""
+                INSERT INTO requests (timestamp, source_ip, method, request_url, request_raw, response_status)
+                VALUES (?, '127.0.0.1', 'POST', '/submit_job', NULL, 201)
+            """, (timestamp,)).lastrowid
+            job_id = db.execute("""
+                INSERT INTO jobs (request_id, timestamp, message, status, profile) VALUES (?, ?, ?, 'completed', 'myremote_a')
+            """, (request_id, timestamp, PAYLOAD)).lastrowid
+            db.executemany("INSERT INTO events (job_id, timestamp, message) VALUES (?, ?, ?)",
+                           ((job_id, timestamp, f'Downloaded file {i} of the job') for i in range(events_per_job)))
+
+
+def query_ms(db, repeat=20):
+    """Median milliseconds of the queries behind GET /jobs, GET /metrics and a job claim."""
+    last_job = db.execute('SELECT MAX(id) FROM jobs').fetchone()[0]
+    queries = [
+        (f'SELECT {app_module.JOB_STATUS_COLUMNS} FROM jobs ORDER BY id DESC LIMIT 100', ()),
+        ("SELECT status, COUNT(*) FROM jobs WHERE status IN ('pending', 'in progress') GROUP BY status", ()),
+        ('SELECT message FROM events WHERE job_id = ?', (last_job,)),
+    ]
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for sql, params in queries:
+            db.execute(sql, params).fetchall()
+        app_module.select_next_job(db)
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--jobs-per-day', type=int, default=300)
+    parser.add_argument('--events-per-job', type=int, default=20)
+    parser.add_argument('--keep-days', type=int, default=30)
+    parser.add_argument('--report-every', type=int, default=10, help='days between samples')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    app_module.DATABASE = os.path.join(temp_dir, 'data.db')
+    app_module.init_db()
+    db = app_module.connect_db()
+
+    policy = {'days': args.keep_days}
+    retention = app_module.Retention({table: policy for table in app_module.Retention.TABLES}, 0,
+                                     app_module.RETENTION_BATCH_ROWS, 0, None, app_module.RETENTION_VACUUM_PAGES)
+
+    # The replay ends today; retention runs at the end of each simulated day
+    first_day = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=args.days)
+    samples = []
+    retention_seconds = []
+    for day in range(args.days):
+        replay_day(db, first_day + datetime.timedelta(days=day), args.jobs_per_day, args.events_per_job)
+
+        started = time.perf_counter()
+        retention.run_once(db, first_day + datetime.timedelta(days=day + 1))
+        retention_seconds.append(time.perf_counter() - started)
+
+        if (day + 1) % args.report_every == 0 or day + 1 == args.days:
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            samples.append({
+                'day': day + 1,
+                'db_mb': round(os.path.getsize(app_module.DATABASE) / 1024 ** 2, 2),
+                'events': db.execute('SELECT COUNT(*) FROM events').fetchone()[0],
+                'query_ms': query_ms(db),
+            })
+
+    # Once the retention window is full the database should neither grow nor slow down
+    steady = [sample for sample in samples if sample['day'] > args.keep_days + 1]
+    print(json.dumps({
+        'benchmark': 'retention',
+        'days': args.days,
+        'jobs_per_day': args.jobs_per_day,
+        'events_per_job': args.events_per_job,
+        'keep_days': args.keep_days,
+        'retention_pass_ms_p50': round(statistics.median(retention_seconds) * 1000, 2),
+        'retention_pass_ms_max': round(max(retention_seconds) * 1000, 2),
+        'steady_state_size_growth': round(steady[-1]['db_mb'] / steady[0]['db_mb'], 3) if len(steady) > 1 else None,
+        'deleted': retention.stats()['deleted'],
+        'samples': samples,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Stand-in for the rclone binary, serving remotes from local directories.
+
+Implements the subcommands DAM-Zipper runs: lsjson, copy, copyto, cat, rcat and hashsum.
+A remote path `name:some/path` maps to $STUB_RCLONE_ROOT/name/some/path. Every invocation
+sleeps $STUB_RCLONE_LATENCY seconds first (process startup, auth, first byte), and remote
+transfers are throttled to $STUB_RCLONE_BANDWIDTH bytes per second (0 for no limit).
+
+benchmark/end_to_end.py puts it on PATH as `rclone`; the tests do the same.
+"""
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+BLOCK_SIZE = 1024 * 1024
+
+# rclone flags DAM-Zipper passes that take a value
+VALUE_FLAGS = {'--files-from-raw', '--transfers', '--offset', '--count', '--bwlimit',
+               '--multi-thread-streams', '--multi-thread-chunk-size', '--log-level'}
+
+
+def parse(argv):
+    positional, options = [], {}
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument.startswith('--'):
+            name, separator, value = argument.partition('=')
+            if name in VALUE_FLAGS:
+                options[name] = value if separator else next(arguments)
+            else:
+                options[name] = True
+        else:
+            positional.append(argument)
+    return positional, options
+
+
+def is_remote(path):
+    return ':' in path and not os.path.isabs(path)
+
+
+def resolve(path):
+    if not is_remote(path):
+        return path
+    name, _, remote_path = path.partition(':')
+    return os.path.join(os.environ['STUB_RCLONE_ROOT'], name, remote_path.lstrip('/'))
+
+
+class Throttle:
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self.started = time.monotonic()
+        self.sent = 0
+
+    def __call__(self, size):
+        self.sent += size
+        if self.bandwidth > 0:
+            ahead = self.sent / self.bandwidth - (time.monotonic() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def pump(source, destination, throttle, count=None):
+    while count is None or count > 0:
+        data = source.read(BLOCK_SIZE if count is None else min(BLOCK_SIZE, count))
+        if not data:
+            break
+        destination.write(data)
+        throttle(len(data))
+        if count is not None:
+            count -= len(data)
+
+
+def copy_file(source, destination, throttle):
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    temp_path = f'{destination}.stub-partial'
+    with open(source, 'rb') as src, open(temp_path, 'wb') as dst:
+        pump(src, dst, throttle)
+    os.replace(temp_path, destination)
+
+
+def file_hash(path, algorithm):
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def read_manifest(path):
+    with open(path) as manifest:
+        return [line.rstrip('\n') for line in manifest if line.strip()]
+
+
+def lsjson(positional, options):
+    root = resolve(positional[0])
+    entries = []
+    for relative in read_manifest(options['--files-from-raw']):
+        path = os.path.join(root, relative)
+        if not os.path.isfile(path):
+            continue
+        st = os.stat(path)
+        entry = {
+            'Path': relative,
+            'Name': os.path.basename(relative),
+            'Size': st.st_size,
+            'ModTime': datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc).isoformat(),
+            'IsDir': False,
+        }
+        if options.get('--hash'):
+            entry['Hashes'] = {'sha1': file_hash(path, 'sha1')}
+        entries.append(entry)
+    json.dump(entries, sys.stdout)
+    return 0
+
+
+def copy(positional, options, throttle):
+    source_root, destination_root = resolve(positional[0]), resolve(positional[1])
+    missing = 0
+    for relative in read_manifest(options['--files-from-raw']):
+        source = os.path.join(source_root, relative)
+        if not os.path.isfile(source):
+            print(f'ERROR : {relative}: file not found', file=sys.stderr)
+            missing += 1
+            continue
+        copy_file(source, os.path.join(destination_root, relative), throttle)
+        if options.get('--use-json-log'):
+            # Like rclone at INFO level, one line per finished transfer
+            print(json.dumps({'level': 'info', 'msg': 'Copied (new)', 'object': relative}), file=sys.stderr, flush=True)
+    return 3 if missing else 0
+
+
+def copyto(positional, options, throttle):
+    source, destination = resolve(positional[0]), resolve(positional[1])
+    if not os.path.isfile(source):
+        print(f'ERROR : {positional[0]}: file not found', file=sys.stderr)
+        return 3
+    if is_remote(positional[0]) and is_remote(positional[1]):
+        # Server-side copy: nothing crosses the network
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        return 0
+    copy_file(source, destination, throttle)
+    return 0
+
+
+def cat(positional, options, throttle):
+    if not os.path.isfile(resolve(positional[0])):
+        print(f'ERROR : {positional[0]}: file not found', file=sys.stderr)
+        return 3
+    with open(resolve(positional[0]), 'rb') as f:
+        f.seek(int(options.get('--offset', 0)))
+        count = int(options['--count']) if '--count' in options else None
+        pump(f, sys.stdout.buffer, throttle, count)
+    return 0
+
+
+def rcat(positional, options, throttle):
+    destination = resolve(positional[0])
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    # Like rclone, an upload that is cut off never shows up under its final name
+    temp_path = f'{destination}.stub-partial'
+    with open(temp_path, 'wb') as f:
+        pump(sys.stdin.buffer, f, throttle)
+    os.replace(temp_path, destination)
+    return 0
+
+
+def hashsum(positional, options):
+    path = resolve(positional[1])
+    if not os.path.isfile(path):
+        return 3
+    print(f'{file_hash(path, positional[0].lower())}  {os.path.basename(path)}')
+    return 0
+
+
+def main(argv):
+    positional, options = parse(argv)
+    if not positional:
+        print('usage: rclone <command> ...', file=sys.stderr)
+        return 1
+
+    time.sleep(float(os.environ.get('STUB_RCLONE_LATENCY', 0)))
+    throttle = Throttle(float(os.environ.get('STUB_RCLONE_BANDWIDTH', 0)))
+    command, arguments = positional[0], positional[1:]
+
+    if command == 'lsjson':
+        return lsjson(arguments, options)
+    if command == 'copy':
+        return copy(arguments, options, throttle)
+    if command == 'copyto':
+        return copyto(arguments, options, throttle)
+    if command == 'cat':
+        return cat(arguments, options, throttle)
+    if command == 'rcat':
+        return rcat(arguments, options, throttle)
+    if command == 'hashsum':
+        return hashsum(arguments, options)
+
+    print(f'stub rclone: unsupported command {command!r}', file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,80 @@
+"""Measure submit-to-start latency: time from POST /submit_job until a worker starts the job.
+
+Runs offline against a throwaway database; job processing itself is replaced by a no-op.
+
+    python benchmark/submit_latency.py --jobs 200 --workers 2
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--interval', type=float, default=0.01, help='seconds between submissions')
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    app_module.DATABASE = os.path.join(temp_dir, 'data.db')
+    app_module.init_db()
+    os.environ['API_KEY'] = 'benchmark'
+    # Measure the submit path itself, not the rate limits of a single benchmark client
+    app_module.admission_controller = app_module.AdmissionController(0, 0, 0, 0, 0)
+
+    submitted = {}
+    started = {}
+    done = threading.Event()
+
+    def record_start(db, job_id, job_payload, worker_id, download_slot=None):
+        started[job_id] = time.perf_counter()
+        app_module.finish_job(db, job_id, worker_id, 'completed')
+        if len(started) == args.jobs:
+            done.set()
+
+    app_module.process_job = record_start
+    app_module.start_job_processor_thread(args.workers)
+
+    # Let the workers go idle so every submission pays the wakeup path
+    time.sleep(1)
+
+    client = app_module.app.test_client()
+    payload = {
+        'files': {'12345_abc/a.jpg': 'a.jpg'},
+        'server': 'myremote_a',
+        'token': 'benchmark',
+        'auth': 'benchmark',
+    }
+
+    for _ in range(args.jobs):
+        submit_time = time.perf_counter()
+        response = client.post('/submit_job', json=payload)
+        submitted[response.json['job_id']] = submit_time
+        time.sleep(args.interval)
+
+    done.wait(timeout=60)
+
+    latencies = sorted((started[job_id] - submitted[job_id]) * 1000 for job_id in started if job_id in submitted)
+    print(json.dumps({
+        'benchmark': 'submit_latency',
+        'jobs': args.jobs,
+        'workers': args.workers,
+        'started': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        'max_ms': round(latencies[-1], 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Measure /submit_job throughput under concurrent load on a database with a large history.
+
+Fills a throwaway database with --rows historical requests, completed jobs and events,
+then has --clients threads submit jobs for --seconds while a job worker keeps claiming them.
+
+    python benchmark/submit_throughput.py --rows 1000000 --clients 8 --seconds 10
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+PAYLOAD = {
+    'files': {
+        '12345_iegurh3987wbgieubrgh9w3ug/i3hgiushgidhiudsfhg.mp4': '12345_Karel_Tutsu_VHS_07.mp4',
+        '12345_iegurh3987wbgieubrgh9w3ug/h395ghuehv893ygs084.jpg': 'Album_07/image_0186.jpg',
+    },
+    'server': 'myremote_a',
+    'token': 'benchmark',
+    'auth': 'benchmark',
+}
+
+
+def fill_history(rows):
+    db = app_module.connect_db()
+    message = json.dumps(PAYLOAD)
+    batch = 50000
+    with db:
+        for start in range(0, rows, batch):
+            ids = range(start + 1, min(start + batch, rows) + 1)
+            db.executemany("INSERT INTO requests (id, source_ip, method, request_url, request_raw, response_status) VALUES (?, '127.0.0.1', 'POST', '/submit_job', ?, 201)",
+                           ((i, message) for i in ids))
+            db.executemany("INSERT INTO jobs (id, request_id, message, status) VALUES (?, ?, ?, 'completed')",
+                           ((i, i, message) for i in ids))
+            db.executemany("INSERT INTO events (job_id, message) VALUES (?, 'Zipping completed')",
+                           ((i,) for i in ids))
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    app_module.DATABASE = os.path.join(temp_dir, 'data.db')
+    app_module.init_db()
+    os.environ['API_KEY'] = 'benchmark'
+    # Measure the submit path itself, not the rate limits of a single benchmark client
+    app_module.admission_controller = app_module.AdmissionController(0, 0, 0, 0, 0)
+
+    started = time.perf_counter()
+    fill_history(args.rows)
+    fill_seconds = time.perf_counter() - started
+
+    # A worker claims and finishes jobs as they arrive, as in production
+    def finish_immediately(db, job_id, job_payload, worker_id, download_slot=None):
+        app_module.finish_job(db, job_id, worker_id, 'completed')
+
+    app_module.process_job = finish_immediately
+    # Retention would start deduplicating the synthetic history in the background
+    app_module.retention.interval = 0
+    app_module.start_job_processor_thread(1)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def client():
+        test_client = app_module.app.test_client()
+        while time.perf_counter() < deadline:
+            submit_started = time.perf_counter()
+            response = test_client.post('/submit_job', json=PAYLOAD)
+            elapsed = time.perf_counter() - submit_started
+            with lock:
+                (latencies if response.status_code == 201 else errors).append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    print(json.dumps({
+        'benchmark': 'submit_throughput',
+        'history_rows': args.rows,
+        'fill_seconds': round(fill_seconds, 2),
+        'clients': args.clients,
+        'seconds': args.seconds,
+        'submitted': len(latencies),
+        'errors': len(errors),
+        'submits_per_second': round(len(latencies) / args.seconds, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2) if latencies else None,
+        'journal_mode': app_module.connect_db().execute('PRAGMA journal_mode').fetchone()[0],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
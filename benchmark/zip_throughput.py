@@ -0,0 +1,128 @@
+"""Compare zip throughput of the single-core zipfile path with the parallel archiver.
+
+Builds a throwaway corpus of mixed media (--megabytes in total: compressible text and CSV,
+semi-compressible raw image data, and incompressible video that is stored), then zips it
+with ZIP_WORKERS=1 and with --workers processes and reports the throughput of each.
+
+    python benchmark/zip_throughput.py --megabytes 512 --workers 8
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+class QuietLogger:
+    def log(self, message):
+        pass
+
+    def log_error(self, message):
+        pass
+
+    def log_job(self, job_id, message):
+        pass
+
+
+def build_corpus(directory, megabytes):
+    """Write the corpus and return the file paths. Roughly 40% text, 30% raw image, 30% video."""
+    rng = random.Random(42)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10))) for _ in range(2000)]
+    budget = megabytes * 1024 * 1024
+    kinds = [('txt', 0.25), ('csv', 0.15), ('tif', 0.3), ('mp4', 0.3)]
+    paths = []
+
+    for extension, share in kinds:
+        remaining = int(budget * share)
+        index = 0
+        while remaining > 0:
+            size = min(remaining, rng.randint(1, 64) * 1024 * 1024)
+            path = os.path.join(directory, extension, f'{index:04d}.{extension}')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                written = 0
+                while written < size:
+                    if extension == 'txt':
+                        block = (' '.join(rng.choice(words) for _ in range(20000)) + '\n').encode()
+                    elif extension == 'csv':
+                        block = ''.join(f'{rng.randint(1, 99999)},{rng.choice(words)},{rng.random():.6f}\n' for _ in range(5000)).encode()
+                    elif extension == 'tif':
+                        # Smooth gradients with noise in the low bits, like an uncompressed scan
+                        block = bytes((i // 64 + rng.getrandbits(3)) & 0xFF for i in range(65536))
+                    else:
+                        block = os.urandom(1024 * 1024)
+                    block = block[:size - written]
+                    f.write(block)
+                    written += len(block)
+            paths.append(path)
+            remaining -= size
+            index += 1
+
+    return paths
+
+
+def run(file_ops, workers, zip_name):
+    app_module.ZIP_WORKERS = workers
+    started = time.perf_counter()
+    zip_path = file_ops.zip(zip_name)
+    elapsed = time.perf_counter() - started
+
+    with zipfile.ZipFile(zip_path) as zipf:
+        valid = zipf.testzip() is None
+    archive_bytes = os.path.getsize(zip_path)
+    os.remove(zip_path)
+    return elapsed, archive_bytes, valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--megabytes', type=int, default=512)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--level', type=int, default=app_module.COMPRESSION_LEVEL)
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        corpus_dir = os.path.join(temp_dir, 'corpus')
+        paths = build_corpus(corpus_dir, args.megabytes)
+        corpus_bytes = sum(os.path.getsize(path) for path in paths)
+
+        profile = app_module.OperationProfile('benchmark', '/down', '/up', compression='deflate', compression_level=args.level)
+        file_ops = app_module.FileOps(profile, QuietLogger(), 0)
+        file_ops.temp_job_directory = corpus_dir
+        file_ops.downloaded_files = paths
+
+        results = {}
+        for label, workers in (('serial', 1), ('parallel', args.workers)):
+            elapsed, archive_bytes, valid = run(file_ops, workers, label)
+            results[label] = {
+                'workers': workers,
+                'seconds': round(elapsed, 2),
+                'mb_per_second': round(corpus_bytes / elapsed / 1024 / 1024, 1),
+                'archive_bytes': archive_bytes,
+                'valid': valid,
+            }
+
+        print(json.dumps({
+            'benchmark': 'zip_throughput',
+            'files': len(paths),
+            'corpus_bytes': corpus_bytes,
+            'chunk_size': app_module.ZIP_CHUNK_SIZE,
+            'level': args.level,
+            **results,
+            'speedup': round(results['serial']['seconds'] / results['parallel']['seconds'], 2),
+        }, indent=2))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
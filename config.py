@@ -1,4 +1,179 @@
 # config.py
+import os
+import tempfile
+
 DATABASE = 'data.db'
+
+# Seconds a connection waits on a locked database before giving up, and the SQLite
+# synchronous level used with the write-ahead log
+DB_BUSY_TIMEOUT = 15
+DB_SYNCHRONOUS = 'NORMAL'
 DEBUG = True
-PROFILE_DIR = 'profiles'
\ No newline at end of file
+
+# Job events are buffered and written in one transaction once this many are queued,
+# or after this many seconds, whichever comes first
+EVENT_BATCH_SIZE = 200
+EVENT_FLUSH_SECONDS = 1.0
+PROFILE_DIR = 'profiles'
+
+# Seconds between background checks of the profiles directory for changes (0 disables hot reload)
+PROFILE_CHECK_INTERVAL = 5
+
+# Default number of simultaneous rclone transfers per job (override per profile with CONCURRENCY=)
+DOWNLOAD_CONCURRENCY = 4
+
+# How downloads are issued: 'batch' runs one `rclone copy --files-from-raw` per job,
+# 'parallel' runs one `rclone copyto` per file (override per profile with TRANSFER_MODE=)
+TRANSFER_MODE = 'batch'
+
+# Stream the zip into `rclone rcat` instead of writing it to the temp directory first
+# (override per profile with STREAM_UPLOAD=)
+STREAM_UPLOAD = True
+
+# Failed transfers are retried this many times, waiting TRANSFER_RETRY_BACKOFF seconds before the
+# first retry and doubling after each (override per profile with RETRIES= and RETRY_BACKOFF=)
+TRANSFER_RETRIES = 3
+TRANSFER_RETRY_BACKOFF = 2.0
+
+# Files of at least TRANSFER_RESUME_THRESHOLD are downloaded in TRANSFER_CHUNK_SIZE pieces and resume
+# from the last complete byte after a failure (override per profile with RESUME_THRESHOLD= and CHUNK_SIZE=).
+# Profiles can also set MULTI_THREAD_STREAMS= and BWLIMIT=, which are passed to rclone.
+TRANSFER_CHUNK_SIZE = '64M'
+TRANSFER_RESUME_THRESHOLD = '256M'
+
+# Zip compression for entries that aren't already compressed: 'deflate', 'bzip2', 'lzma' or 'store'
+# (override per profile with COMPRESSION= and COMPRESSION_LEVEL=)
+COMPRESSION = 'deflate'
+COMPRESSION_LEVEL = 6
+
+# Deflated entries are compressed in ZIP_CHUNK_SIZE pieces by a pool of ZIP_WORKERS processes
+# (1 zips on a single core with zipfile, as do the 'bzip2' and 'lzma' methods)
+ZIP_WORKERS = os.cpu_count() or 1
+ZIP_CHUNK_SIZE = '16M'
+
+# Entries with these extensions are always stored; deflate gains next to nothing on them
+COMPRESSION_STORE_EXTENSIONS = (
+    '.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.m4a', '.aac', '.ogg', '.flac', '.wav',
+    '.zip', '.gz', '.bz2', '.xz', '.7z', '.rar', '.pdf',
+)
+
+# A running job's progress (phase, files done, bytes transferred) is written to its jobs row
+# at most this often, plus on every phase change
+PROGRESS_WRITE_SECONDS = 1.0
+
+# Longest a GET /jobs/<id>?wait= long-poll is held open
+JOB_STATUS_MAX_WAIT_SECONDS = 30
+# Long-polls each server process holds open at once, leaving its other threads for everything
+# else; beyond this a ?wait= request is answered straight away with the job's current state
+JOB_STATUS_MAX_WAITERS = 4
+
+# Job processor threads started in each server process
+JOB_WORKERS = 2
+
+# A claimed job is reclaimed by another worker if its lease isn't renewed within this many seconds
+JOB_LEASE_SECONDS = 120
+
+# Jobs that have been claimed this many times without finishing are marked failed
+JOB_MAX_ATTEMPTS = 3
+
+# Idle workers poll for jobs submitted through other processes, starting at the minimum
+# interval and doubling up to the maximum while the queue stays empty
+JOB_POLL_MIN_SECONDS = 0.5
+JOB_POLL_MAX_SECONDS = 10
+
+# Each job downloads into its own WORKSPACE_ROOT/job-<id> directory
+WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), 'dam-zipper')
+
+# Downloaded source files are kept here and reused by later jobs; keep it on the same
+# filesystem as WORKSPACE_ROOT so cached files can be hardlinked. 0 disables the cache.
+DOWNLOAD_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'dam-zipper-cache')
+DOWNLOAD_CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+# Also key cached files on their remote hash (costs a full read on backends that don't store one)
+DOWNLOAD_CACHE_HASH = False
+
+# Files are hashed with HASH_BUFFER_SIZE reads, and the digests of up to DIGEST_CACHE_ENTRIES
+# files are remembered until the file's mtime or size changes
+HASH_BUFFER_SIZE = 1024 * 1024
+DIGEST_CACHE_ENTRIES = 10000
+
+# Hash each downloaded file as it lands and compare it with the hashes the remote lists for it
+# (MD5/SHA1 where the backend has them); a mismatch is retried like a failed transfer
+DOWNLOAD_VERIFY_HASH = False
+
+# Hand each file to the zip writer as soon as it is downloaded instead of downloading the whole
+# job first. Up to PIPELINE_QUEUE_FILES finished files may wait for the writer before further
+# downloads are held back.
+PIPELINE_STAGES = True
+PIPELINE_QUEUE_FILES = 8
+
+# Worker threads per download slot (JOB_WORKERS slots): a job frees its slot once its downloads
+# finish, so the next job's downloads overlap this job's zip and upload
+JOB_PIPELINE_DEPTH = 2
+
+# Admission control for /submit_job. Each client IP and API key gets a token bucket refilled at
+# ADMISSION_*_PER_MINUTE with room for ADMISSION_BURST requests; over the limit gets a 429 with
+# Retry-After. 0 disables a limit.
+ADMISSION_IP_PER_MINUTE = 120
+ADMISSION_KEY_PER_MINUTE = 600
+ADMISSION_BURST = 20
+
+# No new jobs while MAX_PENDING_JOBS are waiting (429, retry after ADMISSION_QUEUE_RETRY_AFTER
+# seconds); the count is re-read from the database every ADMISSION_PENDING_REFRESH_SECONDS
+MAX_PENDING_JOBS = 1000
+ADMISSION_PENDING_REFRESH_SECONDS = 5
+ADMISSION_QUEUE_RETRY_AFTER = 30
+
+# Largest job accepted: number of files (400 above it) and request body size (413 above it)
+MAX_FILES_PER_JOB = 10000
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+# Scheduling: jobs may carry a "priority" from -JOB_PRIORITY_LIMIT to JOB_PRIORITY_LIMIT (higher
+# runs first); within a priority the profile with the fewest running jobs goes next, and its
+# job with the fewest files. A job pending for JOB_STARVATION_SECONDS runs next regardless, and
+# JOB_MAX_RUNNING_PER_PROFILE (0 for no limit) caps how many workers one profile can hold.
+JOB_PRIORITY_LIMIT = 10
+JOB_STARVATION_SECONDS = 1800
+JOB_MAX_RUNNING_PER_PROFILE = 0
+
+# Profiling: sample a job's worker thread every JOB_PROFILER_INTERVAL seconds and write the
+# folded stacks to JOB_PROFILER_DIR. On for every job with JOB_PROFILER, or per job by
+# submitting it with "profiler": true.
+JOB_PROFILER = False
+JOB_PROFILER_INTERVAL = 0.01
+JOB_PROFILER_DIR = 'job-profiles'
+
+# Bulk submission (/submit_jobs): at most BULK_SUBMIT_MAX_JOBS jobs per call. A JSON body is
+# still limited to MAX_REQUEST_BYTES; an NDJSON body is streamed and may be up to
+# MAX_BULK_REQUEST_BYTES, committed BULK_SUBMIT_CHUNK jobs per transaction.
+BULK_SUBMIT_MAX_JOBS = 100000
+BULK_SUBMIT_CHUNK = 1000
+MAX_BULK_REQUEST_BYTES = 1024 * 1024 * 1024
+
+# Jobs are sized from the remote listing before they download anything and only start while
+# their workspace footprint (the source files, plus the archive unless it is streamed) fits next
+# to the other running jobs, across every process: within WORKSPACE_DISK_BUDGET bytes (0 for no fixed budget)
+# and the free space on WORKSPACE_ROOT's filesystem less WORKSPACE_DISK_RESERVE. Jobs that don't
+# fit wait in the queue; only a job larger than the budget (or the whole filesystem less the
+# reserve) fails.
+WORKSPACE_DISK_BUDGET = 0
+WORKSPACE_DISK_RESERVE = 1024 ** 3
+
+# History retention: every RETENTION_INTERVAL_SECONDS (0 disables) rows older than 'days' or
+# beyond the newest 'max_rows' are deleted from each table, RETENTION_BATCH_ROWS per transaction
+# with RETENTION_BATCH_PAUSE seconds between batches. Pending and running jobs, and the requests
+# that created them, are kept. With RETENTION_ARCHIVE_DIR set, rows are appended to
+# <table>-<date>.ndjson.gz there before they are deleted. Freed pages are returned to the
+# filesystem RETENTION_VACUUM_PAGES at a time.
+RETENTION_INTERVAL_SECONDS = 3600
+RETENTION_POLICIES = {
+    'events': {'days': 30, 'max_rows': 5000000},
+    'jobs': {'days': 90, 'max_rows': 1000000},
+    'requests': {'days': 90, 'max_rows': 1000000},
+}
+RETENTION_BATCH_ROWS = 500
+RETENTION_BATCH_PAUSE = 0.05
+RETENTION_ARCHIVE_DIR = None
+RETENTION_VACUUM_PAGES = 1000
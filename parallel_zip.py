@@ -0,0 +1,288 @@
+"""Multi-core zip writer.
+
+Entries are deflated in fixed-size chunks by a process pool and the compressed chunks are
+written out in order as one ZIP/ZIP64 archive. Each chunk is primed with the 32 KiB that
+precede it and ends on a byte boundary (Z_SYNC_FLUSH), so the concatenated chunks form one
+ordinary deflate stream; the chunks' CRC32s are merged with crc32_combine. Every entry is
+followed by a data descriptor, so the output can go to an unseekable pipe.
+
+This module is imported by the pool's worker processes and deliberately depends on nothing
+else in the application.
+"""
+import collections
+import functools
+import os
+import struct
+import time
+import zlib
+import zipfile
+
+DEFLATE_WINDOW = 32 * 1024
+STORE_READ_SIZE = 1024 * 1024
+ZIP64_LIMIT = (1 << 31) - 1  # Same threshold zipfile uses
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+ZIP_MAX = 0xFFFFFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFLATE = 20
+VERSION_ZIP64 = 45
+CREATE_SYSTEM_UNIX = 3
+
+
+CRC32_POLYNOMIAL = 0xEDB88320  # Bit-reflected, so x^0 is the top bit
+
+
+def _multmodp(a, b):
+    """a * b modulo the CRC32 polynomial."""
+    m = 1 << 31
+    product = 0
+    while True:
+        if a & m:
+            product ^= b
+            if not a & (m - 1):
+                return product
+        m >>= 1
+        b = (b >> 1) ^ CRC32_POLYNOMIAL if b & 1 else b >> 1
+
+
+def _x2n_table():
+    # x^(2^n) modulo the polynomial for n = 0..31; squaring repeats after that
+    table = []
+    power = 1 << 30  # x^1
+    for _ in range(32):
+        table.append(power)
+        power = _multmodp(power, power)
+    return table
+
+
+X2N_TABLE = _x2n_table()
+
+
+@functools.lru_cache(maxsize=64)
+def crc32_shift(len2):
+    """x^(8 * len2) modulo the polynomial: appending len2 zero bytes to a CRC multiplies it by this."""
+    power = 1 << 31  # x^0
+    k = 3  # 8 bits per byte
+    while len2:
+        if len2 & 1:
+            power = _multmodp(X2N_TABLE[k & 31], power)
+        len2 >>= 1
+        k += 1
+    return power
+
+
+def crc32_combine(crc1, crc2, len2):
+    """CRC32 of A + B from crc32(A), crc32(B) and len(B); zlib's crc32_combine, table driven as in zlib 1.2.12."""
+    if not crc1:
+        # Also the empty prefix: nothing to shift
+        return crc2
+    if len2 <= 0:
+        return crc1 ^ crc2
+    # Chunks all have the same length, so the shift is almost always cached
+    return _multmodp(crc32_shift(len2), crc1) ^ crc2
+
+
+def compress_chunk(path, offset, length, last, level):
+    """Deflate `length` bytes of `path` from `offset`; returns (crc32, bytes read, raw deflate data)."""
+    with open(path, 'rb') as f:
+        # Prime the compressor with the preceding window so chunking barely costs any ratio
+        start = max(0, offset - DEFLATE_WINDOW)
+        f.seek(start)
+        zdict = f.read(offset - start)
+        data = f.read(length)
+
+    options = {'zdict': zdict} if zdict else {}
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, **options)
+    compressed = compressor.compress(data)
+    # Only the entry's last chunk ends the deflate stream; the others stop on a byte boundary
+    compressed += compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return zlib.crc32(data), len(data), compressed
+
+
+class ZipEntry:
+    def __init__(self, path, arcname, compress_type, level):
+        self.path = path
+        self.arcname = arcname.replace(os.sep, '/')
+        self.compress_type = compress_type
+        self.level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+
+        st = os.stat(path)
+        self.expected_size = st.st_size
+        self.external_attr = (st.st_mode & 0xFFFF) << 16
+        date_time = time.localtime(st.st_mtime)[:6]
+        if date_time[0] < 1980:
+            date_time = (1980, 1, 1, 0, 0, 0)
+        self.dos_time = date_time[3] << 11 | date_time[4] << 5 | date_time[5] // 2
+        self.dos_date = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+
+        try:
+            self.encoded_name = self.arcname.encode('ascii')
+            self.flags = FLAG_DATA_DESCRIPTOR
+        except UnicodeEncodeError:
+            self.encoded_name = self.arcname.encode('utf-8')
+            self.flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.header_offset = 0
+        self.zip64 = False
+
+
+class ParallelZipWriter:
+    """Write a zip archive to `fileobj`, compressing deflated entries on `executor` (a process pool)."""
+
+    def __init__(self, fileobj, executor, workers, chunk_size, zip64_limit=ZIP64_LIMIT):
+        self.fileobj = fileobj
+        self.executor = executor
+        self.chunk_size = max(DEFLATE_WINDOW, chunk_size)
+        # Chunks in flight; enough to keep every worker busy without holding the archive in memory
+        self.window = max(2, workers * 2)
+        self.zip64_limit = zip64_limit
+        self.entries = []
+        self.offset = 0
+
+    def write_entries(self, files):
+        """Write (path, arcname, compress_type, level) entries in order, yielding each ZipEntry once written."""
+        pending = collections.deque()
+        tasks = self.plan(files)
+        current = None
+
+        try:
+            while True:
+                # Keep the pool busy, even across entry boundaries
+                for entry, chunk in tasks:
+                    future = self.executor.submit(compress_chunk, entry.path, *chunk, entry.level) if chunk else None
+                    pending.append((entry, future))
+                    if len(pending) >= self.window:
+                        break
+
+                if not pending:
+                    break
+
+                entry, future = pending.popleft()
+                if entry is not current:
+                    if current is not None:
+                        yield self.finish_entry(current)
+                    current = entry
+                    self.start_entry(entry)
+
+                if future is None:
+                    self.write_stored(entry)
+                else:
+                    crc, length, compressed = future.result()
+                    # An entry's first chunk (its only one, for most files) has nothing to combine with
+                    entry.crc = crc32_combine(entry.crc, crc, length) if entry.file_size else crc
+                    entry.file_size += length
+                    entry.compress_size += len(compressed)
+                    self.write(compressed)
+
+            if current is not None:
+                yield self.finish_entry(current)
+        finally:
+            # Don't leave the pool compressing chunks of an archive that failed
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+
+    def plan(self, files):
+        for path, arcname, compress_type, level in files:
+            entry = ZipEntry(path, arcname, compress_type, level)
+            if compress_type == zipfile.ZIP_STORED:
+                yield entry, None
+                continue
+
+            size = entry.expected_size
+            for offset in range(0, max(size, 1), self.chunk_size):
+                length = min(self.chunk_size, size - offset)
+                yield entry, (offset, length, offset + length >= size)
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def write_stored(self, entry):
+        with open(entry.path, 'rb') as f:
+            while True:
+                data = f.read(STORE_READ_SIZE)
+                if not data:
+                    break
+                entry.crc = zlib.crc32(data, entry.crc)
+                entry.file_size += len(data)
+                self.write(data)
+        entry.compress_size = entry.file_size
+
+    def start_entry(self, entry):
+        entry.header_offset = self.offset
+        # Sizes aren't known yet; like zipfile, allow for some growth before committing to 32-bit fields
+        entry.zip64 = entry.expected_size * 1.05 > self.zip64_limit
+
+        extra = b''
+        size_field = 0
+        if entry.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            size_field = ZIP_MAX
+
+        version = VERSION_ZIP64 if entry.zip64 else VERSION_DEFLATE
+        self.write(struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', version, entry.flags, entry.compress_type,
+                               entry.dos_time, entry.dos_date, 0, size_field, size_field,
+                               len(entry.encoded_name), len(extra)))
+        self.write(entry.encoded_name)
+        self.write(extra)
+
+    def finish_entry(self, entry):
+        if not entry.zip64 and max(entry.file_size, entry.compress_size) > self.zip64_limit:
+            raise zipfile.LargeZipFile(f"{entry.arcname} grew past the ZIP64 limit while being archived")
+
+        if entry.zip64:
+            self.write(struct.pack('<4sLQQ', b'PK\x07\x08', entry.crc, entry.compress_size, entry.file_size))
+        else:
+            self.write(struct.pack('<4sLLL', b'PK\x07\x08', entry.crc, entry.compress_size, entry.file_size))
+        self.entries.append(entry)
+        return entry
+
+    def close(self):
+        central_directory_offset = self.offset
+
+        for entry in self.entries:
+            # Fields that don't fit move into the ZIP64 extra, in the order the spec lists them
+            zip64_fields = []
+            file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+            if file_size > self.zip64_limit:
+                zip64_fields.append(file_size)
+                file_size = ZIP_MAX
+            if compress_size > self.zip64_limit:
+                zip64_fields.append(compress_size)
+                compress_size = ZIP_MAX
+            if header_offset > self.zip64_limit:
+                zip64_fields.append(header_offset)
+                header_offset = ZIP_MAX
+
+            extra = b''
+            if zip64_fields:
+                extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields)
+            version = VERSION_ZIP64 if zip64_fields or entry.zip64 else VERSION_DEFLATE
+
+            self.write(struct.pack('<4sBBHHHHHLLLHHHHHLL', b'PK\x01\x02', version, CREATE_SYSTEM_UNIX, version,
+                                   entry.flags, entry.compress_type, entry.dos_time, entry.dos_date, entry.crc,
+                                   compress_size, file_size, len(entry.encoded_name), len(extra), 0, 0, 0,
+                                   entry.external_attr, header_offset))
+            self.write(entry.encoded_name)
+            self.write(extra)
+
+        central_directory_size = self.offset - central_directory_offset
+        count = len(self.entries)
+
+        if (count > ZIP_FILECOUNT_LIMIT or central_directory_offset > self.zip64_limit
+                or central_directory_size > self.zip64_limit):
+            zip64_end_offset = self.offset
+            self.write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                                   count, count, central_directory_size, central_directory_offset))
+            self.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, zip64_end_offset, 1))
+            count = min(count, ZIP_FILECOUNT_LIMIT)
+            central_directory_size = min(central_directory_size, ZIP_MAX)
+            central_directory_offset = min(central_directory_offset, ZIP_MAX)
+
+        self.write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, count, count,
+                               central_directory_size, central_directory_offset, 0))
@@ -19,6 +19,22 @@ CREATE TABLE IF NOT EXISTS jobs (
     status TEXT DEFAULT 'pending',
     start_time DATETIME,
     end_time DATETIME,
+    worker_id TEXT,
+    lease_expires DATETIME,
+    attempts INTEGER DEFAULT 0,
+    phase TEXT,
+    files_total INTEGER DEFAULT 0,
+    files_done INTEGER DEFAULT 0,
+    bytes_transferred INTEGER DEFAULT 0,
+    progress_updated DATETIME,
+    file_progress TEXT,
+    priority INTEGER DEFAULT 0,
+    profile TEXT,
+    size_estimate INTEGER DEFAULT 0,
+    size_bytes INTEGER,
+    workspace_bytes INTEGER,
+    workspace_reserved INTEGER,
+    downloaded_bytes INTEGER DEFAULT 0,
     FOREIGN KEY (request_id) REFERENCES requests (id)
 );
 
@@ -29,4 +45,20 @@ CREATE TABLE IF NOT EXISTS events (
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
     message TEXT,
     FOREIGN KEY (job_id) REFERENCES job_id (id)
-);
\ No newline at end of file
+);
+
+/* Archives already uploaded, keyed by a fingerprint of the remote, file map, modtimes and compression */
+CREATE TABLE IF NOT EXISTS job_results (
+    fingerprint TEXT PRIMARY KEY,
+    job_id INTEGER,
+    remote_path TEXT,
+    sha1 TEXT,
+    created DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (job_id) REFERENCES jobs (id)
+);
+
+/* Indexes for the job queue, request lookups and per-job event trails */
+CREATE INDEX IF NOT EXISTS idx_jobs_status_id ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_schedule ON jobs (status, profile, priority DESC, size_estimate, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_request_id ON jobs (request_id);
+CREATE INDEX IF NOT EXISTS idx_events_job_id ON events (job_id);
@@ -48,6 +48,9 @@ module = wsgi:app
 master = true
 enable-threads = true
 processes = 5
+# A GET /jobs/<id>?wait= long-poll holds its thread for up to JOB_STATUS_MAX_WAIT_SECONDS;
+# at most JOB_STATUS_MAX_WAITERS of these threads do so, the rest serve every other call
+threads = 8
 
 socket = /run/uwsgi/%(project).sock
 chmod-socket = 660
@@ -0,0 +1,17 @@
+"""Test doubles shared by the test modules."""
+
+
+class FakeLogger:
+    """Stands in for app.Logger, keeping each job event message in `events`."""
+
+    def __init__(self):
+        self.events = []
+
+    def log(self, message):
+        pass
+
+    def log_error(self, message):
+        pass
+
+    def log_job(self, job_id, message):
+        self.events.append(message)
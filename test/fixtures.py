@@ -0,0 +1,28 @@
+"""Test case base classes shared by the test modules."""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import app as app_module
+from app import app, connect_db, init_db
+
+
+class ApiTestCase(unittest.TestCase):
+    """A throwaway database, API_KEY set to `api_key`, a connection (`db`) and a test client."""
+
+    api_key = 'test-key'
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, True)
+        self.database = os.path.join(self.temp_dir, 'data.db')
+        for patcher in (patch.object(app_module, 'DATABASE', self.database),
+                        patch.dict(os.environ, {'API_KEY': self.api_key})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        init_db()
+        self.db = connect_db()
+        self.addCleanup(self.db.close)
+        self.client = app.test_client()
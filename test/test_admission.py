@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch
+
+import app as app_module
+from app import AdmissionController, TokenBucket, app
+from fixtures import ApiTestCase
+
+
+class TestAdmissionControl(ApiTestCase):
+    def use_controller(self, **kwargs):
+        options = dict(ip_rate=0, key_rate=0, burst=2, max_pending=0, refresh_seconds=60)
+        options.update(kwargs)
+        controller = AdmissionController(**options)
+        controller_patch = patch.object(app_module, 'admission_controller', controller)
+        controller_patch.start()
+        self.addCleanup(controller_patch.stop)
+        return controller
+
+    def submit(self, ip='10.0.0.1', files=None, auth='test-key'):
+        payload = {
+            'files': files or {'12345_abc/a.jpg': 'a.jpg'},
+            'server': 'myremote_a',
+            'token': 'token',
+            'auth': auth,
+        }
+        return self.client.post('/submit_job', json=payload, environ_base={'REMOTE_ADDR': ip})
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(60, 2, now=0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertAlmostEqual(bucket.take(0), 1.0)
+        self.assertEqual(bucket.take(1.0), 0)
+
+    def test_per_ip_rate_limit(self):
+        self.use_controller(ip_rate=1, burst=2)
+
+        self.assertEqual([self.submit().status_code for _ in range(2)], [201, 201])
+        response = self.submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '60')
+        # Other clients are unaffected
+        self.assertEqual(self.submit(ip='10.0.0.2').status_code, 201)
+
+        statuses = [row[0] for row in self.db.execute('SELECT response_status FROM requests ORDER BY id')]
+        self.assertEqual(statuses, [201, 201, 429, 201])
+
+    def test_rate_limit_survives_restart(self):
+        self.use_controller(ip_rate=1, burst=2)
+        self.submit()
+        self.submit()
+
+        # A fresh controller replays the recent requests table
+        self.use_controller(ip_rate=1, burst=2)
+        self.assertEqual(self.submit().status_code, 429)
+
+    def test_per_key_rate_limit(self):
+        self.use_controller(key_rate=1, burst=1)
+        self.assertEqual(self.submit(ip='10.0.0.1').status_code, 201)
+        self.assertEqual(self.submit(ip='10.0.0.2').status_code, 429)
+        # Unauthenticated requests are rejected before they can drain the key's bucket
+        self.assertEqual(self.submit(auth='wrong').status_code, 403)
+
+    def test_pending_queue_cap(self):
+        controller = self.use_controller(max_pending=2)
+        with self.db:
+            self.db.execute("INSERT INTO jobs (request_id, message, status) VALUES (1, '{}', 'pending')")
+
+        self.assertEqual(self.submit().status_code, 201)
+        response = self.submit()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], str(app_module.ADMISSION_QUEUE_RETRY_AFTER))
+        self.assertEqual(controller.stats()['pending'], 2)
+
+        # Once workers drain the queue the next refresh admits jobs again
+        with self.db:
+            self.db.execute("UPDATE jobs SET status = 'completed'")
+        controller.pending_checked = None
+        self.assertEqual(self.submit().status_code, 201)
+
+    def test_job_size_limits(self):
+        self.use_controller()
+        files = {f'12345_abc/{i}.jpg': f'{i}.jpg' for i in range(4)}
+        with patch.object(app_module, 'MAX_FILES_PER_JOB', 3):
+            self.assertEqual(self.submit(files=files).status_code, 400)
+
+        with patch.dict(app.config, {'MAX_CONTENT_LENGTH': 100}):
+            self.assertEqual(self.submit(files=files).status_code, 413)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import json
+import unittest
+from unittest.mock import patch
+
+import app as app_module
+from app import AdmissionController
+from fixtures import ApiTestCase
+
+
+def job(token, **fields):
+    payload = {'files': {'12345_abc/a.jpg': 'a.jpg'}, 'server': 'myremote_a', 'token': token}
+    payload.update(fields)
+    return payload
+
+
+class TestBulkSubmission(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        controller_patch = patch.object(app_module, 'admission_controller', AdmissionController(0, 0, 2, 0, 60))
+        controller_patch.start()
+        self.addCleanup(controller_patch.stop)
+
+    def post_ndjson(self, lines, auth='test-key'):
+        body = ''.join(line + '\n' for line in lines)
+        return self.client.post('/submit_jobs', data=body, content_type='application/x-ndjson',
+                                headers={'X-API-Key': auth})
+
+    def stored_jobs(self):
+        return [(row['id'], json.loads(row['message'])['token'], row['priority'])
+                for row in self.db.execute('SELECT id, message, priority FROM jobs ORDER BY id')]
+
+    def test_json_batch_reports_each_job(self):
+        jobs = [job('one'), job('two', files={}), job('three', priority=5), job('four', server='unknown_remote')]
+
+        response = self.client.post('/submit_jobs', json={'auth': 'test-key', 'jobs': jobs})
+
+        self.assertEqual(response.status_code, 207)
+        body = response.get_json()
+        self.assertEqual((body['submitted'], body['failed']), (2, 2))
+        results = body['jobs']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertIn('files', results[1]['error'])
+        self.assertIn('profile', results[3]['error'])
+
+        stored = self.stored_jobs()
+        self.assertEqual(stored, [(results[0]['job_id'], 'one', 0), (results[2]['job_id'], 'three', 5)])
+        # The API key is not copied onto every job row, and the request row records the call only
+        self.assertNotIn('auth', self.db.execute('SELECT message FROM jobs').fetchone()['message'])
+        self.assertEqual(self.db.execute('SELECT response_status FROM requests').fetchone()['response_status'], 207)
+
+    def test_all_valid_is_created(self):
+        response = self.client.post('/submit_jobs', json={'jobs': [job('one'), job('two')]}, headers={'X-API-Key': 'test-key'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([job_id for job_id, _, _ in self.stored_jobs()], [result['job_id'] for result in response.get_json()['jobs']])
+
+    def test_requires_api_key(self):
+        response = self.client.post('/submit_jobs', json={'auth': 'wrong', 'jobs': [job('one')]})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.post_ndjson([json.dumps(job('one'))], auth='wrong').status_code, 403)
+        self.assertEqual(self.stored_jobs(), [])
+
+    def test_ndjson_stream_is_committed_in_chunks(self):
+        lines = [json.dumps(job(f'token-{i}')) for i in range(5)]
+        lines[3] = '{not json'
+        lines.insert(1, '')
+
+        with patch.object(app_module, 'BULK_SUBMIT_CHUNK', 2):
+            response = self.post_ndjson(lines)
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3, 4])
+        self.assertIn('JSON', results[3]['error'])
+        self.assertEqual([token for _, token, _ in self.stored_jobs()], ['token-0', 'token-1', 'token-2', 'token-4'])
+
+    def test_oversized_ndjson_line_is_skipped(self):
+        with patch.object(app_module, 'MAX_REQUEST_BYTES', 200):
+            response = self.post_ndjson([json.dumps(job('big', files={f'12345_abc/{i}.jpg': f'{i}.jpg' for i in range(20)})),
+                                         json.dumps(job('small'))])
+
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertIn('larger than 200 bytes', results[0]['error'])
+        self.assertIn('job_id', results[1])
+
+    def test_queue_cap_applies_per_job(self):
+        controller = AdmissionController(0, 0, 2, 3, 60)
+        with self.db:
+            self.db.execute("INSERT INTO jobs (request_id, message, status) VALUES (1, '{}', 'pending')")
+
+        with patch.object(app_module, 'admission_controller', controller):
+            response = self.client.post('/submit_jobs', json={'auth': 'test-key', 'jobs': [job(str(i)) for i in range(4)]})
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.headers['Retry-After'], str(app_module.ADMISSION_QUEUE_RETRY_AFTER))
+        results = response.get_json()['jobs']
+        self.assertEqual(['job_id' in result for result in results], [True, True, False, False])
+        self.assertEqual(results[2]['error'], 'Error, job queue is full')
+        self.assertEqual(controller.stats()['pending'], 3)
+
+    def test_batch_size_limit(self):
+        with patch.object(app_module, 'BULK_SUBMIT_MAX_JOBS', 2):
+            response = self.client.post('/submit_jobs', json={'auth': 'test-key', 'jobs': [job(str(i)) for i in range(3)]})
+        self.assertEqual(response.status_code, 207)
+        self.assertIn('at most 2 jobs', response.get_json()['jobs'][2]['error'])
+        self.assertEqual(len(self.stored_jobs()), 2)
+
+    def test_missing_jobs_array(self):
+        self.assertEqual(self.client.post('/submit_jobs', json={'auth': 'test-key'}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import patch
+
+import app as app_module
+from app import DiskBudget, DownloadCache, FileOps, OperationProfile, claim_next_job, connect_db, init_db, process_job
+
+STUB_RCLONE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark', 'stub_rclone.py')
+
+
+class TestEndToEnd(unittest.TestCase):
+    """Real jobs through FileOps against benchmark/stub_rclone.py standing in for rclone."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, True)
+        self.remote_root = os.path.join(self.temp_dir, 'remote')
+        bin_dir = os.path.join(self.temp_dir, 'bin')
+        os.makedirs(bin_dir)
+        with open(os.path.join(bin_dir, 'rclone'), 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{STUB_RCLONE}" "$@"\n')
+        os.chmod(os.path.join(bin_dir, 'rclone'), 0o755)
+
+        self.files = {
+            '12345_abc/a.txt': ('notes/a.txt', b'some text\n' * 5000),
+            '12345_abc/b.jpg': ('Album_07/image_0186.jpg', b'\xff\xd8\xff\xe0' + os.urandom(20000)),
+            '12345_abc/c.wav': ('12345_CC_04_SideA.wav', os.urandom(300000)),
+        }
+        for remote_file, (_, content) in self.files.items():
+            path = os.path.join(self.remote_root, 'myremote_a', 'down', remote_file)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+
+        self.profile = None
+        for patcher in (
+            patch.dict(os.environ, {'PATH': bin_dir + os.pathsep + os.environ['PATH'], 'STUB_RCLONE_ROOT': self.remote_root}),
+            patch.object(app_module, 'DATABASE', os.path.join(self.temp_dir, 'data.db')),
+            patch.object(app_module, 'WORKSPACE_ROOT', os.path.join(self.temp_dir, 'workspace')),
+            patch.object(app_module, 'download_cache', DownloadCache(None, 0)),
+            patch.object(app_module, 'get_operation_profile_by_name', lambda name: self.profile),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        init_db()
+        self.db = connect_db()
+        self.addCleanup(self.db.close)
+
+    def run_job(self, token, **profile_options):
+        self.profile = OperationProfile('myremote_a', '/down', '/up', retry_backoff=0, **profile_options)
+        payload = {
+            'files': {remote_file: local_name for remote_file, (local_name, _) in self.files.items()},
+            'server': 'myremote_a',
+            'token': token,
+        }
+        with self.db:
+            self.db.execute("INSERT INTO jobs (request_id, message, status) VALUES (1, ?, 'pending')", (app_module.json.dumps(payload),))
+        job_id, message = claim_next_job(self.db, 'worker')
+        process_job(self.db, job_id, message, 'worker')
+        return self.db.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()['status']
+
+    def assert_archive(self, token):
+        archive = os.path.join(self.remote_root, 'myremote_a', 'up', '12345_abc', f'{token}.zip')
+        with zipfile.ZipFile(archive) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual({name: zipf.read(name) for name in zipf.namelist()},
+                             {local_name: content for local_name, content in self.files.values()})
+
+    def test_batch_download_and_streamed_upload(self):
+        self.assertEqual(self.run_job('streamed', transfer_mode='batch', stream_upload=True), 'completed')
+        self.assert_archive('streamed')
+
+    def test_parallel_resumable_download_and_file_upload(self):
+        with patch.object(app_module, 'PIPELINE_STAGES', False):
+            status = self.run_job('uploaded', transfer_mode='parallel', stream_upload=False,
+                                  resume_threshold=100000, chunk_size=128 * 1024)
+        self.assertEqual(status, 'completed')
+        self.assert_archive('uploaded')
+
+    def test_repeat_job_is_copied_on_the_remote(self):
+        self.assertEqual(self.run_job('first'), 'completed')
+        self.assertEqual(self.run_job('second'), 'completed')
+
+        self.assert_archive('second')
+        events = [row['message'] for row in self.db.execute('SELECT message FROM events WHERE job_id = 2')]
+        self.assertTrue(any(message.startswith('Copied identical archive') for message in events))
+
+    def test_job_waits_until_its_workspace_fits(self):
+        budget = DiskBudget(400000, 0)
+        with self.db:
+            running = self.db.execute("""
+                INSERT INTO jobs (request_id, message, status, worker_id, lease_expires)
+                VALUES (1, '{}', 'in progress', 'other', datetime('now', '+1 hour'))
+            """).lastrowid
+        self.assertTrue(budget.reserve(self.db, running, 'other', 300000))
+        with patch.object(app_module, 'disk_budget', budget):
+            self.assertEqual(self.run_job('deferred'), 'pending')
+            job = self.db.execute('SELECT * FROM jobs WHERE id = 2').fetchone()
+            size = sum(len(content) for _, content in self.files.values())
+            self.assertEqual((job['phase'], job['attempts'], job['size_bytes'], job['workspace_bytes']), ('deferred', 0, size, size))
+            self.assertIsNone(job['workspace_reserved'])
+            self.assertIsNone(claim_next_job(self.db, 'worker'))
+
+            budget.release(self.db, running)
+            job_id, message = claim_next_job(self.db, 'worker')
+            process_job(self.db, job_id, message, 'worker')
+
+        self.assertEqual(self.db.execute('SELECT status FROM jobs WHERE id = 2').fetchone()['status'], 'completed')
+        self.assert_archive('deferred')
+        self.assertEqual(budget.stats(self.db)['reserved'], 0)
+
+    def test_job_larger_than_the_workspace_fails(self):
+        with patch.object(app_module, 'disk_budget', DiskBudget(100000, 0)):
+            self.assertEqual(self.run_job('too-large'), 'failed')
+
+    def test_job_larger_than_the_free_space_waits(self):
+        # Without a fixed budget only a job larger than the whole filesystem is hopeless
+        with patch.object(app_module, 'disk_budget', DiskBudget(0, 0)), \
+                patch.object(app_module, 'workspace_free_bytes', lambda: 100000):
+            self.assertEqual(self.run_job('wait-for-space'), 'pending')
+            with self.db:
+                self.db.execute("UPDATE jobs SET timestamp = datetime('now', '-1 day')")
+            # Once it has waited long enough it is claimed; now the filesystem is too small
+            with patch.object(app_module, 'workspace_total_bytes', lambda: 100000):
+                job_id, message = claim_next_job(self.db, 'worker')
+                process_job(self.db, job_id, message, 'worker')
+        self.assertEqual(self.db.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()['status'], 'failed')
+
+    def test_unsized_job_that_cannot_reserve_is_deferred(self):
+        budget = DiskBudget(0, 0)
+        with patch.object(app_module, 'disk_budget', budget), \
+                patch.object(budget, 'reserve', return_value=False), \
+                patch.object(FileOps, 'workspace_estimate', return_value=(None, None)):
+            self.assertEqual(self.run_job('unsized'), 'pending')
+
+    def test_missing_file_fails_the_job(self):
+        os.remove(os.path.join(self.remote_root, 'myremote_a', 'down', '12345_abc', 'b.jpg'))
+        self.assertEqual(self.run_job('incomplete', retries=0), 'failed')
+        self.assertFalse(os.path.exists(os.path.join(self.remote_root, 'myremote_a', 'up', '12345_abc', 'incomplete.zip')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,691 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+import hashlib
+import json
+from unittest.mock import patch
+
+from app import CompressionPolicy, DigestCache, DownloadCache, FileOps, OperationProfile, file_digests, parse_size
+from fakes import FakeLogger
+
+real_popen = subprocess.Popen
+
+
+class FakeCopyProcess:
+    """Stands in for the `rclone copy` process; `log(process)` yields its stderr lines as it copies."""
+
+    def __init__(self, log):
+        self.exit_code = 0
+        self.returncode = None
+        self.stderr = log(self)
+
+    def wait(self):
+        self.returncode = self.exit_code
+        return self.returncode
+
+    def kill(self):
+        self.exit_code = -9
+
+
+def copied(relative_path):
+    return json.dumps({'level': 'info', 'msg': 'Copied (new)', 'object': relative_path}) + '\n'
+
+
+class TestFileOpsDownload(unittest.TestCase):
+    def setUp(self):
+        self.cache_patch = patch('app.download_cache', DownloadCache(None, 0))
+        self.cache_patch.start()
+        self.addCleanup(self.cache_patch.stop)
+        self.temp_dir = tempfile.mkdtemp()
+        self.logger = FakeLogger()
+        self.profile = OperationProfile('myremote_a', '/remote/down', '/remote/up', concurrency=3, transfer_mode='parallel', retry_backoff=0)
+        self.file_ops = FileOps(self.profile, self.logger, 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+        self.files = {
+            "12345_abc/a.mp4": "12345_VHS_07.mp4",
+            "12345_abc/b.wav": "12345_CC_04_SideA.wav",
+            "12345_abc/c.jpg": "Album_07/image_0186.jpg",
+            "12345_abc/missing.jpg": "Album_07/image_0187.jpg",
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def fake_rclone(self, command, check=True, **kwargs):
+        # Simulate `rclone copyto <remote> <local>` by writing a small file
+        if command[1] == 'lsjson':
+            return subprocess.CompletedProcess(command, 0, stdout='[]', stderr='')
+        source, destination = command[-2], command[-1]
+        if source.endswith('missing.jpg'):
+            raise subprocess.CalledProcessError(3, command)
+        time.sleep(0.05)
+        with open(destination, 'wb') as f:
+            f.write(b'x' * 10)
+        return subprocess.CompletedProcess(command, 0)
+
+    def test_download_reports_each_file_and_totals(self):
+        with patch('app.subprocess.run', side_effect=self.fake_rclone):
+            downloaded = self.file_ops.download(self.files)
+
+        self.assertEqual(len(downloaded), 3)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, 'Album_07', 'image_0186.jpg')))
+        self.assertEqual(self.file_ops.remote_base_dir, '12345_abc')
+        self.assertTrue(any(e.startswith('Failed to download 12345_abc/missing.jpg') for e in self.logger.events))
+        self.assertIn('Downloaded 3/4 files, 30 bytes', self.logger.events[-1])
+        self.assertEqual(self.file_ops.failed_downloads, ['12345_abc/missing.jpg'])
+        self.assertEqual(sum('missing.jpg failed (attempt' in e for e in self.logger.events), self.profile.retries)
+
+    def test_download_respects_profile_concurrency(self):
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+
+        def tracking_rclone(command, check=True, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            try:
+                return self.fake_rclone(command, check, **kwargs)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        files = {f"12345_abc/{i}.jpg": f"{i}.jpg" for i in range(12)}
+        with patch('app.subprocess.run', side_effect=tracking_rclone):
+            self.file_ops.download(files)
+
+        self.assertGreater(peak[0], 1)
+        self.assertLessEqual(peak[0], self.profile.concurrency)
+
+
+class TestFileOpsPipeline(unittest.TestCase):
+    def setUp(self):
+        self.cache_patch = patch('app.download_cache', DownloadCache(None, 0))
+        self.cache_patch.start()
+        self.addCleanup(self.cache_patch.stop)
+        self.temp_dir = tempfile.mkdtemp()
+        self.logger = FakeLogger()
+        self.profile = OperationProfile('myremote_a', '/remote/down', '/remote/up', concurrency=2, transfer_mode='parallel', retries=0)
+        self.file_ops = FileOps(self.profile, self.logger, 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+        self.files = {f"12345_abc/{i}.txt": f"{i}.txt" for i in range(6)}
+        self.first_zipped = threading.Event()
+        self.started = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def fake_rclone(self, command, **kwargs):
+        if command[1] == 'lsjson':
+            return subprocess.CompletedProcess(command, 0, stdout='[]', stderr='')
+        self.started.append(command[2])
+        if command[2].endswith('missing.txt'):
+            raise subprocess.CalledProcessError(3, command)
+        if command[2].endswith('5.txt'):
+            # The last download only finishes once the zip writer has taken an earlier file
+            self.assertTrue(self.first_zipped.wait(5))
+        with open(command[3], 'wb') as f:
+            f.write(command[2].encode() * 100)
+        return subprocess.CompletedProcess(command, 0)
+
+    def zip_pipelined(self, files):
+        report_zip_entry = FileOps.report_zip_entry
+
+        def reporting(file_ops, *args):
+            report_zip_entry(file_ops, *args)
+            self.first_zipped.set()
+
+        with patch('app.subprocess.run', side_effect=self.fake_rclone), \
+                patch.object(FileOps, 'report_zip_entry', reporting):
+            self.file_ops.start_pipeline(files)
+            return self.file_ops.zip('token')
+
+    def test_files_are_zipped_as_they_land(self):
+        done = []
+        self.file_ops.on_downloads_done = lambda: done.append(True)
+        zip_path = self.zip_pipelined(self.files)
+
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(sorted(zipf.namelist()), sorted(self.files.values()))
+        self.assertEqual(done, [True])
+        self.assertEqual(self.file_ops.remote_base_dir, '12345_abc')
+
+    def test_batch_files_are_zipped_while_rclone_copies(self):
+        self.profile = OperationProfile('myremote_a', '/remote/down', '/remote/up', transfer_mode='batch', retries=0)
+        self.file_ops = FileOps(self.profile, self.logger, 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+
+        def fake_copy(command, **kwargs):
+            staging_dir = command[3]
+            with open(command[command.index('--files-from-raw') + 1]) as manifest:
+                relative_paths = manifest.read().split()
+
+            def log(process):
+                for relative_path in relative_paths:
+                    if relative_path == relative_paths[-1]:
+                        # The last file only lands once the zip writer has taken an earlier one
+                        self.assertTrue(self.first_zipped.wait(5))
+                    os.makedirs(os.path.join(staging_dir, os.path.dirname(relative_path)), exist_ok=True)
+                    with open(os.path.join(staging_dir, relative_path), 'wb') as f:
+                        f.write(relative_path.encode() * 100)
+                    yield copied(relative_path)
+            return FakeCopyProcess(log)
+
+        with patch('app.subprocess.Popen', side_effect=fake_copy):
+            zip_path = self.zip_pipelined(self.files)
+
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(sorted(zipf.namelist()), sorted(self.files.values()))
+
+    def test_incomplete_download_aborts_archive(self):
+        zip_path = self.zip_pipelined(dict(self.files, **{"12345_abc/missing.txt": "missing.txt"}))
+
+        self.assertIsNone(zip_path)
+        self.assertTrue(any(e.startswith('Exception during zipping: 1 files could not be downloaded') for e in self.logger.events))
+
+    def test_downloads_wait_for_the_zip_writer(self):
+        files = {f"12345_abc/{i}.jpg": f"{i}.jpg" for i in range(20)}
+        with patch('app.PIPELINE_QUEUE_FILES', 3), patch('app.subprocess.run', side_effect=self.fake_rclone):
+            pending = self.file_ops.download_iter(files)
+            next(pending)
+            time.sleep(0.2)
+            # Nothing consumed beyond the first file: only concurrency + queue downloads were started
+            self.assertEqual(len(self.started), self.profile.concurrency + 3 + 1)
+            self.assertEqual(len(list(pending)), 19)
+
+
+class TestFileOpsBatchDownload(unittest.TestCase):
+    def setUp(self):
+        self.cache_patch = patch('app.download_cache', DownloadCache(None, 0))
+        self.cache_patch.start()
+        self.addCleanup(self.cache_patch.stop)
+        self.temp_dir = tempfile.mkdtemp()
+        self.remote_dir = tempfile.mkdtemp()
+        self.logger = FakeLogger()
+        # ':local' turns the profile into rclone's on-the-fly local backend (':local:/path')
+        self.profile = OperationProfile(':local', self.remote_dir, self.remote_dir, concurrency=2, transfer_mode='batch', retry_backoff=0)
+        self.file_ops = FileOps(self.profile, self.logger, 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+        self.files = {
+            "12345_abc/a.mp4": "12345_VHS_07.mp4",
+            "12345_abc/c.jpg": "Album_07/image_0186.jpg",
+            "12345_abc/missing.jpg": "Album_07/image_0187.jpg",
+        }
+        os.makedirs(os.path.join(self.remote_dir, '12345_abc'))
+        for remote_file in ("12345_abc/a.mp4", "12345_abc/c.jpg"):
+            with open(os.path.join(self.remote_dir, remote_file), 'wb') as f:
+                f.write(b'y' * 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.remote_dir, ignore_errors=True)
+
+    def fake_rclone_list(self, command, **kwargs):
+        return subprocess.CompletedProcess(command, 0, stdout='[]', stderr='')
+
+    def fake_rclone_copy(self, command, **kwargs):
+        # Simulate `rclone copy :local:<root> <staging> --files-from-raw <manifest> --use-json-log`
+        source_root = command[2].split(':', 2)[2]
+        staging_dir = command[3]
+        manifest_path = command[command.index('--files-from-raw') + 1]
+
+        def log(process):
+            with open(manifest_path) as manifest:
+                relative_paths = [line.rstrip('\n') for line in manifest]
+            for relative_path in relative_paths:
+                source = os.path.join(source_root, relative_path)
+                if not os.path.exists(source):
+                    process.exit_code = 3
+                    yield f'ERROR : {relative_path}: not found\n'
+                    continue
+                os.makedirs(os.path.dirname(os.path.join(staging_dir, relative_path)), exist_ok=True)
+                shutil.copyfile(source, os.path.join(staging_dir, relative_path))
+                yield copied(relative_path)
+        return FakeCopyProcess(log)
+
+    def assert_batch_result(self, downloaded):
+        self.assertEqual(len(downloaded), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, '12345_VHS_07.mp4')))
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, 'Album_07', 'image_0186.jpg')))
+        self.assertTrue(any(e.startswith('Failed to download 12345_abc/missing.jpg') for e in self.logger.events))
+        # Staging area and manifest must not be left behind for the zip step
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['12345_VHS_07.mp4', 'Album_07'])
+
+    def test_batch_download_runs_one_rclone_process(self):
+        manifests = []
+
+        def recording_copy(command, **kwargs):
+            with open(command[command.index('--files-from-raw') + 1]) as manifest:
+                manifests.append(manifest.read().split())
+            return self.fake_rclone_copy(command, **kwargs)
+
+        with patch('app.subprocess.run', side_effect=self.fake_rclone_list), \
+                patch('app.subprocess.Popen', side_effect=recording_copy) as mock_popen:
+            downloaded = self.file_ops.download(self.files)
+
+        copies = [c[0][0] for c in mock_popen.call_args_list]
+        # One process for the whole job, then retries for just the file that failed
+        self.assertEqual(len(copies), 1 + self.profile.retries)
+        self.assertEqual(len(manifests[0]), 3)
+        self.assertEqual(manifests[1:], [['12345_abc/missing.jpg']] * self.profile.retries)
+        self.assertEqual(self.file_ops.failed_downloads, ['12345_abc/missing.jpg'])
+        self.assert_batch_result(downloaded)
+
+    @unittest.skipUnless(shutil.which('rclone'), 'rclone is not installed')
+    def test_batch_download_with_rclone_local_backend(self):
+        downloaded = self.file_ops.download(self.files)
+        self.assert_batch_result(downloaded)
+
+
+class TestFileOpsResumableTransfers(unittest.TestCase):
+    def setUp(self):
+        self.cache_patch = patch('app.download_cache', DownloadCache(None, 0))
+        self.cache_patch.start()
+        self.addCleanup(self.cache_patch.stop)
+        self.temp_dir = tempfile.mkdtemp()
+        self.logger = FakeLogger()
+        self.profile = OperationProfile('myremote_a', '/remote/down', '/remote/up', transfer_mode='batch', retry_backoff=0,
+                                        chunk_size='1K', resume_threshold='2K', bwlimit='10M', multi_thread_streams=4)
+        self.file_ops = FileOps(self.profile, self.logger, 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+        self.content = os.urandom(5000)
+        self.offsets = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def fake_rclone(self, command, stdout=None, **kwargs):
+        if command[1] == 'lsjson':
+            return subprocess.CompletedProcess(command, 0, stdout=json.dumps([{'Path': '12345_abc/big.mov', 'Size': len(self.content)}]), stderr='')
+
+        self.assertEqual(command[:2], ['rclone', 'cat'])
+        offset = int(command[command.index('--offset') + 1])
+        count = int(command[command.index('--count') + 1])
+        self.offsets.append(offset)
+        if len(self.offsets) == 3:
+            # Drop the connection half way through the third chunk
+            stdout.write(self.content[offset:offset + count // 2])
+            raise subprocess.CalledProcessError(5, command)
+        stdout.write(self.content[offset:offset + count])
+        return subprocess.CompletedProcess(command, 0)
+
+    def test_large_file_resumes_after_failure(self):
+        with patch('app.subprocess.run', side_effect=self.fake_rclone):
+            downloaded = self.file_ops.download({"12345_abc/big.mov": "big.mov"})
+
+        destination = os.path.join(self.temp_dir, 'big.mov')
+        self.assertEqual(downloaded, [destination])
+        with open(destination, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        # The retry picks up from the bytes already on disk instead of starting over
+        self.assertEqual(self.offsets, [0, 1024, 2048, 2560, 3584, 4608])
+        self.assertFalse(os.path.exists(destination + '.partial'))
+        self.assertTrue(any('Resuming' in e and 'at byte 2560' in e for e in self.logger.events))
+
+    def test_profile_flags(self):
+        self.assertEqual(self.profile.rclone_flags(), ['--bwlimit', '10M', '--multi-thread-streams', '4', '--multi-thread-chunk-size', '1024B'])
+        self.assertEqual(self.profile.rclone_flags(multi_thread=False), ['--bwlimit', '10M'])
+        self.assertEqual([self.profile.retry_delay(n) for n in (1, 2, 3)], [0, 0, 0])
+        self.assertEqual(OperationProfile('a', '/', '/', retry_backoff=2).retry_delay(3), 8)
+        self.assertEqual(parse_size('1.5G'), 1536 * 1024 ** 2)
+        self.assertIn(f'{64 * 1024 ** 2}B', OperationProfile('a', '/', '/', multi_thread_streams=4, chunk_size='64M').rclone_flags())
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = DownloadCache(os.path.join(self.temp_dir, 'cache'), 10 ** 6)
+        self.cache_patch = patch('app.download_cache', self.cache)
+        self.cache_patch.start()
+        self.remote_calls = []
+        self.remote_files = {
+            "12345_abc/a.mp4": {'Path': '12345_abc/a.mp4', 'Size': 30, 'ModTime': '2024-01-01T00:00:00Z'},
+            "12345_abc/c.jpg": {'Path': '12345_abc/c.jpg', 'Size': 30, 'ModTime': '2024-01-01T00:00:00Z'},
+        }
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_file_ops(self, job_id):
+        file_ops = FileOps(OperationProfile('myremote_a', '/down', '/up', transfer_mode='parallel'), FakeLogger(), job_id)
+        file_ops.temp_job_directory = os.path.join(self.temp_dir, f'job-{job_id}')
+        return file_ops
+
+    def fake_rclone(self, command, **kwargs):
+        if command[1] == 'lsjson':
+            return subprocess.CompletedProcess(command, 0, stdout=json.dumps(list(self.remote_files.values())), stderr='')
+        self.remote_calls.append(command[2])
+        with open(command[3], 'wb') as f:
+            f.write(b'z' * 30)
+        return subprocess.CompletedProcess(command, 0)
+
+    def test_fingerprint_tracks_files_and_modtimes(self):
+        files = {"12345_abc/a.mp4": "a.mp4", "12345_abc/c.jpg": "Album_07/c.jpg"}
+
+        with patch('app.subprocess.run', side_effect=self.fake_rclone):
+            first = self.make_file_ops(1).fingerprint(files)
+            self.assertEqual(self.make_file_ops(2).fingerprint(dict(reversed(list(files.items())))), first)
+            self.assertNotEqual(self.make_file_ops(3).fingerprint({"12345_abc/a.mp4": "renamed.mp4", "12345_abc/c.jpg": "Album_07/c.jpg"}), first)
+
+            self.remote_files["12345_abc/c.jpg"]['ModTime'] = '2024-02-01T00:00:00Z'
+            self.assertNotEqual(self.make_file_ops(4).fingerprint(files), first)
+
+            # A file the remote doesn't list can't be fingerprinted
+            self.assertIsNone(self.make_file_ops(5).fingerprint(dict(files, **{"12345_abc/gone.jpg": "gone.jpg"})))
+
+    def test_second_job_is_served_from_cache(self):
+        files = {"12345_abc/a.mp4": "a.mp4", "12345_abc/c.jpg": "Album_07/c.jpg"}
+
+        with patch('app.subprocess.run', side_effect=self.fake_rclone):
+            first = self.make_file_ops(1)
+            first.download(files)
+            second = self.make_file_ops(2)
+            downloaded = second.download(files)
+
+        self.assertEqual(len(self.remote_calls), 2)
+        self.assertEqual((first.cache_hits, first.cache_misses), (0, 2))
+        self.assertEqual((second.cache_hits, second.cache_misses, second.cache_bytes_saved), (2, 0, 60))
+        self.assertEqual(len(downloaded), 2)
+        with open(os.path.join(second.temp_job_directory, 'Album_07', 'c.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), b'z' * 30)
+        self.assertIn('Download cache: 2 hits, 0 misses, 60 bytes saved', second.logger.events)
+
+        # Cleaning up a workspace leaves the cached copy alone
+        first.cleanup()
+        second.cleanup()
+        self.assertTrue(os.path.exists(self.cache.path(self.cache.key('myremote_a', '12345_abc/a.mp4', self.remote_files['12345_abc/a.mp4']))))
+
+    def test_changed_remote_file_is_downloaded_again(self):
+        files = {"12345_abc/a.mp4": "a.mp4"}
+
+        with patch('app.subprocess.run', side_effect=self.fake_rclone):
+            self.make_file_ops(1).download(files)
+            self.remote_files['12345_abc/a.mp4']['ModTime'] = '2024-02-01T00:00:00Z'
+            file_ops = self.make_file_ops(2)
+            file_ops.download(files)
+
+        self.assertEqual(len(self.remote_calls), 2)
+        self.assertEqual(file_ops.cache_misses, 1)
+
+    def test_evict_removes_least_recently_used(self):
+        self.cache.max_bytes = 250
+
+        def store(key):
+            source = os.path.join(self.temp_dir, key)
+            with open(source, 'wb') as f:
+                f.write(b'x' * 100)
+            # Downloads keep the remote file's (old) modtime
+            os.utime(source, (1000, 1000))
+            self.cache.store(key, source)
+            time.sleep(0.01)
+
+        store('bb22')
+        store('cc33')
+        self.assertTrue(self.cache.fetch('bb22', os.path.join(self.temp_dir, 'used.bin')))
+        time.sleep(0.01)
+        store('aa11')
+
+        self.cache.evict()
+
+        # The file cached last stays even though its modtime is the oldest
+        self.assertFalse(os.path.exists(self.cache.path('cc33')))
+        self.assertTrue(os.path.exists(self.cache.path('bb22')))
+        self.assertTrue(os.path.exists(self.cache.path('aa11')))
+
+
+class TestFileOpsStreamingUpload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.remote_dir = tempfile.mkdtemp()
+        self.logger = FakeLogger()
+        self.profile = OperationProfile('myremote_a', '/remote/down', '/remote/up', retry_backoff=0)
+        self.file_ops = FileOps(self.profile, self.logger, 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+        self.file_ops.remote_base_dir = '12345_abc'
+        os.makedirs(os.path.join(self.temp_dir, 'Album_07'))
+        with open(os.path.join(self.temp_dir, 'Album_07', 'image_0186.jpg'), 'wb') as f:
+            f.write(os.urandom(4096))
+        with open(os.path.join(self.temp_dir, '12345_VHS_07.mp4'), 'wb') as f:
+            f.write(b'frame' * 1000)
+        self.file_ops.downloaded_files = [
+            os.path.join(self.temp_dir, '12345_VHS_07.mp4'),
+            os.path.join(self.temp_dir, 'Album_07', 'image_0186.jpg'),
+        ]
+        self.remote_file = os.path.join(self.remote_dir, 'upload.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        shutil.rmtree(self.remote_dir, ignore_errors=True)
+
+    def fake_rcat(self, command, **kwargs):
+        # `rclone rcat <remote>` stores stdin at the remote path
+        self.assertEqual(command[:2], ['rclone', 'rcat'])
+        self.assertEqual(command[2], 'myremote_a:/remote/up/12345_abc/token.zip')
+        return real_popen(['sh', '-c', f'cat > {self.remote_file}'], **kwargs)
+
+    def fake_hashsum(self, command, **kwargs):
+        with open(self.remote_file, 'rb') as f:
+            remote_sha1 = hashlib.sha1(f.read()).hexdigest()
+        return subprocess.CompletedProcess(command, 0, stdout=f"{remote_sha1}  token.zip\n", stderr='')
+
+    def test_zip_and_upload_streams_without_local_archive(self):
+        with patch('app.subprocess.Popen', side_effect=self.fake_rcat), \
+                patch('app.subprocess.run', side_effect=self.fake_hashsum):
+            remote_upload_path = self.file_ops.zip_and_upload('token')
+
+        self.assertEqual(remote_upload_path, 'myremote_a:/remote/up/12345_abc/token.zip')
+        self.assertIn('SHA1 checksum verification successful.', self.logger.events)
+        self.assertFalse(any(name.endswith('.zip') for name in os.listdir(self.temp_dir)))
+
+        with zipfile.ZipFile(self.remote_file) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(sorted(zipf.namelist()), ['12345_VHS_07.mp4', 'Album_07/image_0186.jpg'])
+
+    def test_zip_and_upload_reports_rclone_failure(self):
+        def failing_rcat(command, **kwargs):
+            return real_popen(['sh', '-c', 'cat > /dev/null; exit 5'], **kwargs)
+
+        with patch('app.subprocess.Popen', side_effect=failing_rcat):
+            self.assertIsNone(self.file_ops.zip_and_upload('token'))
+
+        self.assertTrue(any(e.startswith('Failed to stream token.zip') for e in self.logger.events))
+
+    def test_zip_and_upload_retries_when_rcat_exits_mid_stream(self):
+        # Far more than a pipe buffer, so writing after rclone is gone breaks the pipe
+        with open(os.path.join(self.temp_dir, '12345_VHS_07.mp4'), 'wb') as f:
+            f.write(os.urandom(2 * 1024 * 1024))
+        calls = []
+
+        def flaky_rcat(command, **kwargs):
+            calls.append(command)
+            if len(calls) == 1:
+                return real_popen(['sh', '-c', 'echo "connection reset" >&2; exit 3'], **kwargs)
+            return self.fake_rcat(command, **kwargs)
+
+        with patch('app.subprocess.Popen', side_effect=flaky_rcat), \
+                patch('app.subprocess.run', side_effect=self.fake_hashsum):
+            remote_upload_path = self.file_ops.zip_and_upload('token')
+
+        self.assertEqual(remote_upload_path, 'myremote_a:/remote/up/12345_abc/token.zip')
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(any(e.startswith('Upload of token.zip failed (attempt 1/') and 'exit status 3' in e for e in self.logger.events))
+
+    def test_zip_and_upload_retries_checksum_mismatch(self):
+        hashsums = []
+
+        def flaky_hashsum(command, **kwargs):
+            hashsums.append(command)
+            if len(hashsums) == 1:
+                return subprocess.CompletedProcess(command, 0, stdout="0000  token.zip\n", stderr='')
+            return self.fake_hashsum(command, **kwargs)
+
+        with patch('app.subprocess.Popen', side_effect=self.fake_rcat) as mock_popen, \
+                patch('app.subprocess.run', side_effect=flaky_hashsum):
+            remote_upload_path = self.file_ops.zip_and_upload('token')
+
+        self.assertEqual(remote_upload_path, 'myremote_a:/remote/up/12345_abc/token.zip')
+        self.assertEqual(mock_popen.call_count, 2)
+        self.assertIn('SHA1 checksum verification successful.', self.logger.events)
+
+
+class TestCompressionPolicy(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_media_is_stored_by_extension_and_signature(self):
+        policy = CompressionPolicy('deflate', 6)
+        mp4 = self.make_file('clip.mp4', b'\x00' * 64)
+        # A JPEG without a telling extension is still recognised from its first bytes
+        jpeg = self.make_file('scan.bin', b'\xff\xd8\xff\xe0' + b'\x00' * 60)
+        text = self.make_file('notes.txt', b'hello ' * 100)
+
+        self.assertEqual(policy.choose(mp4), (zipfile.ZIP_STORED, None, 'store'))
+        self.assertEqual(policy.choose(jpeg), (zipfile.ZIP_STORED, None, 'store'))
+        self.assertEqual(policy.choose(text), (zipfile.ZIP_DEFLATED, 6, 'deflate-6'))
+
+    def test_configurable_method(self):
+        text = self.make_file('notes.txt', b'hello ' * 100)
+        self.assertEqual(CompressionPolicy('bzip2', 9).choose(text), (zipfile.ZIP_BZIP2, 9, 'bzip2-9'))
+        self.assertEqual(CompressionPolicy('lzma', 6).choose(text), (zipfile.ZIP_LZMA, None, 'lzma'))
+        with self.assertRaises(ValueError):
+            CompressionPolicy('brotli', 6)
+
+    def test_zip_records_method_and_savings(self):
+        logger = FakeLogger()
+        file_ops = FileOps(OperationProfile('myremote_a', '/down', '/up'), logger, 1)
+        file_ops.temp_job_directory = self.temp_dir
+        file_ops.downloaded_files = [
+            self.make_file('clip.mp4', os.urandom(2048)),
+            self.make_file('notes.txt', b'hello ' * 1000),
+        ]
+
+        zip_path = file_ops.zip('token')
+
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertEqual(zipf.getinfo('clip.mp4').compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zipf.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertTrue(any(e.startswith('Zipped clip.mp4 using store: 2048 -> 2048 bytes (saved 0)') for e in logger.events))
+        self.assertTrue(any(e.startswith('Zipped notes.txt using deflate-6') for e in logger.events))
+        self.assertTrue(any(e.startswith('Compression saved') for e in logger.events))
+
+
+class TestFileDigests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_patch = patch('app.digest_cache', DigestCache(100))
+        self.cache_patch.start()
+        self.addCleanup(self.cache_patch.stop)
+        self.path = os.path.join(self.temp_dir, 'data.bin')
+        self.content = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_one_pass_digests_are_cached_until_file_changes(self):
+        with patch('app.hashlib.new', wraps=hashlib.new) as mock_new:
+            digests = file_digests(self.path, ('md5', 'sha1'))
+            self.assertEqual(digests, {'md5': hashlib.md5(self.content).hexdigest(), 'sha1': hashlib.sha1(self.content).hexdigest()})
+            self.assertEqual(mock_new.call_count, 2)
+
+            # Cached digests cost nothing; a new algorithm only computes that one
+            self.assertEqual(file_digests(self.path, ('sha1',))['sha1'], digests['sha1'])
+            self.assertEqual(mock_new.call_count, 2)
+            file_digests(self.path, ('sha1', 'sha256'))
+            self.assertEqual(mock_new.call_count, 3)
+
+        with open(self.path, 'ab') as f:
+            f.write(b'more')
+        self.assertEqual(file_digests(self.path)['sha1'], hashlib.sha1(self.content + b'more').hexdigest())
+
+    def test_zip_is_hashed_while_written(self):
+        file_ops = FileOps(OperationProfile('myremote_a', '/down', '/up'), FakeLogger(), 1)
+        file_ops.temp_job_directory = self.temp_dir
+        file_ops.downloaded_files = [self.path]
+        zip_path = file_ops.zip('token')
+
+        with patch('app.open', side_effect=AssertionError('archive was read back')):
+            sha1 = file_ops.calculate_sha1(zip_path)
+        with open(zip_path, 'rb') as f:
+            self.assertEqual(sha1, hashlib.sha1(f.read()).hexdigest())
+
+    def test_download_hash_mismatch_is_retried(self):
+        file_ops = FileOps(OperationProfile('myremote_a', '/down', '/up', transfer_mode='parallel', retries=1, retry_backoff=0), FakeLogger(), 1)
+        file_ops.temp_job_directory = self.temp_dir
+        payloads = [b'corrupted', b'good']
+
+        def fake_rclone(command, **kwargs):
+            if command[1] == 'lsjson':
+                entry = {'Path': '12345_abc/a.txt', 'Size': 4, 'ModTime': '2024-01-01T00:00:00Z',
+                         'Hashes': {'sha1': hashlib.sha1(b'good').hexdigest(), 'quickxor': 'ignored'}}
+                return subprocess.CompletedProcess(command, 0, stdout=json.dumps([entry]), stderr='')
+            with open(command[3], 'wb') as f:
+                f.write(payloads.pop(0))
+            return subprocess.CompletedProcess(command, 0)
+
+        with patch('app.DOWNLOAD_VERIFY_HASH', True), patch('app.download_cache', DownloadCache(None, 0)), \
+                patch('app.subprocess.run', side_effect=fake_rclone) as mock_run:
+            downloaded = file_ops.download({'12345_abc/a.txt': 'a.txt'})
+
+        self.assertIn('--hash', mock_run.call_args_list[0][0][0])
+        self.assertEqual(len(downloaded), 1)
+        with open(downloaded[0], 'rb') as f:
+            self.assertEqual(f.read(), b'good')
+        self.assertTrue(any('sha1 mismatch for 12345_abc/a.txt' in e for e in file_ops.logger.events))
+
+
+class TestFileOpsWorkspace(unittest.TestCase):
+    def setUp(self):
+        self.workspace_root = tempfile.mkdtemp()
+        self.root_patch = patch('app.WORKSPACE_ROOT', self.workspace_root)
+        self.root_patch.start()
+        self.profile = OperationProfile('myremote_a', '/down', '/up')
+
+    def tearDown(self):
+        self.root_patch.stop()
+        shutil.rmtree(self.workspace_root, ignore_errors=True)
+
+    def test_jobs_get_separate_workspaces(self):
+        first = FileOps(self.profile, FakeLogger(), 1)
+        second = FileOps(self.profile, FakeLogger(), 2)
+        self.assertEqual(first.temp_job_directory, os.path.join(self.workspace_root, 'job-1'))
+        self.assertNotEqual(first.temp_job_directory, second.temp_job_directory)
+
+    def test_zip_contains_only_downloaded_files_and_cleanup_removes_workspace(self):
+        file_ops = FileOps(self.profile, FakeLogger(), 7)
+        os.makedirs(os.path.join(file_ops.temp_job_directory, 'Album_07'))
+        downloaded = os.path.join(file_ops.temp_job_directory, 'Album_07', 'image_0186.jpg')
+        with open(downloaded, 'wb') as f:
+            f.write(b'jpeg')
+        # Anything not downloaded by this job stays out of the archive
+        with open(os.path.join(file_ops.temp_job_directory, 'stray.txt'), 'wb') as f:
+            f.write(b'stray')
+        file_ops.downloaded_files = [downloaded]
+
+        with zipfile.ZipFile(file_ops.zip('token')) as zipf:
+            self.assertEqual(zipf.namelist(), ['Album_07/image_0186.jpg'])
+
+        file_ops.cleanup()
+        self.assertFalse(os.path.exists(file_ops.temp_job_directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
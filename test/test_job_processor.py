@@ -0,0 +1,582 @@
+import os
+import sqlite3
+import subprocess
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import app as app_module
+from app import DiskBudget, DownloadSlot, EventSink, FileOps, JobProgress, OperationProfile, process_job, JobSignal, Logger, thread_db, app, claim_next_job, connect_db, finish_job, get_job_workspace, init_db, sweep_workspaces
+from fakes import FakeLogger
+
+
+class JobProcessorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.database = os.path.join(self.temp_dir, 'data.db')
+        self.database_patch = patch.object(app_module, 'DATABASE', self.database)
+        self.database_patch.start()
+        init_db()
+        self.db = connect_db()
+
+    def tearDown(self):
+        self.db.close()
+        self.database_patch.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def add_jobs(self, count):
+        with self.db:
+            for i in range(count):
+                self.db.execute("INSERT INTO jobs (request_id, message, status) VALUES (?, ?, 'pending')", (i, '{}'))
+
+    def job(self, job_id):
+        return self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+class TestDatabaseSetup(JobProcessorTestCase):
+    def test_wal_mode_and_indexes(self):
+        self.assertEqual(self.db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        indexes = {row[0] for row in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertTrue({'idx_jobs_status_id', 'idx_jobs_request_id', 'idx_events_job_id'} <= indexes)
+
+        plan = ' '.join(row[3] for row in self.db.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1"))
+        self.assertIn('idx_jobs_status_id', plan)
+
+    def test_init_db_leaves_no_connection_behind(self):
+        # wsgi.py runs init_db in the uWSGI master; forked workers must not inherit a connection
+        fresh = os.path.join(self.temp_dir, 'fresh.db')
+        with patch.object(app_module, 'DATABASE', fresh):
+            init_db()
+        self.assertNotIn(fresh, getattr(app_module.db_local, 'connections', {}))
+
+    def test_old_database_is_migrated(self):
+        old_database = os.path.join(self.temp_dir, 'old.db')
+        db = sqlite3.connect(old_database)
+        db.executescript('''
+            CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, request_id INTEGER,
+                               timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, message TEXT,
+                               status TEXT DEFAULT 'pending', start_time DATETIME, end_time DATETIME);
+            INSERT INTO jobs (request_id, message) VALUES (1, '{}');
+        ''')
+        db.close()
+
+        with patch.object(app_module, 'DATABASE', old_database):
+            init_db()
+            columns = {row[1] for row in thread_db().execute('PRAGMA table_info(jobs)')}
+            attempts = thread_db().execute('SELECT attempts FROM jobs').fetchone()[0]
+
+        self.assertTrue({'worker_id', 'lease_expires', 'attempts'} <= columns)
+        self.assertEqual(attempts, 0)
+
+    def test_connections_are_reused_per_thread(self):
+        self.assertIs(thread_db(), thread_db())
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(thread_db()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], thread_db())
+
+
+class TestJobClaiming(JobProcessorTestCase):
+    def test_concurrent_workers_claim_distinct_jobs(self):
+        self.add_jobs(40)
+        claimed = []
+        lock = threading.Lock()
+
+        def worker(worker_id):
+            db = connect_db()
+            db.execute('PRAGMA busy_timeout = 5000')
+            with app.app_context():
+                while True:
+                    job = claim_next_job(db, worker_id)
+                    if job is None:
+                        break
+                    with lock:
+                        claimed.append(job[0])
+            db.close()
+
+        threads = [threading.Thread(target=worker, args=(f'worker-{i}',)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(claimed), list(range(1, 41)))
+        statuses = {row[0] for row in self.db.execute('SELECT status FROM jobs')}
+        self.assertEqual(statuses, {'in progress'})
+
+    def test_expired_lease_is_reclaimed(self):
+        self.add_jobs(1)
+        with app.app_context():
+            self.assertEqual(claim_next_job(self.db, 'crashed-worker')[0], 1)
+            # A live lease keeps the job away from other workers
+            self.assertIsNone(claim_next_job(self.db, 'other-worker'))
+
+            with self.db:
+                self.db.execute("UPDATE jobs SET lease_expires = datetime('now', '-1 seconds') WHERE id = 1")
+            self.assertEqual(claim_next_job(self.db, 'other-worker')[0], 1)
+
+        job = self.job(1)
+        self.assertEqual(job['worker_id'], 'other-worker')
+        self.assertEqual(job['attempts'], 2)
+
+        # The crashed worker can no longer finish a job it lost
+        finish_job(self.db, 1, 'crashed-worker', 'completed')
+        self.assertEqual(self.job(1)['status'], 'in progress')
+        finish_job(self.db, 1, 'other-worker', 'completed')
+        self.assertEqual(self.job(1)['status'], 'completed')
+
+    def test_job_fails_after_max_attempts(self):
+        self.add_jobs(1)
+        with app.app_context():
+            for attempt in range(app_module.JOB_MAX_ATTEMPTS):
+                self.assertEqual(claim_next_job(self.db, f'worker-{attempt}')[0], 1)
+                with self.db:
+                    self.db.execute("UPDATE jobs SET lease_expires = datetime('now', '-1 seconds') WHERE id = 1")
+
+            self.assertIsNone(claim_next_job(self.db, 'last-worker'))
+
+        self.assertEqual(self.job(1)['status'], 'failed')
+
+
+class TestJobScheduling(JobProcessorTestCase):
+    def add_job(self, profile='myremote_a', priority=0, size=1):
+        with self.db:
+            cursor = self.db.execute("""
+                INSERT INTO jobs (request_id, message, status, priority, profile, size_estimate)
+                VALUES (0, '{}', 'pending', ?, ?, ?)
+            """, (priority, profile, size))
+        return cursor.lastrowid
+
+    def claim(self):
+        claimed = claim_next_job(self.db, 'worker')
+        return claimed and claimed[0]
+
+    def test_priority_then_smallest_job(self):
+        large = self.add_job(size=500)
+        small = self.add_job(size=3)
+        urgent = self.add_job(priority=5, size=900)
+
+        self.assertEqual([self.claim(), self.claim(), self.claim(), self.claim()], [urgent, small, large, None])
+
+    def test_fair_share_across_profiles(self):
+        a_jobs = [self.add_job('myremote_a') for _ in range(3)]
+        b_jobs = [self.add_job('myremote_b') for _ in range(2)]
+
+        # Alternates between profiles while both have work, even though profile a queued first
+        self.assertEqual([self.claim() for _ in range(5)], [a_jobs[0], b_jobs[0], a_jobs[1], b_jobs[1], a_jobs[2]])
+
+    def test_running_cap_per_profile(self):
+        a_first, a_second = self.add_job('myremote_a'), self.add_job('myremote_a')
+        with patch.object(app_module, 'JOB_MAX_RUNNING_PER_PROFILE', 1):
+            self.assertEqual(self.claim(), a_first)
+            self.assertIsNone(self.claim())
+            finish_job(self.db, a_first, 'worker', 'completed')
+            self.assertEqual(self.claim(), a_second)
+
+    def test_starving_job_runs_next(self):
+        old = self.add_job(size=1000)
+        small = self.add_job(size=1)
+        with self.db:
+            self.db.execute("UPDATE jobs SET timestamp = datetime('now', '-1 hour') WHERE id = ?", (old,))
+
+        with patch.object(app_module, 'JOB_STARVATION_SECONDS', 600):
+            self.assertEqual(self.claim(), old)
+        self.assertEqual(self.claim(), small)
+
+    def use_disk_budget(self, free, limit=0):
+        self.free_bytes = free
+        budget = DiskBudget(limit, 0)
+        for patcher in (patch.object(app_module, 'disk_budget', budget),
+                        patch.object(app_module, 'workspace_free_bytes', lambda: self.free_bytes),
+                        patch.object(app_module, 'workspace_total_bytes', lambda: 1000)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return budget
+
+    def set_workspace_bytes(self, job_id, workspace_bytes):
+        with self.db:
+            self.db.execute('UPDATE jobs SET workspace_bytes = ? WHERE id = ?', (workspace_bytes, job_id))
+
+    def start_running_job(self, budget, workspace_bytes, db=None):
+        """A job some other worker is running, holding `workspace_bytes` if they fit."""
+        db = db or self.db
+        with db:
+            job_id = db.execute("""
+                INSERT INTO jobs (request_id, message, status, worker_id, lease_expires, profile)
+                VALUES (0, '{}', 'in progress', 'other', datetime('now', '+1 hour'), 'other')
+            """).lastrowid
+        return job_id, budget.reserve(db, job_id, 'other', workspace_bytes)
+
+    def test_jobs_wait_for_workspace(self):
+        budget = self.use_disk_budget(free=1000)
+        large = self.add_job(priority=5)
+        self.set_workspace_bytes(large, 800)
+        small = self.add_job()
+        self.set_workspace_bytes(small, 300)
+        unsized = self.add_job()
+        running, reserved = self.start_running_job(budget, 500)
+        self.assertTrue(reserved)
+        self.assertFalse(self.start_running_job(budget, 600)[1])
+
+        # The large job doesn't fit next to the running one; unsized jobs are sized once claimed
+        self.assertEqual([self.claim(), self.claim(), self.claim()], [small, unsized, None])
+        self.assertTrue(budget.release(self.db, running))
+        self.assertEqual(self.claim(), large)
+
+    def test_workspace_budget_follows_free_space(self):
+        budget = self.use_disk_budget(free=1000, limit=600)
+        self.assertEqual(budget.available(self.db), 600)
+        running, _ = self.start_running_job(budget, 100)
+        # Something else filling the disk shrinks what's left for new jobs
+        self.free_bytes = 300
+        self.assertEqual(budget.available(self.db), 200)
+        # Bytes a running job already wrote were counted in its reservation
+        with self.db:
+            self.db.execute('UPDATE jobs SET downloaded_bytes = 100 WHERE id = ?', (running,))
+        self.free_bytes = 200
+        self.assertEqual(budget.available(self.db), 200)
+        budget.release(self.db, running)
+        self.free_bytes = 50
+        self.assertEqual(budget.capacity(self.db), 50)
+
+    def test_streamed_bytes_do_not_count_as_workspace(self):
+        budget = self.use_disk_budget(free=1000)
+        running, _ = self.start_running_job(budget, 600)
+        large = self.add_job()
+        self.set_workspace_bytes(large, 500)
+        small = self.add_job()
+        self.set_workspace_bytes(small, 400)
+
+        # Half way through a stream-upload job: 300 bytes downloaded to the workspace, and the
+        # compressed entry sent straight to the remote
+        progress = JobProgress(running, 'other')
+        file_ops = FileOps(OperationProfile('myremote_a', '/down', '/up'), FakeLogger(), running, progress)
+        file_ops.advance_progress(bytes_transferred=300, downloaded_bytes=300)
+        file_ops.streaming = True
+        file_ops.report_zip_entry('a.wav', 'a.wav', 'deflate', 300, 290)
+        progress.write()
+        self.free_bytes = 700
+
+        self.assertEqual((self.job(running)['bytes_transferred'], self.job(running)['downloaded_bytes']), (590, 300))
+        self.assertEqual(budget.available(self.db), 400)
+        self.assertEqual([self.claim(), self.claim()], [small, None])
+
+    def test_workspace_budget_is_shared_between_processes(self):
+        # Every uWSGI process has its own DiskBudget; the reservations they admit against are in the database
+        first = self.use_disk_budget(free=1000)
+        second = DiskBudget(0, 0)
+        other_db = connect_db()
+        self.addCleanup(other_db.close)
+
+        running, reserved = self.start_running_job(first, 600)
+        self.assertTrue(reserved)
+        self.assertEqual(second.available(other_db), 400)
+        self.assertFalse(self.start_running_job(second, 500, db=other_db)[1])
+        self.assertTrue(self.start_running_job(second, 400, db=other_db)[1])
+        self.assertEqual(first.stats(self.db)['reserved'], 1000)
+        self.assertEqual(second.stats(other_db)['deferred'], 1)
+
+        # A job sized too large for what the other process left is not claimed here either
+        pending = self.add_job()
+        self.set_workspace_bytes(pending, 100)
+        self.assertIsNone(self.claim())
+        first.release(self.db, running)
+        self.assertEqual(self.claim(), pending)
+
+    def test_starving_job_holds_back_others_until_it_fits(self):
+        budget = self.use_disk_budget(free=1000)
+        old = self.add_job()
+        self.set_workspace_bytes(old, 800)
+        small = self.add_job()
+        self.set_workspace_bytes(small, 100)
+        with self.db:
+            self.db.execute("UPDATE jobs SET timestamp = datetime('now', '-1 hour') WHERE id = ?", (old,))
+        running, _ = self.start_running_job(budget, 500)
+
+        with patch.object(app_module, 'JOB_STARVATION_SECONDS', 600):
+            self.assertIsNone(self.claim())
+            budget.release(self.db, running)
+            self.assertEqual(self.claim(), old)
+        self.assertEqual(self.claim(), small)
+
+    def test_jobs_without_profile_are_scheduled(self):
+        legacy = self.add_job(profile=None)
+        self.assertEqual(self.claim(), legacy)
+
+    def test_selection_uses_schedule_index(self):
+        plan = ' '.join(row[3] for row in self.db.execute("""
+            EXPLAIN QUERY PLAN SELECT id FROM jobs WHERE status = 'pending' AND profile IS 'myremote_a'
+            ORDER BY priority DESC, size_estimate ASC, id ASC LIMIT 1
+        """))
+        self.assertIn('idx_jobs_schedule', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_small_job_wait_is_bounded_under_large_job_flood(self):
+        # Two workers busy with a queue of 20 hour-long jobs when a one-minute job arrives
+        for _ in range(20):
+            self.add_job(size=1000)
+        workers = {worker: (60.0, claim_next_job(self.db, worker)[0]) for worker in ('w1', 'w2')}
+        small = self.add_job(size=1)
+        started = {}
+
+        while True:
+            worker, (clock, job_id) = min(workers.items(), key=lambda item: item[1][0])
+            finish_job(self.db, job_id, worker, 'completed')
+            self.assertEqual((self.job(job_id)['status'], self.job(job_id)['worker_id']), ('completed', worker))
+            claimed = claim_next_job(self.db, worker)
+            if claimed is None:
+                break
+            started[claimed[0]] = clock
+            workers[worker] = (clock + (1.0 if claimed[0] == small else 60.0), claimed[0])
+
+        # Waits for at most one large job to finish instead of the whole backlog
+        self.assertLessEqual(started[small], 60.0)
+        self.assertEqual(len(started), 19)
+
+
+class TestWorkspaceSweep(JobProcessorTestCase):
+    def test_sweep_removes_orphans_but_keeps_running_jobs(self):
+        self.add_jobs(2)
+        workspace_root = os.path.join(self.temp_dir, 'workspaces')
+
+        with patch.object(app_module, 'WORKSPACE_ROOT', workspace_root):
+            with app.app_context():
+                running_job = claim_next_job(self.db, 'worker-1')[0]
+
+            for job_id in (1, 2):
+                os.makedirs(os.path.join(get_job_workspace(job_id), 'Album_07'))
+            with open(os.path.join(workspace_root, 'left_over_from_old_layout.jpg'), 'wb') as f:
+                f.write(b'x')
+
+            sweep_workspaces(self.db)
+
+            self.assertEqual(os.listdir(workspace_root), [f'job-{running_job}'])
+
+
+class TestJobProgress(JobProcessorTestCase):
+    def test_progress_is_visible_and_db_unlocked_while_job_runs(self):
+        self.add_jobs(1)
+        with self.db:
+            self.db.execute("UPDATE jobs SET message = ? WHERE id = 1", (
+                '{"files": {"12345_abc/a.jpg": "a.jpg", "12345_abc/b.jpg": "b.jpg"}, "server": "myremote_a", "token": "t"}',))
+        observed = {}
+
+        def fake_download(file_ops, files):
+            for name in files.values():
+                file_ops.downloaded_files.append(name)
+                file_ops.advance_progress(files=1, bytes_transferred=100)
+            file_ops.progress.write()
+
+            # Another connection sees the job mid-run and can write without waiting on the worker
+            other = connect_db()
+            other.execute('PRAGMA busy_timeout = 0')
+            observed['row'] = dict(other.execute('SELECT * FROM jobs WHERE id = 1').fetchone())
+            with other:
+                other.execute("INSERT INTO jobs (request_id, message) VALUES (99, '{}')")
+            other.close()
+
+        with patch('app.PIPELINE_STAGES', False), patch.object(FileOps, 'fingerprint', return_value=None), \
+                patch.object(FileOps, 'download', fake_download), \
+                patch.object(FileOps, 'zip_and_upload', return_value='myremote_a:/up/t.zip'), \
+                patch.object(FileOps, 'cleanup'), app.app_context():
+            job = claim_next_job(self.db, 'worker-1')
+            process_job(self.db, *job, 'worker-1')
+
+        self.assertEqual(observed['row']['status'], 'in progress')
+        self.assertEqual(observed['row']['phase'], 'downloading')
+        self.assertEqual((observed['row']['files_total'], observed['row']['files_done']), (2, 2))
+        self.assertEqual(observed['row']['bytes_transferred'], 200)
+
+        job = self.job(1)
+        self.assertEqual((job['status'], job['phase']), ('completed', 'completed'))
+
+
+class TestJobResults(JobProcessorTestCase):
+    def add_job(self, token):
+        message = '{"files": {"12345_abc/a.jpg": "a.jpg"}, "server": "myremote_a", "token": "%s"}' % token
+        with self.db:
+            self.db.execute("INSERT INTO jobs (request_id, message) VALUES (1, ?)", (message,))
+
+    def run_next_job(self, rclone):
+        def fake_zip_and_upload(file_ops, token):
+            file_ops.archive_sha1 = 'f' * 40
+            return file_ops.get_remote_upload_path(token + '.zip')
+
+        def fake_fingerprint(file_ops, files):
+            file_ops.remote_base_dir = '12345_abc'
+            return 'fp-1'
+
+        def fake_download(file_ops, files):
+            self.downloads += 1
+
+        profile = OperationProfile('myremote_a', '/remote/down', '/remote/up')
+        with patch('app.get_operation_profile_by_name', return_value=profile), patch('app.PIPELINE_STAGES', False), \
+                patch.object(FileOps, 'fingerprint', fake_fingerprint), \
+                patch.object(FileOps, 'download', fake_download), \
+                patch.object(FileOps, 'zip_and_upload', fake_zip_and_upload), \
+                patch('app.subprocess.run', side_effect=rclone) as mock_run, app.app_context():
+            job = claim_next_job(self.db, 'worker-1')
+            process_job(self.db, *job, 'worker-1')
+        return [c[0][0][:2] for c in mock_run.call_args_list]
+
+    def hashsum(self, command, **kwargs):
+        return subprocess.CompletedProcess(command, 0, stdout='f' * 40 + '  t.zip\n', stderr='')
+
+    def test_repeat_job_is_copied_remotely(self):
+        self.downloads = 0
+        self.add_job('first')
+        self.add_job('second')
+        self.add_job('second')
+
+        self.assertEqual(self.run_next_job(self.hashsum), [])
+        result = self.db.execute('SELECT * FROM job_results').fetchone()
+        self.assertEqual((result['fingerprint'], result['job_id'], result['remote_path']), ('fp-1', 1, 'myremote_a:/remote/up/12345_abc/first.zip'))
+
+        # Different token: a server-side copy of the first archive, verified by its SHA1
+        copies = []
+        def rclone(command, **kwargs):
+            if command[1] == 'copyto':
+                copies.append(command[2:4])
+                return subprocess.CompletedProcess(command, 0)
+            return self.hashsum(command, **kwargs)
+
+        self.assertEqual(self.run_next_job(rclone), [['rclone', 'copyto'], ['rclone', 'hashsum']])
+        self.assertEqual(copies, [['myremote_a:/remote/up/12345_abc/first.zip', 'myremote_a:/remote/up/12345_abc/second.zip']])
+
+        # Same token again: the archive is already in place
+        self.assertEqual(self.run_next_job(self.hashsum), [['rclone', 'hashsum']])
+        self.assertEqual(self.downloads, 1)
+        self.assertEqual([self.job(i)['status'] for i in (1, 2, 3)], ['completed'] * 3)
+
+    def test_missing_result_falls_back_to_building(self):
+        self.downloads = 0
+        with self.db:
+            self.db.execute("INSERT INTO job_results (fingerprint, job_id, remote_path, sha1) VALUES ('fp-1', 7, 'myremote_a:/gone.zip', ?)", ('f' * 40,))
+        self.add_job('first')
+
+        def rclone(command, **kwargs):
+            raise subprocess.CalledProcessError(3, command)
+
+        self.run_next_job(rclone)
+        self.assertEqual(self.downloads, 1)
+        self.assertEqual(self.job(1)['status'], 'completed')
+        self.assertEqual(self.db.execute('SELECT job_id FROM job_results').fetchone()[0], 1)
+
+
+class TestJobOverlap(JobProcessorTestCase):
+    def test_next_job_downloads_while_previous_uploads(self):
+        with self.db:
+            for token in ('first', 'second'):
+                self.db.execute("INSERT INTO jobs (request_id, message) VALUES (1, ?)", (
+                    '{"files": {"12345_abc/a.jpg": "a.jpg"}, "server": "myremote_a", "token": "%s"}' % token,))
+        second_downloading = threading.Event()
+        overlapped = []
+
+        def fake_download_iter(file_ops, files):
+            if file_ops.job_id == 2:
+                second_downloading.set()
+            file_ops.on_downloads_done()
+            return
+            yield
+
+        def fake_zip_and_upload(file_ops, token):
+            list(file_ops.archive_files())
+            if file_ops.job_id == 1:
+                # Job 1 is past its downloads, so job 2 may take the only download slot
+                overlapped.append(second_downloading.wait(5))
+            return 'myremote_a:/up/%s.zip' % token
+
+        slots = threading.Semaphore(1)
+
+        def worker(worker_id):
+            db = connect_db()
+            slot = DownloadSlot(slots)
+            slot.acquire()
+            job = claim_next_job(db, worker_id)
+            try:
+                process_job(db, *job, worker_id, slot)
+            finally:
+                slot.release()
+                db.close()
+
+        with patch.object(FileOps, 'fingerprint', return_value=None), \
+                patch.object(FileOps, 'download_iter', fake_download_iter), \
+                patch.object(FileOps, 'zip_and_upload', fake_zip_and_upload), \
+                patch.object(FileOps, 'cleanup'), app.app_context():
+            first = threading.Thread(target=worker, args=('worker-1',))
+            first.start()
+            second = threading.Thread(target=worker, args=('worker-2',))
+            second.start()
+            first.join(10)
+            second.join(10)
+
+        self.assertEqual(overlapped, [True])
+        self.assertEqual([self.job(i)['status'] for i in (1, 2)], ['completed', 'completed'])
+
+
+class TestEventSink(JobProcessorTestCase):
+    def count_events(self):
+        return self.db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def test_events_are_written_in_batches(self):
+        sink = EventSink(batch_size=100, flush_interval=60)
+        for i in range(450):
+            sink.emit(1, f"Downloaded file {i}")
+
+        self.assertTrue(sink.flush())
+        self.assertEqual(self.count_events(), 450)
+
+        stats = sink.stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertLessEqual(stats['flushes'], 5)
+        self.assertGreater(stats['flush_seconds_total'], 0)
+
+    def test_time_threshold_flushes_without_explicit_flush(self):
+        sink = EventSink(batch_size=1000, flush_interval=0.05)
+        sink.emit(1, "Zipping completed")
+
+        deadline = time.monotonic() + 5
+        while self.count_events() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.count_events(), 1)
+
+    def test_finishing_a_job_flushes_its_events(self):
+        self.add_jobs(1)
+        sink = EventSink(batch_size=1000, flush_interval=60)
+        with patch.object(app_module, 'event_sink', sink), app.app_context():
+            claim_next_job(self.db, 'worker-1')
+            Logger().log_job(1, "Uploaded token.zip")
+            finish_job(self.db, 1, 'worker-1', 'completed')
+
+        self.assertEqual(self.db.execute('SELECT message FROM events WHERE job_id = 1').fetchone()[0], "Uploaded token.zip")
+
+
+class TestJobSignal(unittest.TestCase):
+    def test_notify_wakes_waiting_worker(self):
+        signal = JobSignal()
+        generation = signal.generation
+        threading.Timer(0.05, signal.notify).start()
+
+        started = time.monotonic()
+        self.assertTrue(signal.wait(generation, 5))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_notify_before_wait_is_not_lost(self):
+        signal = JobSignal()
+        generation = signal.generation
+        signal.notify()
+        self.assertTrue(signal.wait(generation, 0))
+
+    def test_wait_times_out_without_notify(self):
+        signal = JobSignal()
+        self.assertFalse(signal.wait(signal.generation, 0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import app as app_module
+from app import JobProgress, app, claim_next_job
+from fixtures import ApiTestCase
+
+
+class TestJobStatusApi(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.db:
+            for status in ('pending', 'pending', 'completed'):
+                self.db.execute("INSERT INTO jobs (request_id, message, status) VALUES (1, '{}', ?)", (status,))
+        self.headers = {'X-API-Key': 'test-key'}
+
+    def test_requires_api_key(self):
+        self.assertEqual(self.client.get('/jobs/1').status_code, 403)
+        self.assertEqual(self.client.get('/jobs', headers={'X-API-Key': 'wrong'}).status_code, 403)
+        self.assertEqual(self.client.get('/jobs/1', headers=self.headers).status_code, 200)
+        # A key in the URL would end up in access logs
+        self.assertEqual(self.client.get('/jobs/1?auth=test-key').status_code, 403)
+
+    def test_get_job_returns_progress(self):
+        with app.app_context():
+            claim_next_job(self.db, 'worker-1')
+        progress = JobProgress(1, 'worker-1')
+        progress.set_phase('downloading', 2)
+        progress.advance(files=1, bytes_transferred=1024, remote_file='12345_abc/a.jpg', state='downloaded')
+        progress.write()
+
+        response = self.client.get('/jobs/1', headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        job = response.json
+        self.assertEqual((job['status'], job['phase']), ('in progress', 'downloading'))
+        self.assertEqual((job['files_total'], job['files_done'], job['bytes_transferred']), (2, 1, 1024))
+        self.assertEqual(job['files'], {'12345_abc/a.jpg': 'downloaded'})
+        self.assertIsNotNone(job['started'])
+
+        self.assertEqual(self.client.get('/jobs/999', headers=self.headers).status_code, 404)
+
+    def test_etag_returns_not_modified_until_job_changes(self):
+        first = self.client.get('/jobs/1', headers=self.headers)
+        etag = first.headers['ETag']
+
+        unchanged = self.client.get('/jobs/1', headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(unchanged.status_code, 304)
+
+        with app.app_context():
+            claim_next_job(self.db, 'worker-1')
+        changed = self.client.get('/jobs/1', headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json['status'], 'in progress')
+
+    def test_long_poll_returns_when_progress_is_written(self):
+        with app.app_context():
+            claim_next_job(self.db, 'worker-1')
+        etag = self.client.get('/jobs/1', headers=self.headers).headers['ETag']
+
+        def make_progress():
+            time.sleep(0.1)
+            JobProgress(1, 'worker-1').set_phase('zipping', 3)
+
+        threading.Thread(target=make_progress).start()
+        started = time.monotonic()
+        response = self.client.get('/jobs/1?wait=10', headers={**self.headers, 'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['phase'], 'zipping')
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_long_polls_beyond_the_cap_are_answered_at_once(self):
+        with app.app_context():
+            claim_next_job(self.db, 'worker-1')
+        etag = self.client.get('/jobs/1', headers=self.headers).headers['ETag']
+        headers = {**self.headers, 'If-None-Match': etag}
+        waiters = threading.BoundedSemaphore(1)
+        held = []
+
+        with patch.object(app_module, 'status_waiters', waiters):
+            waiter = threading.Thread(target=lambda: held.append(app.test_client().get('/jobs/1?wait=10', headers=headers)))
+            waiter.start()
+            deadline = time.monotonic() + 5
+            while waiters._value and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            started = time.monotonic()
+            response = self.client.get('/jobs/1?wait=10', headers=headers)
+            self.assertEqual((response.status_code, response.headers['ETag']), (304, etag))
+            self.assertLess(time.monotonic() - started, 1)
+
+            JobProgress(1, 'worker-1').set_phase('zipping', 3)
+            waiter.join(5)
+
+        self.assertEqual(held[0].status_code, 200)
+        # The slot is free again
+        self.assertTrue(waiters.acquire(blocking=False))
+
+    def test_long_poll_wait_must_be_finite(self):
+        etag = self.client.get('/jobs/1', headers=self.headers).headers['ETag']
+        for wait in ('nan', 'inf', '-inf'):
+            response = self.client.get(f'/jobs/1?wait={wait}', headers={**self.headers, 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 400, wait)
+
+        started = time.monotonic()
+        response = self.client.get('/jobs/1?wait=-5', headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_list_jobs_by_status(self):
+        response = self.client.get('/jobs?status=pending', headers=self.headers)
+        self.assertEqual([job['job_id'] for job in response.json['jobs']], [2, 1])
+
+        page = self.client.get('/jobs?limit=1&before=3', headers=self.headers)
+        self.assertEqual([job['job_id'] for job in page.json['jobs']], [2])
+
+        etag = response.headers['ETag']
+        again = self.client.get('/jobs?status=pending', headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(again.status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
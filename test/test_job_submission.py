@@ -1,11 +1,20 @@
 import unittest
 from unittest.mock import patch
 from flask import json
-from app import app  # Import your Flask app here
+import app as app_module
+from app import AdmissionController
+from fixtures import ApiTestCase
+
+class TestJobSubmission(ApiTestCase):
+    # The API key the sample requests use
+    api_key = '^D93T@C^?LHp]LEpQj_DGiRCmNzcQxkh'
 
-class TestJobSubmission(unittest.TestCase):
     def setUp(self):
-        self.client = app.test_client()
+        super().setUp()
+        # No rate limits
+        controller_patch = patch.object(app_module, 'admission_controller', AdmissionController(0, 0, 0, 0, 0))
+        controller_patch.start()
+        self.addCleanup(controller_patch.stop)
         self.endpoint = '/submit_job'
         self.sample_request = {
             "files": {
@@ -18,8 +27,8 @@ class TestJobSubmission(unittest.TestCase):
             "auth": "^D93T@C^?LHp]LEpQj_DGiRCmNzcQxkh"
         }
 
-    @patch('main.Logger.log_request')
-    @patch('main.Logger.create_job_record')
+    @patch('app.Logger.log_request')
+    @patch('app.Logger.create_job_record')
     def test_submit_job_positive(self, mock_create_job_record, mock_log_request):
         mock_log_request.return_value = 1  # Simulating a request ID
         mock_create_job_record.return_value = 1  # Simulating a job ID
@@ -29,8 +38,8 @@ class TestJobSubmission(unittest.TestCase):
         self.assertIn('Job submitted successfully', response.json['message'])
 
 
-    @patch('main.Logger.log_request')
-    @patch('main.Logger.create_job_record')
+    @patch('app.Logger.log_request')
+    @patch('app.Logger.create_job_record')
     def test_submit_job_negative(self, mock_create_job_record, mock_log_request):
         mock_log_request.return_value = None  # Simulate a failure in logging the request
         mock_create_job_record.return_value = None  # Simulate a failure in creating the job record
@@ -43,8 +52,8 @@ class TestJobSubmission(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('Error occurred during request submission', response.json['message'])
 
-    @patch('main.Logger.log_request')
-    @patch('main.Logger.create_job_record')
+    @patch('app.Logger.log_request')
+    @patch('app.Logger.create_job_record')
     def test_submit_job_missing_files(self, mock_create_job_record, mock_log_request):
         mock_log_request.return_value = 1
         mock_create_job_record.return_value = 1
@@ -60,8 +69,8 @@ class TestJobSubmission(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn("'files' array is empty", response.json['message'])
 
-    @patch('main.Logger.log_request')
-    @patch('main.Logger.create_job_record')
+    @patch('app.Logger.log_request')
+    @patch('app.Logger.create_job_record')
     def test_submit_job_invalid_auth(self, mock_create_job_record, mock_log_request):
         mock_log_request.return_value = 1
         mock_create_job_record.return_value = 1
@@ -139,7 +148,7 @@ class TestJobSubmission(unittest.TestCase):
         self.assertIn("Failed to match server-operation profile", response.json['message'])
 
     # Test with Database Connection Error
-    #@patch('main.get_db')
+    #@patch('app.get_db')
     #def test_database_connection_error(self, mock_get_db):
     #    mock_get_db.side_effect = Exception("Database connection error")
 #
@@ -148,7 +157,7 @@ class TestJobSubmission(unittest.TestCase):
     #    self.assertIn("Database error", response.json['message'])
 
     # Test with Unexpected Exception
-    @patch('main.Logger.create_job_record')
+    @patch('app.Logger.create_job_record')
     def test_unexpected_exception(self, mock_create_job_record):
         # Simulate an unexpected exception
         mock_create_job_record.side_effect = Exception("Unexpected error")
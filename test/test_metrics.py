@@ -0,0 +1,143 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from app import DownloadCache, FileOps, Metrics, OperationProfile, StackSampler
+from fakes import FakeLogger
+from fixtures import ApiTestCase
+
+
+def sample_value(text, series):
+    match = re.search(rf'^{re.escape(series)} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        metrics = Metrics()
+        for seconds in (0.002, 0.3, 0.4, 5000):
+            metrics.observe('damzipper_phase_seconds', seconds, phase='zip', profile='myremote_a')
+
+        text = metrics.render()
+        series = 'damzipper_phase_seconds_bucket{phase="zip",profile="myremote_a",le="%s"}'
+        self.assertEqual(text.count('# TYPE damzipper_phase_seconds histogram'), 1)
+        self.assertEqual(sample_value(text, series % '0.001'), 0)
+        self.assertEqual(sample_value(text, series % '0.005'), 1)
+        self.assertEqual(sample_value(text, series % '0.5'), 3)
+        self.assertEqual(sample_value(text, series % '3600'), 3)
+        self.assertEqual(sample_value(text, series % '+Inf'), 4)
+        self.assertEqual(sample_value(text, 'damzipper_phase_seconds_count{phase="zip",profile="myremote_a"}'), 4)
+
+    def test_phase_records_bytes_and_throughput(self):
+        metrics = Metrics()
+        metrics.record_phase('download', 'myremote_a', 2.0, 8 * 1024 * 1024)
+
+        text = metrics.render()
+        self.assertEqual(sample_value(text, 'damzipper_phase_bytes_sum{phase="download",profile="myremote_a"}'), 8 * 1024 * 1024)
+        self.assertEqual(sample_value(text, 'damzipper_phase_throughput_bytes_per_second_sum{phase="download",profile="myremote_a"}'),
+                         4 * 1024 * 1024)
+
+    def test_label_values_are_escaped(self):
+        metrics = Metrics()
+        metrics.inc('damzipper_jobs_finished_total', status='a"b\\c\nd')
+        self.assertIn('damzipper_jobs_finished_total{status="a\\"b\\\\c\\nd"} 1', metrics.render())
+
+
+class TestFileOpsInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.metrics = Metrics()
+        for target, value in (('app.metrics', self.metrics), ('app.download_cache', DownloadCache(None, 0))):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        profile = OperationProfile('myremote_a', '/down', '/up', transfer_mode='parallel', retry_backoff=0)
+        self.file_ops = FileOps(profile, FakeLogger(), 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def fake_rclone(self, command, check=True, **kwargs):
+        if command[1] == 'lsjson':
+            return subprocess.CompletedProcess(command, 0, stdout='[]', stderr='')
+        with open(command[3], 'wb') as f:
+            f.write(b'x' * 1000)
+        return subprocess.CompletedProcess(command, 0)
+
+    def test_each_phase_is_timed_per_profile(self):
+        with patch('app.subprocess.run', side_effect=self.fake_rclone):
+            self.file_ops.download({'12345_abc/a.txt': 'a.txt', '12345_abc/b.txt': 'b.txt'})
+        with patch('app.ZIP_WORKERS', 1):
+            zip_path = self.file_ops.zip('token')
+        self.file_ops.calculate_sha1(zip_path)
+
+        text = self.metrics.render()
+        count = 'damzipper_phase_seconds_count{phase="%s",profile="myremote_a"}'
+        self.assertEqual(sample_value(text, count % 'list'), 1)
+        self.assertEqual(sample_value(text, count % 'download_file'), 2)
+        self.assertEqual(sample_value(text, 'damzipper_phase_bytes_sum{phase="download",profile="myremote_a"}'), 2000)
+        self.assertEqual(sample_value(text, 'damzipper_phase_bytes_sum{phase="zip",profile="myremote_a"}'), 2000)
+        # The archive's SHA1 was taken while zipping, so there was nothing left to hash
+        self.assertIsNone(sample_value(text, count % 'hash'))
+
+
+class TestMetricsEndpoint(ApiTestCase):
+    def test_requires_api_key(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'X-API-Key': 'test-key'}).status_code, 200)
+        self.assertEqual(self.client.get('/metrics?auth=test-key').status_code, 403)
+
+    def test_reports_queue_and_component_stats(self):
+        with self.db:
+            self.db.execute("INSERT INTO jobs (request_id, message, status, timestamp) VALUES (1, '{}', 'pending', datetime('now', '-90 seconds'))")
+            self.db.execute("INSERT INTO jobs (request_id, message, status) VALUES (1, '{}', 'pending')")
+            self.db.execute("INSERT INTO jobs (request_id, message, status) VALUES (1, '{}', 'in progress')")
+
+        response = self.client.get('/metrics', headers={'X-API-Key': 'test-key'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertEqual(sample_value(text, 'damzipper_jobs{status="pending"}'), 2)
+        self.assertEqual(sample_value(text, 'damzipper_jobs{status="in progress"}'), 1)
+        self.assertGreaterEqual(sample_value(text, 'damzipper_oldest_pending_seconds'), 89)
+        for series in ('damzipper_event_queue_depth', 'damzipper_profile_lookups_total',
+                       'damzipper_digest_cache_entries', 'damzipper_admission_rejected_total',
+                       'damzipper_workspace_capacity_bytes', 'damzipper_db_size_bytes',
+                       'damzipper_retention_deleted_total{table="events"}'):
+            self.assertIsNotNone(sample_value(text, series), series)
+        self.assertIn('# TYPE damzipper_admission_rejected_total counter', text)
+
+
+class TestStackSampler(unittest.TestCase):
+    def test_writes_folded_stacks_of_the_job_thread(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, True)
+        logger = FakeLogger()
+
+        def busy_job():
+            deadline = time.monotonic() + 0.2
+            while time.monotonic() < deadline:
+                pass
+
+        with patch('app.JOB_PROFILER_DIR', temp_dir), patch('app.Logger', return_value=logger):
+            with StackSampler(7, threading.get_ident(), 0.005):
+                busy_job()
+
+        with open(os.path.join(temp_dir, 'job-7.folded')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(re.fullmatch(r'.+ \d+', line) for line in lines))
+        self.assertTrue(any('busy_job (test_metrics.py)' in line for line in lines))
+        self.assertTrue(logger.events[0].startswith('Profiler: '))
+
+
+if __name__ == '__main__':
+    unittest.main()
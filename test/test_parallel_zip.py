@@ -0,0 +1,146 @@
+import io
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+import app as app_module
+from app import FileOps, OperationProfile
+from parallel_zip import ParallelZipWriter, crc32_combine
+from fakes import FakeLogger
+
+
+class UnseekableWriter(io.RawIOBase):
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+
+class TestParallelZip(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context(app_module.ZIP_START_METHOD))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.files = {
+            'notes.txt': b'the quick brown fox jumps over the lazy dog\n' * 5000,
+            'Album_07/image_0186.jpg': os.urandom(70000),
+            'empty.csv': b'',
+            'Album_07/ñame.txt': b'unicode name',
+        }
+        for arcname, content in self.files.items():
+            path = os.path.join(self.temp_dir, arcname)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def write_archive(self, fileobj, **kwargs):
+        writer = ParallelZipWriter(fileobj, self.executor, 2, 32 * 1024, **kwargs)
+        entries = [(os.path.join(self.temp_dir, arcname), arcname,
+                    zipfile.ZIP_STORED if arcname.endswith('.jpg') else zipfile.ZIP_DEFLATED, 6)
+                   for arcname in self.files]
+        written = list(writer.write_entries(entries))
+        writer.close()
+        return written
+
+    def assert_archive(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual({name: zipf.read(name) for name in zipf.namelist()}, self.files)
+
+        zip_path = os.path.join(self.temp_dir, 'out.zip')
+        with open(zip_path, 'wb') as f:
+            f.write(data)
+        if shutil.which('unzip'):
+            result = subprocess.run(['unzip', '-t', zip_path], capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+
+    def test_app_pool_does_not_fork_the_server(self):
+        with patch.object(app_module, 'zip_executor', None):
+            executor = app_module.get_zip_executor()
+            self.addCleanup(executor.shutdown)
+            self.assertNotEqual(executor._mp_context.get_start_method(), 'fork')
+
+    def test_crc32_combine(self):
+        a, b = os.urandom(1000), os.urandom(123457)
+        self.assertEqual(crc32_combine(zlib.crc32(a), zlib.crc32(b), len(b)), zlib.crc32(a + b))
+        self.assertEqual(crc32_combine(zlib.crc32(a), 0, 0), zlib.crc32(a))
+        # Empty prefix
+        self.assertEqual(crc32_combine(zlib.crc32(b''), zlib.crc32(b), len(b)), zlib.crc32(b))
+        for length in (1, 2, 3, 7, 64, 1000, 1 << 20):
+            c = os.urandom(length)
+            self.assertEqual(crc32_combine(zlib.crc32(a), zlib.crc32(c), length), zlib.crc32(a + c))
+
+    def test_chunked_entries_form_valid_archive(self):
+        output = io.BytesIO()
+        written = self.write_archive(output)
+
+        self.assert_archive(output.getvalue())
+        # The text entry spans several chunks and still deflates as one stream
+        notes = written[0]
+        self.assertEqual(notes.file_size, len(self.files['notes.txt']))
+        self.assertLess(notes.compress_size, notes.file_size // 50)
+        self.assertEqual(written[1].compress_size, 70000)
+
+    def test_unseekable_output(self):
+        output = UnseekableWriter()
+        self.write_archive(output)
+        self.assert_archive(output.buffer.getvalue())
+
+    def test_zip64_records(self):
+        output = io.BytesIO()
+        self.write_archive(output, zip64_limit=1000)
+
+        data = output.getvalue()
+        self.assertIn(b'PK\x06\x06', data)
+        self.assert_archive(data)
+
+
+class TestFileOpsParallelZip(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.logger = FakeLogger()
+        self.file_ops = FileOps(OperationProfile('myremote_a', '/down', '/up'), self.logger, 1)
+        self.file_ops.temp_job_directory = self.temp_dir
+        for name, content in (('a.txt', b'abc' * 100000), ('b.mp4', os.urandom(1000))):
+            path = os.path.join(self.temp_dir, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.file_ops.downloaded_files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_zip_uses_process_pool(self):
+        with patch('app.ZIP_WORKERS', 2), patch('app.ZIP_CHUNK_SIZE', '64K'):
+            zip_path = self.file_ops.zip('token')
+
+        with zipfile.ZipFile(zip_path) as zipf:
+            self.assertIsNone(zipf.testzip())
+            self.assertEqual(zipf.read('a.txt'), b'abc' * 100000)
+            self.assertEqual(zipf.getinfo('b.mp4').compress_type, zipfile.ZIP_STORED)
+        self.assertTrue(any(e.startswith('Zipped a.txt using deflate-6: 300000 ->') for e in self.logger.events))
+        self.assertIn('Zipped b.mp4 using store: 1000 -> 1000 bytes (saved 0)', self.logger.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from app import ProfileRegistry
+
+
+class TestProfileRegistry(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.write_profile('profile_a.txt', "NAME=myremote_a\nPATH_DOWN=/remote/a\nPATH_UP=/remote/a_up\n")
+        self.write_profile('profile_b.txt', "NAME=myremote_b\nPATH_DOWN=/remote/b\nPATH_UP=/remote/b_up\nCONCURRENCY=8\n")
+        # No background watcher; tests drive reloads explicitly
+        self.registry = ProfileRegistry(self.profile_dir, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def write_profile(self, name, content):
+        path = os.path.join(self.profile_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_lookup_by_name(self):
+        profile = self.registry.get('myremote_b')
+        self.assertEqual(profile.download_path, '/remote/b')
+        self.assertEqual(profile.concurrency, 8)
+        self.assertIsNone(self.registry.get('nonexistent_server'))
+        self.assertEqual(self.registry.names(), ['myremote_a', 'myremote_b'])
+
+    def test_lookups_do_no_filesystem_io_after_load(self):
+        self.registry.get('myremote_a')
+
+        with patch('builtins.open', side_effect=AssertionError('profile file opened')), \
+                patch('os.walk', side_effect=AssertionError('profiles directory walked')):
+            for _ in range(100):
+                self.assertIsNotNone(self.registry.get('myremote_a'))
+
+        stats = self.registry.stats()
+        self.assertEqual(stats['lookups'], 101)
+        self.assertEqual(stats['reloads'], 1)
+
+    def test_reload_only_when_files_change(self):
+        self.registry.get('myremote_a')
+        self.assertFalse(self.registry.reload_if_changed())
+
+        path = self.write_profile('profile_a.txt', "NAME=myremote_a\nPATH_DOWN=/remote/moved\nPATH_UP=/remote/a_up\n")
+        os.utime(path, ns=(time.time_ns() + 10 ** 9, time.time_ns() + 10 ** 9))
+
+        self.assertTrue(self.registry.reload_if_changed())
+        self.assertEqual(self.registry.get('myremote_a').download_path, '/remote/moved')
+
+    def test_invalid_profiles_are_rejected_at_load(self):
+        self.write_profile('typo.txt', "NAME=myremote_c\nPATH_DOWN=/c\nPATH_UP=/c\nCONCURENCY=4\n")
+        self.write_profile('incomplete.txt', "NAME=myremote_d\nPATH_DOWN=/d\n")
+        # Files load in path order, so the earlier profile_a.txt keeps the name
+        self.write_profile('zz_duplicate.txt', "NAME=myremote_a\nPATH_DOWN=/x\nPATH_UP=/x\n")
+
+        self.assertIsNone(self.registry.get('myremote_c'))
+        self.assertIsNone(self.registry.get('myremote_d'))
+        self.assertEqual(self.registry.get('myremote_a').download_path, '/remote/a')
+
+        errors = self.registry.stats()['errors']
+        self.assertIn("unknown key 'CONCURENCY'", errors[os.path.join(self.profile_dir, 'typo.txt')])
+        self.assertIn('required', errors[os.path.join(self.profile_dir, 'incomplete.txt')])
+        self.assertIn('duplicate', errors[os.path.join(self.profile_dir, 'zz_duplicate.txt')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import gzip
+import json
+import os
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+import app as app_module
+from app import Retention, app, init_db
+from fixtures import ApiTestCase
+
+
+class TestRetention(ApiTestCase):
+    def retention(self, archive_dir=None, **policies):
+        return Retention(policies, 0, 3, 0, archive_dir, 2)
+
+    def add_history(self, count, age, status='completed'):
+        with self.db:
+            for _ in range(count):
+                request_id = self.db.execute("""
+                    INSERT INTO requests (timestamp, request_url, request_raw) VALUES (datetime('now', ?), '/submit_job', '{}')
+                """, (age,)).lastrowid
+                job_id = self.db.execute("""
+                    INSERT INTO jobs (request_id, timestamp, message, status) VALUES (?, datetime('now', ?), ?, ?)
+                """, (request_id, age, 'x' * 2000, status)).lastrowid
+                self.db.execute("INSERT INTO events (job_id, timestamp, message) VALUES (?, datetime('now', ?), 'event')", (job_id, age))
+
+    def count(self, table):
+        return self.db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    def test_prunes_rows_past_their_age_in_batches(self):
+        self.add_history(7, '-40 days')
+        self.add_history(1, '-40 days', status='in progress')
+        self.add_history(2, '-1 day')
+
+        deleted = self.retention(events={'days': 30}, jobs={'days': 30}, requests={'days': 30}).run_once(self.db)
+
+        self.assertEqual(deleted, {'events': 8, 'jobs': 7, 'requests': 7})
+        self.assertEqual(self.count('events'), 2)
+        # The running job and its request stay however old they are
+        self.assertEqual([row[0] for row in self.db.execute('SELECT status FROM jobs ORDER BY id')],
+                         ['in progress', 'completed', 'completed'])
+        self.assertEqual(self.db.execute('SELECT COUNT(*) FROM requests WHERE id = 8').fetchone()[0], 1)
+
+    def test_row_limit_keeps_the_newest_rows(self):
+        self.add_history(10, '-1 hour')
+        self.retention(events={'max_rows': 4}).run_once(self.db)
+        self.assertEqual([row[0] for row in self.db.execute('SELECT id FROM events ORDER BY id')], [7, 8, 9, 10])
+        self.assertEqual(self.count('jobs'), 10)
+
+    def test_rows_are_archived_before_they_are_deleted(self):
+        archive_dir = os.path.join(self.temp_dir, 'archive')
+        self.add_history(5, '-40 days')
+
+        self.retention(archive_dir, events={'days': 30}).run_once(self.db)
+
+        [name] = os.listdir(archive_dir)
+        self.assertTrue(name.startswith('events-') and name.endswith('.ndjson.gz'))
+        # One gzip member per batch, read back as a single stream
+        with gzip.open(os.path.join(archive_dir, name), 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row['job_id'] for row in rows], [1, 2, 3, 4, 5])
+        self.assertEqual(rows[0]['message'], 'event')
+
+    def test_payload_is_stored_once(self):
+        payload = {'files': {'12345_abc/a.jpg': 'a.jpg'}, 'server': 'myremote_a', 'token': 'token', 'auth': 'test-key'}
+        self.assertEqual(self.client.post('/submit_job', json=payload).status_code, 201)
+        self.assertIsNone(self.db.execute('SELECT request_raw FROM requests').fetchone()[0])
+
+        # Rows stored before requests dropped their copy are cleaned up by retention
+        with self.db:
+            self.db.execute("UPDATE requests SET request_raw = (SELECT message FROM jobs WHERE jobs.request_id = requests.id)")
+            self.db.execute("INSERT INTO requests (request_url, request_raw, response_status) VALUES ('/submit_job', '{\"files\": {}}', 400)")
+        retention = self.retention()
+        retention.run_once(self.db)
+
+        self.assertEqual([row[0] for row in self.db.execute('SELECT request_raw FROM requests ORDER BY id')], [None, '{"files": {}}'])
+        self.assertEqual(retention.stats()['deduped'], 1)
+
+    def test_freed_pages_are_returned_to_the_filesystem(self):
+        self.add_history(300, '-40 days')
+        size = os.path.getsize(self.database) + os.path.getsize(self.database + '-wal')
+        pages = self.db.execute('PRAGMA page_count').fetchone()[0]
+
+        self.retention(jobs={'days': 30}).run_once(self.db)
+
+        self.assertEqual(self.db.execute('PRAGMA freelist_count').fetchone()[0], 0)
+        self.assertLess(self.db.execute('PRAGMA page_count').fetchone()[0], pages / 2)
+        self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.assertLess(os.path.getsize(self.database), size / 2)
+
+    def test_existing_database_is_switched_to_incremental_vacuum_on_request(self):
+        self.assertEqual(self.db.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+
+        legacy = os.path.join(self.temp_dir, 'legacy.db')
+        db = sqlite3.connect(legacy)
+        db.execute('CREATE TABLE requests (id INTEGER PRIMARY KEY AUTOINCREMENT, request_raw TEXT)')
+        db.commit()
+        db.close()
+
+        def auto_vacuum():
+            db = sqlite3.connect(legacy)
+            try:
+                return db.execute('PRAGMA auto_vacuum').fetchone()[0]
+            finally:
+                db.close()
+
+        with patch.object(app_module, 'DATABASE', legacy):
+            # Starting up never runs the blocking VACUUM itself
+            init_db()
+            self.assertEqual(auto_vacuum(), 0)
+
+            result = app.test_cli_runner().invoke(args=['vacuum-db'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('VACUUM of', result.output)
+            self.assertEqual(auto_vacuum(), 2)
+            self.assertIn('already', app.test_cli_runner().invoke(args=['vacuum-db']).output)
+
+if __name__ == '__main__':
+    unittest.main()